@@ -1,7 +1,7 @@
 import os
 import yaml
-from pymongo import MongoClient
 from config.load_settings import load_settings
+from utils.mongo_utils import get_database, load_customer_with_devices, load_customers_with_devices
 
 def load_yaml(yaml_path: str) -> tuple:
     """Load device data from a YAML file."""
@@ -17,29 +17,34 @@ def load_yaml(yaml_path: str) -> tuple:
         return {}, None, None
 
 def load_mongodb(connection_string: str, database_name: str, customer_name: str) -> tuple:
-    """Load device data from a MongoDB collection."""
+    """Load a customer and its access and PE devices from MongoDB in a single round trip."""
     try:
-        client = MongoClient(connection_string)
-        db = client[database_name]
-        customers_collection = db['customers']
-        devices_collection = db['devices']
-        
-        customer_data = customers_collection.find_one({"name": customer_name})
+        db = get_database(connection_string, database_name)
+        customer_data, access_device_info, pe_device_info = load_customer_with_devices(db, customer_name)
         if not customer_data:
             print(f"Customer {customer_name} not found in MongoDB.")
             return {}, {}, {}
-
-        access_device_name = customer_data['customer_details']['devices']['access']['name']
-        pe_device_name = customer_data['customer_details']['devices']['pe']['name']
-        
-        access_device_info = devices_collection.find_one({"device_name": access_device_name})
-        pe_device_info = devices_collection.find_one({"device_name": pe_device_name})
-
         return customer_data, access_device_info, pe_device_info
     except Exception as e:
         print(f"Error loading data from MongoDB: {e}")
         return {}, {}, {}
 
+def load_all_customers_mongodb(connection_string: str, database_name: str) -> tuple:
+    """Load every customer with its devices in one aggregation for bulk operations. Returns (customers, devices keyed by name)."""
+    try:
+        db = get_database(connection_string, database_name)
+        customers = []
+        devices = {}
+        for customer_data, access_device_info, pe_device_info in load_customers_with_devices(db):
+            customers.append(customer_data)
+            for device_info in (access_device_info, pe_device_info):
+                if device_info:
+                    devices[device_info['device_name']] = device_info
+        return customers, devices
+    except Exception as e:
+        print(f"Error loading data from MongoDB: {e}")
+        return [], {}
+
 def load_devices(source: str, customer_name: str = None) -> tuple:
     """Load device data from the specified source (yaml or mongodb)."""
     if source == 'yaml':
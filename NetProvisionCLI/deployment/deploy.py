@@ -2,13 +2,13 @@ import paramiko
 import time
 import os
 import datetime
-import difflib
 import json
+import shutil
 from collections import defaultdict
 from typing import Optional, Dict, Any, List
 from influxdb_client import InfluxDBClient, Point
 from influxdb_client.client.write_api import SYNCHRONOUS
-from utils.file_utils import write_to_file, log_error, delete_error_log
+from utils.file_utils import write_to_file, log_error, delete_error_log, customer_output_dir
 from utils.validation import valid_ip_irb, valid_ip_nexthop, valid_ip_lan, interface_allowed
 from audit.audit_log import create_audit_log_entry, write_audit_log
 from audit.cleanup import check_for_error_logs
@@ -16,7 +16,11 @@ from security.auth import verify_user
 from utils.network_utils import get_current_user, get_ip_address
 from config.load_config import load_yaml, load_settings, load_devices, load_mongodb
 from utils.template_utils import render_template
+from utils.config_diff import section_diff
 from config.save_config import save_deployed_config
+from generation.manifest import new_outputs, mark_deployed
+from utils.mongo_utils import get_database
+from utils.deployment_summary import record_deployment, summary_document
 
 settings = load_settings()
 data_source = settings.get('data_source')
@@ -98,32 +102,44 @@ def compare_configurations(new_config: str, old_config_path: str) -> str:
         old_config = old_config_path.strip().replace('\r\n', '\n').split('\n')
 
     new_config_lines = new_config.strip().replace('\r\n', '\n').split('\n')
-    diff = list(difflib.unified_diff(old_config, new_config_lines, fromfile='old_config', tofile='new_config', lineterm=''))
+    diff = section_diff(old_config, new_config_lines, fromfile='old_config', tofile='new_config')
 
     return '\n'.join(diff) if diff else "No changes detected."
 
 def cleanup_generated_configs(customer_name: str):
     """Clean up generated configuration files for the customer."""
-    directory = 'generated_configs'
+    directory = customer_output_dir(customer_name)
+    if not os.path.isdir(directory):
+        return
     for file_name in os.listdir(directory):
-        if file_name.startswith(customer_name):
-            file_path = os.path.join(directory, file_name)
-            try:
-                os.remove(file_path)
-                print(f"Deleted generated config file: {file_path}")
-            except Exception as e:
-                print(f"Error deleting file {file_path}: {e}")
-
-def deploy_configurations(username: str, password: str, customer_name: str, device_names: dict) -> Optional[str]:
-    """Deploy configurations to specified devices for a customer."""
-    error_log = check_for_error_logs(customer_name)
-    if error_log:
-        return f"Deployment aborted due to config generation errors: {error_log['error_message']} (Error Code: {error_log['error_code']})"
-
-    if not verify_user(username, password):
+        file_path = os.path.join(directory, file_name)
+        try:
+            os.remove(file_path)
+            print(f"Deleted generated config file: {file_path}")
+        except Exception as e:
+            print(f"Error deleting file {file_path}: {e}")
+    shutil.rmtree(directory, ignore_errors=True)
+
+def deploy_configurations(username: str, password: str, customer_name: str, device_names: dict,
+                          rendered_configs: Optional[list] = None, devices: Optional[dict] = None,
+                          verified: bool = False) -> Optional[str]:
+    """Deploy configurations to specified devices for a customer.
+
+    When rendered_configs (RenderedConfig objects from generation.generate.render_customer) are given,
+    they are deployed as-is and generated_configs/ is neither read nor cleaned up. Bulk callers can also
+    pass a preloaded device inventory and skip re-verifying credentials for every customer.
+    """
+    if rendered_configs is None:
+        error_log = check_for_error_logs(customer_name, customer_output_dir(customer_name))
+        if error_log:
+            return f"Deployment aborted due to config generation errors: {error_log['error_message']} (Error Code: {error_log['error_code']})"
+
+    if not verified and not verify_user(username, password):
         return "Authentication failed. Check username and password."
 
-    if data_source == 'yaml':
+    if devices is not None:
+        pass
+    elif data_source == 'yaml':
         devices, _, _ = load_yaml('devices/network_devices.yaml')
     else:
         customer_data, access_device_info, pe_device_info = load_devices('mongodb', customer_name)
@@ -149,39 +165,57 @@ def deploy_configurations(username: str, password: str, customer_name: str, devi
 
     config_suffixes = ['config_remove', 'config', 'config_deactivate']
     all_configs = defaultdict(list)
-
-    for device_name, config_action in device_names.items():
-        if device_name not in devices:
-            print(f"Device {device_name} not found in device configuration.")
-            print("Available devices:", list(devices.keys()))  # Debug statement to list available devices
-            return f"Deployment aborted. Device not found: {device_name}"
-
-        for suffix in config_suffixes:
-            config_type = f"{config_action}_{suffix}.txt"
-            config_file_name = f"{customer_name}_{device_name}_{config_type}"
-            config_file_path = f"generated_configs/{config_file_name}"
-
-            if os.path.exists(config_file_path):
-                device_info = devices[device_name]
-                all_configs[device_name].append((config_file_path, device_info['ip_address'], device_info['device_type'], suffix))
-                print(f"Added configuration for {device_name}: {config_file_path}")
+    deployed_fingerprints = None
+
+    if rendered_configs is not None:
+        deployed_fingerprints = {}
+        for rendered in rendered_configs:
+            if rendered.device_name not in devices:
+                print(f"Device {rendered.device_name} not found in device configuration.")
+                return f"Deployment aborted. Device not found: {rendered.device_name}"
+            device_info = devices[rendered.device_name]
+            all_configs[rendered.device_name].append((f"{rendered.file_name} (rendered in memory)", device_info['ip_address'],
+                                                      device_info['device_type'], rendered.suffix, rendered.content, rendered.role))
+            deployed_fingerprints[rendered.file_name] = rendered.fingerprint
+            print(f"Added configuration for {rendered.device_name}: {rendered.file_name} (rendered in memory)")
+    else:
+        undeployed_outputs = set(new_outputs(customer_name))
+        for device_name, config_action in device_names.items():
+            if device_name not in devices:
+                print(f"Device {device_name} not found in device configuration.")
+                print("Available devices:", list(devices.keys()))  # Debug statement to list available devices
+                return f"Deployment aborted. Device not found: {device_name}"
+
+            for suffix in config_suffixes:
+                config_type = f"{config_action}_{suffix}.txt"
+                config_file_name = f"{customer_name}_{device_name}_{config_type}"
+                config_file_path = os.path.join(customer_output_dir(customer_name), config_file_name)
+
+                if os.path.exists(config_file_path):
+                    device_info = devices[device_name]
+                    with open(config_file_path, 'r') as file:
+                        configuration = file.read()
+                    all_configs[device_name].append((config_file_path, device_info['ip_address'], device_info['device_type'], suffix, configuration, config_action))
+                    status = "new since last deployment" if config_file_name in undeployed_outputs else "unchanged since last deployment"
+                    print(f"Added configuration for {device_name}: {config_file_path} ({status})")
 
     if not all_configs:
         return "Deployment aborted. No configuration files found."
 
+    if deployed_fingerprints is not None:
+        deployed_files = list(deployed_fingerprints)
+    else:
+        deployed_files = [os.path.basename(config[0]) for configs in all_configs.values() for config in configs]
     start_time = time.time()
     try:
         for device_name, configs in all_configs.items():
             previous_config_path = find_latest_config(customer_name, device_name, influx_client)  # Find the latest config before any changes
-            for config_file_path, ip_address, device_type, suffix in configs:
+            for config_file_path, ip_address, device_type, suffix, configuration, config_action in configs:
                 print(f"Deploying configuration for {device_name} from {config_file_path}")
                 try:
                     ssh_client.connect(ip_address, username=username, password=password, timeout=10)
                     channel = ssh_client.invoke_shell()
 
-                    with open(config_file_path, 'r') as file:
-                        configuration = file.read()
-
                     commands = prepare_device_commands(device_type, configuration)
                     for command in commands:
                         channel.send(command + '\n')
@@ -190,6 +224,7 @@ def deploy_configurations(username: str, password: str, customer_name: str, devi
                     ssh_client.close()
 
                 except paramiko.ssh_exception.SSHException as e:
+                    record_deployment_summary(deployment_id, customer_name, operator, list(all_configs), 'failed', start_time, str(e))
                     return f"Deployment failed for {device_name} with error: {str(e)}. Please retry the operation."
 
                 is_deactivate = suffix == 'config_deactivate'
@@ -214,7 +249,7 @@ def deploy_configurations(username: str, password: str, customer_name: str, devi
                         operator_ip=operator_ip,
                         device_name=device_name,
                         device_type=device_type,
-                        configuration_type=config_type.split('_')[0],
+                        configuration_type=config_action,
                         configuration_path=config_file_path,
                         deployed_config_path=deployed_config_path,
                         diff_results=diff_results,
@@ -224,19 +259,24 @@ def deploy_configurations(username: str, password: str, customer_name: str, devi
                     )
                     audit_entries.append(audit_entry)
 
+        mark_deployed(customer_name, deployed_files, deployed_fingerprints)
+
         if data_source == 'yaml':
             audit_path = write_audit_log(customer_name, audit_entries)
             print(f"Deployment completed successfully. Detailed audit log saved at: {audit_path}")
-            cleanup_generated_configs(customer_name)
+            if rendered_configs is None:
+                cleanup_generated_configs(customer_name)
         elif data_source == 'mongodb':
             write_api = influx_client.write_api(write_options=SYNCHRONOUS)
             for entry in audit_entries:
                 point = Point("audit_logs").tag("customer_name", customer_name).tag("deployment_id", deployment_id).field("entry", json.dumps(entry)).tag("operator", operator).time(datetime.datetime.utcnow(), write_precision='s')
                 write_api.write(bucket=influxdb_bucket, org=influxdb_org, record=point)
+            record_deployment_summary(deployment_id, customer_name, operator, list(all_configs), 'success', start_time)
 
-            print(f"=== Cleanup of temporary generated configs ===")
-            cleanup_generated_configs(customer_name)
-            print(f"=== End of cleanup ===")
+            if rendered_configs is None:
+                print(f"=== Cleanup of temporary generated configs ===")
+                cleanup_generated_configs(customer_name)
+                print(f"=== End of cleanup ===")
             print(f"Deployment issued by user {operator} for customer {customer_name} completed successfully in {time.time() - start_time:.2f} seconds.")
             print(f"Detailed audit log saved in InfluxDB under deployment ID {deployment_id}.")
             print(f"To check the audit log entries for this deployment, use: python netprovisioncli_commitdb.py --deployment-id {deployment_id}")
@@ -249,8 +289,21 @@ def deploy_configurations(username: str, password: str, customer_name: str, devi
 
     except Exception as e:
         ssh_client.close()
+        record_deployment_summary(deployment_id, customer_name, operator, list(all_configs), 'failed', start_time, str(e))
         return f"Deployment failed with an exception: {str(e)}"
 
+def record_deployment_summary(deployment_id: str, customer_name: str, operator: str, device_names: list, status: str,
+                              start_time: float, error: Optional[str] = None) -> None:
+    """Write the summary listed by commitdb --deployment-list (MongoDB data source); never fails the deployment."""
+    if data_source != 'mongodb':
+        return
+    try:
+        db = get_database(settings['mongodb_connection']['uri'], settings['mongodb_connection']['database_name'])
+        record_deployment(db, summary_document(deployment_id, customer_name, operator, device_names, status,
+                                               time.time() - start_time, datetime.datetime.utcnow(), error))
+    except Exception as e:
+        print(f"Warning: could not record the deployment summary: {e}")
+
 def prepare_device_commands(device_type: str, configuration: str) -> list:
     """Prepare device-specific deployment commands."""
     commands = {
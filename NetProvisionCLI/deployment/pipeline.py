@@ -0,0 +1,36 @@
+from typing import Optional, Dict, List, Tuple
+from generation.generate import render_customer, render_bulk
+from deployment.deploy import deploy_configurations
+from security.auth import verify_user
+
+def generate_and_deploy(username: str, password: str, service: dict, access_device_info: Optional[dict],
+                        pe_device_info: Optional[dict], deactivate: bool = False) -> Optional[str]:
+    """Render a customer's configurations in memory and deploy them in the same process, with no generated_configs/ files."""
+    error_message, rendered_configs = render_customer(service, access_device_info, pe_device_info, deactivate)
+    if error_message:
+        return f"Deployment aborted due to config generation errors: {error_message}"
+    devices = {
+        service['access_device']: access_device_info,
+        service['pe_device']: pe_device_info
+    }
+    return deploy_configurations(username, password, service['customer_name'], {}, rendered_configs=rendered_configs, devices=devices)
+
+def generate_and_deploy_bulk(username: str, password: str, services: List[dict], devices_config: Dict[str, dict],
+                             deactivate: bool = False, workers: Optional[int] = None) -> List[Tuple[str, Optional[str]]]:
+    """Render many customers in a process pool and deploy each one straight from memory.
+
+    Credentials are verified once for the whole batch. Returns a list of (customer_name, result) tuples,
+    where result is None on success or the deployment error message.
+    """
+    if not verify_user(username, password):
+        return [(service['customer_name'], "Authentication failed. Check username and password.") for service in services]
+
+    results = []
+    for customer_name, error_message, rendered_configs in render_bulk(services, devices_config, deactivate, workers):
+        if error_message:
+            results.append((customer_name, f"Deployment aborted due to config generation errors: {error_message}"))
+            continue
+        result = deploy_configurations(username, password, customer_name, {}, rendered_configs=rendered_configs,
+                                       devices=devices_config, verified=True)
+        results.append((customer_name, result))
+    return results
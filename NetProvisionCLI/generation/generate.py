@@ -0,0 +1,340 @@
+import os
+import glob
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, Any, List, Tuple
+from config.load_config import load_devices, load_recipe, load_all_customers_mongodb
+from utils.file_utils import write_to_file, log_error, delete_error_log, customer_output_dir
+from utils.validation import interface_allowed
+from utils.template_utils import render_template
+from generation.manifest import load_manifest, save_manifest, output_fingerprint, is_up_to_date, record_output
+
+ACCESS_DEACTIVATE_TYPES = ['cisco_xe', 'cisco_xr', 'juniper_junos', 'huawei_vrp', 'huawei_vrp_xpl']
+PE_DEACTIVATE_TYPES = ['cisco_xr', 'juniper_junos', 'huawei_vrp', 'huawei_vrp_xpl']
+ACCESS_ACTIVATE_TYPES = ['cisco_xe', 'huawei_vrp', 'huawei_vrp_xpl']
+PE_ACTIVATE_TYPES = ['cisco_xr', 'juniper_junos', 'huawei_vrp', 'huawei_vrp_xpl']
+SERVICE_TYPES = ['p2p', 'p2mp']
+
+SERVICE_FIELDS = ['customer_name', 'access_device', 'access_interface', 'circuit_id',
+                  'qos_input', 'qos_output', 'vlan_id', 'vlan_id_outer', 'pw_id',
+                  'irb_ipaddr', 'irb_ipv6addr', 'ipv4_lan', 'ipv4_nexthop',
+                  'ipv6_lan', 'ipv6_nexthop', 'pe_device', 'service_type']
+
+def service_from_recipe(recipe_data: dict) -> Dict[str, Any]:
+    """Map a customer recipe (YAML or JSON) to the flat service fields used for generation."""
+    customer = recipe_data['customer']
+    configuration = customer['configuration']
+    return {
+        'customer_name': customer['name'],
+        'access_device': customer['devices']['access']['name'],
+        'access_interface': customer['devices']['access']['interface'],
+        'circuit_id': configuration['circuit_id'],
+        'qos_input': configuration['qos']['input'],
+        'qos_output': configuration['qos']['output'],
+        'vlan_id': configuration['vlan']['id'],
+        'vlan_id_outer': configuration['vlan'].get('outer_id'),
+        'pw_id': configuration['pseudowire_id'],
+        'irb_ipaddr': configuration['irb']['ipv4_address'],
+        'irb_ipv6addr': configuration['irb']['ipv6_address'],
+        'ipv4_lan': configuration['lan']['ipv4']['network'],
+        'ipv4_nexthop': configuration['lan']['ipv4']['next_hop'],
+        'ipv6_lan': configuration['lan']['ipv6']['network'],
+        'ipv6_nexthop': configuration['lan']['ipv6']['next_hop'],
+        'pe_device': customer['devices']['pe']['name'],
+        'service_type': customer['service_type']
+    }
+
+def service_from_customer_document(customer_data: dict) -> Dict[str, Any]:
+    """Map a MongoDB customer document to the flat service fields used for generation."""
+    devices = customer_data['customer_details']['devices']
+    service_details = customer_data['customer_details']['service_details']
+    return {
+        'customer_name': customer_data['name'],
+        'access_device': devices['access']['name'],
+        'access_interface': devices['access']['interface'],
+        'circuit_id': service_details['circuit_id'],
+        'qos_input': service_details['qos_input'],
+        'qos_output': service_details['qos_output'],
+        'vlan_id': service_details['vlan_id'],
+        'vlan_id_outer': service_details['vlan_id_outer'],
+        'pw_id': service_details['pw_id'],
+        'irb_ipaddr': service_details['irb_ipaddr'],
+        'irb_ipv6addr': service_details['irb_ipv6addr'],
+        'ipv4_lan': service_details['ipv4_lan'],
+        'ipv4_nexthop': service_details['ipv4_nexthop'],
+        'ipv6_lan': service_details['ipv6_lan'],
+        'ipv6_nexthop': service_details['ipv6_nexthop'],
+        'pe_device': devices['pe']['name'],
+        'service_type': customer_data.get('service_type') or 'p2p'
+    }
+
+def validate_service_devices(service: dict, access_device_info: Optional[dict], pe_device_info: Optional[dict]) -> Optional[str]:
+    """Check device presence, interface, roles and provisioning flags. Returns an error message or None."""
+    access_device = service['access_device']
+    pe_device = service['pe_device']
+
+    if not access_device_info or not pe_device_info:
+        return "Device information is missing or incorrect. Please check the device names."
+
+    if not interface_allowed(access_device_info, service['access_interface']):
+        return f"The specified interface {service['access_interface']} on the Access device {access_device} is not allowed for customer configurations."
+
+    access_role = access_device_info.get('device_role')
+    pe_role = pe_device_info.get('device_role')
+    if access_role != 'access' and pe_role != 'pe':
+        return f"Incorrect device roles specified. The device '{access_device}' is assigned the role '{access_role}', but expected 'access'. The device '{pe_device}' is assigned the role '{pe_role}', but expected 'pe'."
+    if access_role != 'access':
+        return f"The specified Access device {access_device} has a role of {access_role}, not 'access'."
+    if pe_role != 'pe':
+        return f"The specified PE device {pe_device} has a role of {pe_role}, not 'pe'."
+
+    access_provisioning = access_device_info.get('customer_provisioning', False)
+    pe_provisioning = pe_device_info.get('customer_provisioning', False)
+    if not access_provisioning and not pe_provisioning:
+        return f"Customer provisioning is disabled for both specified devices, Access device {access_device} and PE device {pe_device}. Cannot proceed with configuration."
+    if not access_provisioning:
+        return f"Customer provisioning is disabled for the specified Access device {access_device}. Cannot proceed with configuration."
+    if not pe_provisioning:
+        return f"Customer provisioning is disabled for the specified PE device {pe_device}. Cannot proceed with configuration."
+    return None
+
+def select_templates(access_device_type: str, pe_device_type: str, service_type: str, deactivate: bool) -> Dict[str, str]:
+    """Pick the Jinja2 templates for each generated file. Raises ValueError for unsupported device types."""
+    if deactivate:
+        if access_device_type not in ACCESS_DEACTIVATE_TYPES:
+            raise ValueError(f"Unsupported Access device type: {access_device_type}")
+        if pe_device_type not in PE_DEACTIVATE_TYPES:
+            raise ValueError(f"Unsupported PE device type: {pe_device_type}")
+        return {
+            'access_config_deactivate': f"{access_device_type}_to_generic_deactivate.j2",
+            'pe_config_deactivate': f"{pe_device_type}_to_generic_deactivate.j2"
+        }
+
+    if access_device_type not in ACCESS_ACTIVATE_TYPES or service_type not in SERVICE_TYPES:
+        raise ValueError(f"Unsupported Access device type: {access_device_type}")
+    if pe_device_type not in PE_ACTIVATE_TYPES:
+        raise ValueError(f"Unsupported PE device type: {pe_device_type}")
+    return {
+        'access_config_remove': f"{service_type}_{access_device_type}_to_generic_remove.j2",
+        'pe_config_remove': f"{service_type}_{pe_device_type}_to_generic_remove.j2",
+        'access_config': f"{service_type}_{access_device_type}_to_generic.j2",
+        'pe_config': f"{service_type}_{pe_device_type}_to_generic.j2"
+    }
+
+def build_context(service: dict, access_device_info: dict, pe_device_info: dict) -> Dict[str, Any]:
+    """Build the Jinja2 rendering context for a customer service."""
+    return {
+        'customer_name': service['customer_name'],
+        'interface_name': service['access_interface'],
+        'service_instance_id': service['circuit_id'],
+        'qos_input': service['qos_input'],
+        'qos_output': service['qos_output'],
+        'vlan_id': service['vlan_id'],
+        'vlan_id_outer': service['vlan_id_outer'],
+        'pw_id': service['pw_id'],
+        'irb_ipaddr': service['irb_ipaddr'],
+        'irb_ipv6addr': service['irb_ipv6addr'],
+        'ipv4_lan': service['ipv4_lan'],
+        'ipv4_nexthop': service['ipv4_nexthop'],
+        'ipv6_lan': service['ipv6_lan'],
+        'ipv6_nexthop': service['ipv6_nexthop'],
+        'access_address': access_device_info['ip_address'],
+        'pe_address': pe_device_info['ip_address'],
+        'access_loopback': access_device_info['loopback'],
+        'pe_loopback': pe_device_info['loopback'],
+        'device_type': pe_device_info['device_type']
+    }
+
+def output_file_name(service: dict, output_key: str) -> str:
+    """Return the generated file name for an output key such as 'access_config_remove'."""
+    role = output_key.split('_', 1)[0]
+    device_name = service['access_device'] if role == 'access' else service['pe_device']
+    return f"{service['customer_name']}_{device_name}_{output_key}.txt"
+
+@dataclass
+class RenderedConfig:
+    """One rendered configuration for a device, ready to be written to disk or handed straight to deploy."""
+    customer_name: str
+    device_name: str
+    role: str
+    suffix: str
+    template_name: str
+    content: str
+    fingerprint: str
+
+    @property
+    def file_name(self) -> str:
+        return f"{self.customer_name}_{self.device_name}_{self.role}_{self.suffix}.txt"
+
+def render_customer(service: dict, access_device_info: Optional[dict], pe_device_info: Optional[dict],
+                    deactivate: bool = False) -> Tuple[Optional[str], List[RenderedConfig]]:
+    """Validate and render every configuration for a customer in memory, without touching generated_configs/.
+
+    Returns (error_message, rendered_configs); error_message is None on success.
+    """
+    error_message = validate_service_devices(service, access_device_info, pe_device_info)
+    if error_message:
+        return error_message, []
+    try:
+        templates = select_templates(access_device_info['device_type'], pe_device_info['device_type'],
+                                     service.get('service_type'), deactivate)
+        context = build_context(service, access_device_info, pe_device_info)
+        rendered_configs = []
+        for key, template_name in templates.items():
+            role, suffix = key.split('_', 1)
+            rendered_configs.append(RenderedConfig(
+                customer_name=service['customer_name'],
+                device_name=service['access_device'] if role == 'access' else service['pe_device'],
+                role=role,
+                suffix=suffix,
+                template_name=template_name,
+                content=render_template(template_name, context) + '\n',
+                fingerprint=output_fingerprint(context, template_name)
+            ))
+    except ValueError as e:
+        return str(e), []
+    except Exception as e:
+        return f"Failed to generate configurations due to: {str(e)}", []
+    return None, rendered_configs
+
+def _render_customer_job(job: Tuple[dict, Optional[dict], Optional[dict], bool]) -> Tuple[str, Optional[str], List[RenderedConfig]]:
+    """Process pool entry point for in-memory rendering."""
+    service, access_device_info, pe_device_info, deactivate = job
+    error_message, rendered_configs = render_customer(service, access_device_info, pe_device_info, deactivate)
+    return service['customer_name'], error_message, rendered_configs
+
+def render_bulk(services: List[dict], devices_config: Dict[str, dict], deactivate: bool = False,
+                workers: Optional[int] = None) -> List[Tuple[str, Optional[str], List[RenderedConfig]]]:
+    """Render many customers in a process pool and return the rendered objects instead of writing files."""
+    jobs = [(service, devices_config.get(service['access_device']), devices_config.get(service['pe_device']), deactivate)
+            for service in services]
+    if not jobs:
+        return []
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_render_customer_job, jobs, chunksize=chunksize))
+
+def generate_customer(service: dict, access_device_info: Optional[dict], pe_device_info: Optional[dict],
+                      deactivate: bool = False, directory: str = 'generated_configs', verbose: bool = False,
+                      force: bool = False) -> Tuple[Optional[str], List[str]]:
+    """Validate, render and write one customer's configurations into its own output directory.
+
+    Outputs whose context and template fingerprint match the generation manifest are skipped
+    unless force is set. Returns (error_message, written_file_names); error_message is None on success.
+    """
+    customer_name = service['customer_name']
+    output_dir = customer_output_dir(customer_name, directory)
+
+    error_message = validate_service_devices(service, access_device_info, pe_device_info)
+    if error_message:
+        log_error(output_dir, customer_name, error_message, 400)
+        return error_message, []
+
+    try:
+        templates = select_templates(access_device_info['device_type'], pe_device_info['device_type'],
+                                     service.get('service_type'), deactivate)
+    except ValueError as e:
+        return str(e), []
+
+    context = build_context(service, access_device_info, pe_device_info)
+    manifest = load_manifest(customer_name)
+    written = []
+    try:
+        for key, template_name in templates.items():
+            file_name = output_file_name(service, key)
+            fingerprint = output_fingerprint(context, template_name)
+            if not force and is_up_to_date(manifest.get(file_name), fingerprint, os.path.join(output_dir, file_name)):
+                continue
+            write_to_file(output_dir, file_name, render_template(template_name, context) + '\n', verbose=verbose)
+            record_output(manifest, file_name, fingerprint, template_name)
+            written.append(file_name)
+    except Exception as e:
+        error_message = f"Failed to generate configurations due to: {str(e)}"
+        log_error(output_dir, customer_name, error_message, 500)
+        return error_message, written
+    finally:
+        if written:
+            save_manifest(customer_name, manifest)
+
+    delete_error_log(output_dir, customer_name)
+    return None, written
+
+def _generate_customer_job(job: Tuple[dict, Optional[dict], Optional[dict], bool, str, bool]) -> Tuple[str, Optional[str], List[str]]:
+    """Process pool entry point; never raises so one bad customer cannot abort the batch."""
+    service, access_device_info, pe_device_info, deactivate, directory, force = job
+    try:
+        error_message, written = generate_customer(service, access_device_info, pe_device_info, deactivate, directory, force=force)
+        return service['customer_name'], error_message, written
+    except Exception as e:
+        return service['customer_name'], f"Failed to generate configurations due to: {str(e)}", []
+
+def generate_bulk(services: List[dict], devices_config: Dict[str, dict], deactivate: bool = False,
+                  directory: str = 'generated_configs', workers: Optional[int] = None,
+                  force: bool = False) -> List[Tuple[str, Optional[str], List[str]]]:
+    """Generate configurations for many customers in a process pool using an inventory loaded once by the caller.
+
+    Returns a list of (customer_name, error_message, written_file_names) tuples; error_message is None on success.
+    """
+    results = []
+    jobs = []
+    seen = set()
+    for service in services:
+        customer_name = service['customer_name']
+        if customer_name in seen:
+            results.append((customer_name, "Duplicate customer in this batch; skipped.", []))
+            continue
+        seen.add(customer_name)
+        jobs.append((service, devices_config.get(service['access_device']), devices_config.get(service['pe_device']),
+                     deactivate, directory, force))
+
+    if not jobs:
+        return results
+
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results.extend(executor.map(_generate_customer_job, jobs, chunksize=chunksize))
+    return results
+
+def find_recipe_files(patterns: List[str]) -> List[str]:
+    """Expand recipe globs into a sorted, de-duplicated list of YAML/JSON recipe files."""
+    recipe_files = set()
+    for pattern in patterns:
+        for path in glob.glob(pattern):
+            if path.endswith(('.yaml', '.yml', '.json')):
+                recipe_files.add(path)
+    return sorted(recipe_files)
+
+def load_services(data_source: str, settings: dict, recipe_patterns: Optional[List[str]] = None) -> Tuple[List[dict], Dict[str, dict], List[Tuple[str, str]]]:
+    """Load every customer service for a bulk run together with the device inventory, each loaded once.
+
+    MongoDB customers come from the customers collection; with YAML, services come from recipe files
+    (recipes/customers/ by default). Returns (services, devices_config, failures).
+    """
+    services = []
+    failures = []
+    if data_source == 'mongodb':
+        customers, devices_config = load_all_customers_mongodb(settings['mongodb_connection']['uri'],
+                                                              settings['mongodb_connection']['database_name'])
+        for customer_data in customers:
+            try:
+                services.append(service_from_customer_document(customer_data))
+            except (KeyError, TypeError) as e:
+                failures.append((customer_data.get('name', 'Unknown'), f"Incomplete customer record, missing {e}"))
+    else:
+        devices_config, _, _ = load_devices('yaml')
+        patterns = recipe_patterns or ['recipes/customers/*.yaml', 'recipes/customers/*.yml', 'recipes/customers/*.json']
+        seen = set()
+        for recipe_file in find_recipe_files(patterns):
+            try:
+                service = service_from_recipe(load_recipe(recipe_file))
+            except (KeyError, TypeError) as e:
+                failures.append((recipe_file, f"Invalid recipe, missing {e}"))
+                continue
+            if service['customer_name'] in seen:
+                failures.append((recipe_file, f"Duplicate recipe for customer {service['customer_name']}; skipped."))
+                continue
+            seen.add(service['customer_name'])
+            services.append(service)
+    return services, devices_config, failures
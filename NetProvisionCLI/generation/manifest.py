@@ -0,0 +1,72 @@
+import os
+import json
+import hashlib
+import datetime
+from typing import Optional, Dict, Any, List
+from utils.file_utils import write_to_file
+from utils.template_utils import get_template_digest
+
+MANIFEST_DIR = 'generation_manifest'
+
+def output_fingerprint(context: dict, template_name: str) -> str:
+    """Hash a rendering context together with the template source (and its included templates)."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(context, sort_keys=True, default=str).encode())
+    digest.update(get_template_digest(template_name).encode())
+    return digest.hexdigest()
+
+def load_manifest(customer_name: str, directory: str = MANIFEST_DIR) -> Dict[str, Dict[str, Any]]:
+    """Load a customer's generation manifest, keyed by generated file name."""
+    manifest_path = os.path.join(directory, f"{customer_name}.json")
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(customer_name: str, manifest: Dict[str, Dict[str, Any]], directory: str = MANIFEST_DIR) -> None:
+    """Atomically replace a customer's generation manifest."""
+    write_to_file(directory, f"{customer_name}.json", json.dumps(manifest, indent=4, sort_keys=True), verbose=False)
+
+def is_up_to_date(entry: Dict[str, Any], fingerprint: str, output_path: str) -> bool:
+    """An output can be skipped only when its fingerprint is unchanged and the file is still on disk.
+
+    Deployed outputs are cleaned up after a deployment, so they are rendered again; deployed_hash only labels
+    outputs as new or unchanged since the last deployment.
+    """
+    if not entry or entry.get('hash') != fingerprint:
+        return False
+    return os.path.exists(output_path)
+
+def record_output(manifest: Dict[str, Dict[str, Any]], file_name: str, fingerprint: str, template_name: str) -> None:
+    """Record a freshly rendered output in the manifest."""
+    entry = manifest.setdefault(file_name, {})
+    entry['hash'] = fingerprint
+    entry['template'] = template_name
+    entry['generated_at'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def new_outputs(customer_name: str, directory: str = MANIFEST_DIR) -> List[str]:
+    """Return the generated file names whose current content has not been deployed yet."""
+    manifest = load_manifest(customer_name, directory)
+    return sorted(file_name for file_name, entry in manifest.items() if entry.get('hash') != entry.get('deployed_hash'))
+
+def mark_deployed(customer_name: str, file_names: List[str], fingerprints: Optional[Dict[str, str]] = None,
+                  directory: str = MANIFEST_DIR) -> None:
+    """Record that the current version of the given outputs has been pushed to the devices.
+
+    Outputs rendered in memory never went through the manifest, so their fingerprints are passed in directly.
+    """
+    manifest = load_manifest(customer_name, directory)
+    if not manifest and not fingerprints:
+        return
+    deployed_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for file_name in file_names:
+        if fingerprints and file_name in fingerprints:
+            manifest.setdefault(file_name, {})['hash'] = fingerprints[file_name]
+        entry = manifest.get(file_name)
+        if entry:
+            entry['deployed_hash'] = entry.get('hash')
+            entry['deployed_at'] = deployed_at
+    save_manifest(customer_name, manifest, directory)
@@ -2,11 +2,21 @@ import argparse
 import yaml
 import json
 import getpass
-from pymongo import MongoClient
+from utils.mongo_utils import get_database
 from prettytable import PrettyTable
 import bcrypt
 import glob
-import ipaddress
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pymongo import UpdateOne
+from utils.prefix_index import (PrefixIndex, PREFIX_FIELDS, PREFIX_COLLECTION, prefix_documents, find_persisted_conflict,
+                                ensure_prefix_collection, sync_customer_prefixes, remove_customer_prefixes, rebuild_prefix_collection,
+                                mark_prefix_collection)
+from utils.validation import find_interface_violations
+from utils.schema import ensure_indexes, check_schema
+from utils.resource_allocator import ResourceAllocator, RESOURCE_LABELS, AUTO, reset_allocations
+from utils.prefix_pool import PrefixPoolAllocator, define_pool, rebuild_pools, parse_auto
+from utils.discovery import load_templates, init_discovery_worker, discover_device_job, build_customers
 
 def load_settings():
     """Load settings from the settings.yaml file."""
@@ -77,8 +87,11 @@ def validate_and_transform_customer_data(customer_data):
     }
     return transformed_data
 
-def check_for_conflicts(customers_collection, customer_data):
-    """Check for conflicts in VLAN ID, Pseudowire ID, Circuit ID, IRB IP addresses, and customer LAN routes."""
+def check_for_conflicts(customers_collection, customer_data, prefix_index=None):
+    """Check for conflicts in VLAN ID, Pseudowire ID, Circuit ID, IRB IP addresses, and customer LAN routes.
+
+    Prefix overlaps are looked up in an in-memory PrefixIndex when one is given, otherwise in the persisted customer_prefixes collection.
+    """
     service_details = customer_data['customer_details']['service_details']
     devices = customer_data['customer_details']['devices']
 
@@ -114,65 +127,13 @@ def check_for_conflicts(customers_collection, customer_data):
     if circuit_id_conflict:
         return f"Conflict: Circuit ID {service_details['circuit_id']} on {devices['access']['name']} {devices['access']['interface']} is already in use by customer {circuit_id_conflict['name']}."
 
-    # Check IRB IPv4 address
-    irb_ipv4_conflicts = customers_collection.find({
-        'customer_details.service_details.irb_ipaddr': {'$exists': True},
-        'name': {'$ne': customer_data['name']}
-    })
-    for conflict in irb_ipv4_conflicts:
-        existing_network = ipaddress.ip_network(conflict['customer_details']['service_details']['irb_ipaddr'], strict=False)
-        new_network = ipaddress.ip_network(service_details['irb_ipaddr'], strict=False)
-        if new_network.overlaps(existing_network):
-            if new_network == existing_network:
-                return f"Conflict: IRB IPv4 address {service_details['irb_ipaddr']} is already in use by customer {conflict['name']}."
-            else:
-                return f"Conflict: IRB IPv4 prefix {service_details['irb_ipaddr']} overlaps with {conflict['customer_details']['service_details']['irb_ipaddr']} owned by customer {conflict['name']}."
-
-    # Check IRB IPv6 address
-    irb_ipv6_conflicts = customers_collection.find({
-        'customer_details.service_details.irb_ipv6addr': {'$exists': True},
-        'name': {'$ne': customer_data['name']}
-    })
-    for conflict in irb_ipv6_conflicts:
-        existing_network = ipaddress.ip_network(conflict['customer_details']['service_details']['irb_ipv6addr'], strict=False)
-        new_network = ipaddress.ip_network(service_details['irb_ipv6addr'], strict=False)
-        if new_network.overlaps(existing_network):
-            if new_network == existing_network:
-                return f"Conflict: IRB IPv6 address {service_details['irb_ipv6addr']} is already in use by customer {conflict['name']}."
-            else:
-                return f"Conflict: IRB IPv6 prefix {service_details['irb_ipv6addr']} overlaps with {conflict['customer_details']['service_details']['irb_ipv6addr']} owned by customer {conflict['name']}."
-
-    # Check IPv4 LAN route
-    ipv4_lan_conflicts = customers_collection.find({
-        'customer_details.service_details.ipv4_lan': {'$exists': True},
-        'name': {'$ne': customer_data['name']}
-    })
-    for conflict in ipv4_lan_conflicts:
-        existing_network = ipaddress.ip_network(conflict['customer_details']['service_details']['ipv4_lan'], strict=False)
-        new_network = ipaddress.ip_network(service_details['ipv4_lan'], strict=False)
-        if new_network.overlaps(existing_network):
-            if new_network == existing_network:
-                return f"Conflict: IPv4 LAN route {service_details['ipv4_lan']} is already in use by customer {conflict['name']}."
-            else:
-                return f"Conflict: IPv4 LAN prefix {service_details['ipv4_lan']} overlaps with {conflict['customer_details']['service_details']['ipv4_lan']} owned by customer {conflict['name']}."
-
-    # Check IPv6 LAN route
-    ipv6_lan_conflicts = customers_collection.find({
-        'customer_details.service_details.ipv6_lan': {'$exists': True},
-        'name': {'$ne': customer_data['name']}
-    })
-    for conflict in ipv6_lan_conflicts:
-        existing_network = ipaddress.ip_network(conflict['customer_details']['service_details']['ipv6_lan'], strict=False)
-        new_network = ipaddress.ip_network(service_details['ipv6_lan'], strict=False)
-        if new_network.overlaps(existing_network):
-            if new_network == existing_network:
-                return f"Conflict: IPv6 LAN route {service_details['ipv6_lan']} is already in use by customer {conflict['name']}."
-            else:
-                return f"Conflict: IPv6 LAN prefix {service_details['ipv6_lan']} overlaps with {conflict['customer_details']['service_details']['ipv6_lan']} owned by customer {conflict['name']}."
-
-    return None
-
-def add_or_update_customer(connection_string, database_name, recipe_file):
+    # Check IRB IPv4/IPv6 addresses and IPv4/IPv6 LAN routes against the prefix index
+    if prefix_index is not None:
+        return prefix_index.find_conflict(customer_data['name'], service_details)
+    return find_persisted_conflict(customers_collection.database, customer_data['name'], service_details)
+
+def load_recipe_file(recipe_file):
+    """Load a customer recipe from a YAML or JSON file and transform it to the stored structure."""
     if recipe_file.endswith('.yaml') or recipe_file.endswith('.yml'):
         with open(recipe_file, 'r') as file:
             customer_data = yaml.safe_load(file)['customer']
@@ -182,14 +143,33 @@ def add_or_update_customer(connection_string, database_name, recipe_file):
     else:
         raise ValueError("Unsupported file format. Use .yaml, .yml, or .json")
 
-    customer_data = validate_and_transform_customer_data(customer_data)
+    return validate_and_transform_customer_data(customer_data)
+
+def add_or_update_customer(connection_string, database_name, recipe_file, pools=None):
+    customer_data = load_recipe_file(recipe_file)
 
-    client = MongoClient(connection_string)
-    db = client[database_name]
+    db = get_database(connection_string, database_name)
     customers_collection = db['customers']
+    ensure_prefix_collection(db)
+
+    existing = customers_collection.find_one({'name': customer_data['name']})
+    allocator = ResourceAllocator(db, pools)
+    pool_allocator = PrefixPoolAllocator(db)
+    devices = customer_data['customer_details']['devices']
+    allocated, error = allocator.resolve_auto(customer_data, existing)
+    if error:
+        print(error)
+        return
+    allocated_prefixes, error = pool_allocator.resolve_auto(customer_data, existing)
+    if error:
+        allocator.release_all(allocated, devices)
+        print(error)
+        return
 
     conflict_message = check_for_conflicts(customers_collection, customer_data)
     if conflict_message:
+        allocator.release_all(allocated, devices)
+        pool_allocator.release_all(allocated_prefixes, devices['pe']['name'])
         print(conflict_message)
         return
 
@@ -198,18 +178,250 @@ def add_or_update_customer(connection_string, database_name, recipe_file):
         {'$set': customer_data},
         upsert=True
     )
+    sync_customer_prefixes(db, customer_data['name'], customer_data['customer_details']['service_details'])
+    allocator.sync_customer(existing, customer_data)
+    pool_allocator.sync_customer(existing, customer_data)
 
+    for resource, value in allocated + allocated_prefixes:
+        print(f"Allocated {resource} {value} to customer {customer_data['name']}.")
     if result.upserted_id:
         print(f"Customer {customer_data['name']} added.")
     else:
         print(f"Customer {customer_data['name']} updated.")
 
+def _parse_recipe_job(recipe_file):
+    """Worker entry point: returns (recipe_file, customer_data, error)."""
+    try:
+        return recipe_file, load_recipe_file(recipe_file), None
+    except (OSError, ValueError, KeyError, TypeError, AttributeError, yaml.YAMLError) as e:
+        return recipe_file, None, f"Invalid recipe: {e!r}"
+
+class BatchConflictIndex:
+    """VLAN, pseudowire, circuit and prefix allocations of existing customers plus those accepted so far in a batch."""
+
+    def __init__(self):
+        self.vlans = {}
+        self.circuits = {}
+        self.pseudowires = {}
+        self.prefixes = PrefixIndex()
+
+    @staticmethod
+    def _keys(customer_data):
+        """(map, key, entry) for each VLAN, circuit and pseudowire allocation of a customer."""
+        name = customer_data['name']
+        devices = customer_data['customer_details']['devices']
+        service_details = customer_data['customer_details']['service_details']
+        access_name, access_interface = devices['access']['name'], devices['access'].get('interface')
+        pe_name = devices['pe']['name']
+        owner = (name, access_name, pe_name)
+        return [('vlans', (access_name, access_interface, service_details.get('vlan_id')), name),
+                ('circuits', (access_name, access_interface, service_details.get('circuit_id')), name),
+                ('pseudowires', ('access', access_name, service_details.get('pw_id')), owner),
+                ('pseudowires', ('pe', pe_name, service_details.get('pw_id')), owner)]
+
+    def add(self, customer_data):
+        name = customer_data['name']
+        service_details = customer_data['customer_details']['service_details']
+        for attribute, key, entry in self._keys(customer_data):
+            getattr(self, attribute).setdefault(key, []).append(entry)
+        for field in PREFIX_FIELDS:
+            prefix = service_details.get(field)
+            if not prefix:
+                continue
+            try:
+                self.prefixes.add(field, prefix, name)
+            except ValueError:
+                continue
+
+    def remove(self, customer_data):
+        """Drop a customer's allocations, e.g. the stored ones of a customer the batch replaces."""
+        for attribute, key, entry in self._keys(customer_data):
+            entries = getattr(self, attribute).get(key, [])
+            if entry in entries:
+                entries.remove(entry)
+        self.prefixes.remove_owner(customer_data['name'])
+
+    def find_conflict(self, customer_data):
+        """Same checks and messages as check_for_conflicts, answered from the in-memory maps."""
+        name = customer_data['name']
+        devices = customer_data['customer_details']['devices']
+        service_details = customer_data['customer_details']['service_details']
+        access_name, access_interface = devices['access']['name'], devices['access']['interface']
+        pe_name = devices['pe']['name']
+
+        for owner in self.vlans.get((access_name, access_interface, service_details['vlan_id']), []):
+            if owner != name:
+                return f"Conflict: VLAN ID {service_details['vlan_id']} on {access_name} {access_interface} is already in use by customer {owner}."
+
+        for key in (('access', access_name, service_details['pw_id']), ('pe', pe_name, service_details['pw_id'])):
+            for owner, owner_access, owner_pe in self.pseudowires.get(key, []):
+                if owner != name:
+                    return f"Conflict: Pseudowire ID {service_details['pw_id']} is already in use by customer {owner} on access device {owner_access} or PE device {owner_pe}."
+
+        for owner in self.circuits.get((access_name, access_interface, service_details['circuit_id']), []):
+            if owner != name:
+                return f"Conflict: Circuit ID {service_details['circuit_id']} on {access_name} {access_interface} is already in use by customer {owner}."
+
+        return self.prefixes.find_conflict(name, service_details)
+
+def bulk_import_customers(connection_string, database_name, recipe_files, workers=None, pools=None):
+    """Parse recipes in parallel, check them against the database and each other in one pass, and upsert the valid ones with a single bulk_write."""
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(recipe_files) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parsed = list(executor.map(_parse_recipe_job, recipe_files, chunksize=chunksize))
+    return import_customer_batch(connection_string, database_name, parsed, pools=pools)
+
+def import_customer_batch(connection_string, database_name, parsed, pools=None, overwrite=True):
+    """Check (source, customer_data, error) entries against the database and each other in one pass, and upsert the valid ones with a single bulk_write.
+
+    Without overwrite, entries naming an existing customer are rejected instead of replacing it.
+    """
+    db = get_database(connection_string, database_name)
+    customers_collection = db['customers']
+    ensure_prefix_collection(db)
+
+    conflicts = BatchConflictIndex()
+    existing_customers = {}
+    for customer in customers_collection.find({}, {'name': 1, 'customer_details': 1}):
+        conflicts.add(customer)
+        existing_customers[customer['name']] = customer
+    allocator = ResourceAllocator(db, pools)
+    batch_has_auto = any(customer_data and AUTO in customer_data['customer_details']['service_details'].values()
+                         for _source, customer_data, _error in parsed)
+    pool_allocator = PrefixPoolAllocator(db)
+    batch_has_auto_prefix = any(customer_data and any(parse_auto(customer_data['customer_details']['service_details'].get(field)) is not None
+                                                      for field in PREFIX_FIELDS)
+                                for _source, customer_data, _error in parsed)
+    devices_config = {device['device_name']: device for device in db['devices'].find({}, {'_id': 0})}
+    # Every access interface of the batch is checked against the inventory in one pass.
+    access_pairs = {(customer_data['customer_details']['devices']['access']['name'], customer_data['customer_details']['devices']['access']['interface'])
+                    for _source, customer_data, error in parsed if not error}
+    interface_violations = {(device_name, interface_name): reason
+                            for device_name, interface_name, reason in find_interface_violations(devices_config, sorted(access_pairs))}
+
+    rejected = []
+    accepted = []
+    seen = {}
+    for source, customer_data, error in parsed:
+        if error:
+            rejected.append((source, error))
+            continue
+        name = customer_data['name']
+        if name in seen:
+            rejected.append((source, f"Duplicate customer {name}, already defined in {seen[name]}."))
+            continue
+        if not overwrite and name in existing_customers:
+            rejected.append((source, f"Customer {name} already exists."))
+            continue
+        devices = customer_data['customer_details']['devices']
+        violation = interface_violations.get((devices['access']['name'], devices['access']['interface']))
+        if violation is None and devices['pe']['name'] not in devices_config:
+            violation = f"Device {devices['pe']['name']} not found in the inventory."
+        if violation:
+            rejected.append((source, violation))
+            continue
+        allocated, conflict_message = allocator.resolve_auto(customer_data, existing_customers.get(name))
+        allocated_prefixes = []
+        if not conflict_message:
+            allocated_prefixes, conflict_message = pool_allocator.resolve_auto(customer_data, existing_customers.get(name))
+            if conflict_message:
+                allocator.release_all(allocated, devices)
+        if not conflict_message:
+            try:
+                conflict_message = conflicts.find_conflict(customer_data)
+            except (KeyError, ValueError) as e:
+                conflict_message = f"Invalid recipe: {e!r}"
+            if conflict_message:
+                allocator.release_all(allocated, devices)
+                pool_allocator.release_all(allocated_prefixes, devices['pe']['name'])
+        if conflict_message:
+            rejected.append((source, conflict_message))
+            continue
+        if batch_has_auto:
+            # Later 'auto' recipes in this batch must not be handed an ID this one chose explicitly.
+            service_details = customer_data['customer_details']['service_details']
+            for resource in RESOURCE_LABELS:
+                if (resource, service_details[resource]) not in allocated:
+                    allocator.reserve(resource, devices, service_details[resource])
+        if batch_has_auto_prefix:
+            service_details = customer_data['customer_details']['service_details']
+            for field in PREFIX_FIELDS:
+                if service_details.get(field) and (field, service_details[field]) not in allocated_prefixes:
+                    pool_allocator.reserve(field, devices['pe']['name'], service_details[field])
+        seen[name] = source
+        if name in existing_customers:
+            # Values the stored customer gives up are free for later recipes in the batch.
+            conflicts.remove(existing_customers[name])
+        conflicts.add(customer_data)
+        accepted.append(customer_data)
+
+    if accepted:
+        result = customers_collection.bulk_write(
+            [UpdateOne({'name': customer_data['name']}, {'$set': customer_data}, upsert=True) for customer_data in accepted],
+            ordered=False
+        )
+        names = [customer_data['name'] for customer_data in accepted]
+        db[PREFIX_COLLECTION].delete_many({'customer': {'$in': names}})
+        documents = [document for customer_data in accepted
+                     for document in prefix_documents(customer_data['name'], customer_data['customer_details']['service_details'])]
+        if documents:
+            db[PREFIX_COLLECTION].insert_many(documents, ordered=False)
+        mark_prefix_collection(db)
+        touched = accepted + [existing_customers[name] for name in names if name in existing_customers]
+        allocator.invalidate(touched)
+        rebuild_pools(db, sorted({customer['customer_details']['devices']['pe']['name'] for customer in touched}))
+        print(f"Imported {len(accepted)} customers ({result.upserted_count} added, {len(accepted) - result.upserted_count} updated).")
+    else:
+        print("No customers imported.")
+
+    if rejected:
+        print(f"Rejected {len(rejected)} entries:")
+        for source, reason in rejected:
+            print(f"  {source}: {reason}")
+    return accepted, rejected
+
+def discover_customers(connection_string, database_name, settings, workers=None, pools=None):
+    """Infer customers from the latest stored configuration of every inventory device and import them as one batch.
+
+    Devices are parsed in parallel; services already managed as customers are left untouched.
+    """
+    db = get_database(connection_string, database_name)
+    inventory = {device['device_name']: device for device in db['devices'].find({}, {'_id': 0})}
+    templates = load_templates()
+    jobs = [(device_name, device['device_type'], settings) for device_name, device in sorted(inventory.items())
+            if device.get('device_role') in ('access', 'pe') and device.get('device_type') in templates]
+    if not jobs:
+        print("No inventory devices with a discovery template.")
+        return [], []
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_discovery_worker, initargs=(templates,)) as executor:
+        results = list(executor.map(discover_device_job, jobs, chunksize=chunksize))
+
+    discovered = {}
+    parsed = []
+    for device_name, facts, error in results:
+        if error:
+            parsed.append((device_name, None, f"Discovery failed: {error}"))
+        else:
+            discovered[device_name] = facts
+    customers, problems = build_customers(discovered, inventory)
+    print(f"Discovered {len(customers)} services on {len(discovered)} devices.")
+    parsed.extend((source, None, problem) for source, problem in problems)
+    parsed.extend((source, customer_data, None) for source, customer_data in customers)
+    return import_customer_batch(connection_string, database_name, parsed, pools=pools, overwrite=False)
+
 def remove_customer(connection_string, database_name, customer_name):
-    client = MongoClient(connection_string)
-    db = client[database_name]
+    db = get_database(connection_string, database_name)
     customers_collection = db['customers']
 
+    existing = customers_collection.find_one({'name': customer_name})
     result = customers_collection.delete_one({'name': customer_name})
+    remove_customer_prefixes(db, customer_name)
+    if existing:
+        ResourceAllocator(db).sync_customer(existing, None)
+        PrefixPoolAllocator(db).sync_customer(existing, None)
     if result.deleted_count > 0:
         print(f"Customer {customer_name} removed.")
     else:
@@ -225,8 +437,7 @@ def add_or_update_device(connection_string, database_name, device_file):
     else:
         raise ValueError("Unsupported file format. Use .yaml, .yml, or .json")
 
-    client = MongoClient(connection_string)
-    db = client[database_name]
+    db = get_database(connection_string, database_name)
     devices_collection = db['devices']
 
     for device_name, device_details in device_data.items():
@@ -241,8 +452,7 @@ def add_or_update_device(connection_string, database_name, device_file):
             print(f"Device {device_name} updated.")
 
 def remove_device(connection_string, database_name, device_name):
-    client = MongoClient(connection_string)
-    db = client[database_name]
+    db = get_database(connection_string, database_name)
     devices_collection = db['devices']
 
     result = devices_collection.delete_one({'device_name': device_name})
@@ -269,6 +479,15 @@ def main():
     parser.add_argument("--device", type=str, action='append', help="Path to a YAML or JSON file containing the device details (can specify multiple).")
     parser.add_argument("--remove", action='store_true', help="Flag to remove a customer or device.")
     parser.add_argument("--customer", type=str, help="Customer name to query, add, or remove.")
+    parser.add_argument("--bulk", action='store_true', help="Import all --recipe files in one batch: parse in parallel, check conflicts in one pass and write with a single bulk_write.")
+    parser.add_argument("--discover", action='store_true', help="Infer customers from the latest stored device configurations and import the ones not yet managed.")
+    parser.add_argument("--workers", type=int, help="Number of worker processes for parsing recipes with --bulk or configurations with --discover (default: number of CPUs).")
+    parser.add_argument("--init-schema", action='store_true', help="Create the MongoDB indexes used by the CLI (safe to re-run).")
+    parser.add_argument("--check-schema", action='store_true', help="Report missing indexes and hot queries that scan collections.")
+    parser.add_argument("--rebuild-allocations", action='store_true', help="Discard the VLAN/pseudowire/circuit ID bitmaps so they are rebuilt from the customers collection.")
+    parser.add_argument("--prefix-pools", type=str, help="Path to a YAML file defining IRB/LAN prefix pools per PE or region.")
+    parser.add_argument("--rebuild-prefix-pools", action='store_true', help="Rebuild the free blocks of every prefix pool from the customers collection.")
+    parser.add_argument("--rebuild-prefix-index", action='store_true', help="Rebuild the persisted prefix index from the customers collection. Run it after editing customers outside netprovisioncli_admin.py; only a changed customer count is picked up automatically.")
     args = parser.parse_args()
 
     if args.password:
@@ -279,11 +498,47 @@ def main():
     if not authenticated:
         return
 
-    if args.recipe:
+    if args.init_schema:
+        errors = ensure_indexes(get_database(connection_string, database_name))
+        for error in errors:
+            print(f"Could not create index {error}")
+        if not errors:
+            print("Schema initialized.")
+
+    if args.check_schema:
+        check_schema(get_database(connection_string, database_name))
+
+    if args.rebuild_allocations:
+        reset_allocations(get_database(connection_string, database_name))
+        print("Resource allocations will be rebuilt on next use.")
+
+    if args.prefix_pools:
+        with open(args.prefix_pools, 'r') as file:
+            pool_definitions = yaml.safe_load(file).get('prefix_pools', [])
+        db = get_database(connection_string, database_name)
+        for definition in pool_definitions:
+            print(define_pool(db, definition))
+
+    if args.rebuild_prefix_pools:
+        count = rebuild_pools(get_database(connection_string, database_name))
+        print(f"Rebuilt {count} prefix pools.")
+
+    if args.rebuild_prefix_index:
+        db = get_database(connection_string, database_name)
+        count = rebuild_prefix_collection(db)
+        print(f"Prefix index rebuilt with {count} prefixes.")
+
+    if args.discover:
+        discover_customers(connection_string, database_name, settings, workers=args.workers, pools=settings.get('resource_pools'))
+
+    if args.recipe and args.bulk:
+        recipe_files = sorted({recipe_file for recipe_pattern in args.recipe for recipe_file in glob.glob(recipe_pattern)})
+        bulk_import_customers(connection_string, database_name, recipe_files, workers=args.workers, pools=settings.get('resource_pools'))
+    elif args.recipe:
         for recipe_pattern in args.recipe:
             recipe_files = glob.glob(recipe_pattern)
             for recipe_file in recipe_files:
-                add_or_update_customer(connection_string, database_name, recipe_file)
+                add_or_update_customer(connection_string, database_name, recipe_file, pools=settings.get('resource_pools'))
 
     if args.customer and args.remove:
         remove_customer(connection_string, database_name, args.customer)
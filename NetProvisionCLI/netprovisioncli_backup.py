@@ -2,7 +2,7 @@ import os
 import json
 import argparse
 import datetime
-from pymongo import MongoClient
+from utils.mongo_utils import get_database
 from bson import ObjectId
 from influxdb_client import InfluxDBClient
 
@@ -29,8 +29,7 @@ class CustomJSONEncoder(json.JSONEncoder):
         return super().default(obj)
 
 def export_mongodb_data(connection_string, database_name, output_file):
-    client = MongoClient(connection_string)
-    db = client[database_name]
+    db = get_database(connection_string, database_name)
     
     customers = list(db['customers'].find({}))
     devices = list(db['devices'].find({}))
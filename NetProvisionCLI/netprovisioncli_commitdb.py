@@ -1,9 +1,11 @@
 import argparse
 from influxdb_client import InfluxDBClient
 import json
-import difflib
-from datetime import datetime
+from datetime import datetime, timezone
 from utils.network_utils import get_current_user
+from utils.config_diff import section_diff
+from utils.mongo_utils import get_database
+from utils.deployment_summary import list_summaries, summaries_from_audit_logs, rebuild_summaries, DEFAULT_PAGE_SIZE
 
 def load_settings():
     """Load settings from the settings.yaml file."""
@@ -38,54 +40,26 @@ def query_audit_log(deployment_id, influxdb_url, influxdb_token, influxdb_org, i
         print(f"No audit log entry found for deployment ID: {deployment_id}")
     return entries
 
-def list_deployments(influxdb_url, influxdb_token, influxdb_org, influxdb_bucket, customer=None, timeframe=None, last=None):
+def list_deployments(connection_string, database_name, customer=None, timeframe=None, last=None, cursor=None):
+    """One page of deployment summaries (newest first) and the cursor of the next page."""
+    db = get_database(connection_string, database_name)
+    return list_summaries(db, customer=customer, date=timeframe, limit=last or DEFAULT_PAGE_SIZE, cursor=cursor)
+
+def rebuild_deployment_summaries(connection_string, database_name, influxdb_url, influxdb_token, influxdb_org, influxdb_bucket):
+    """Rebuild deployment_summaries from the full audit_logs history, for deployments made before summaries were recorded."""
     client = InfluxDBClient(url=influxdb_url, token=influxdb_token, org=influxdb_org)
-    
     query = f'''
     from(bucket: "{influxdb_bucket}")
-    |> range(start: -30d)
-    |> filter(fn: (r) => r._measurement == "audit_logs")
+    |> range(start: 0)
+    |> filter(fn: (r) => r._measurement == "audit_logs" and r._field == "entry")
     '''
-    
-    if customer:
-        query += f'''|> filter(fn: (r) => r.customer_name == "{customer}")\n'''
-    
-    if timeframe:
-        start_time = f"{timeframe}T00:00:00Z"
-        end_time = f"{timeframe}T23:59:59Z"
-        query += f'''|> filter(fn: (r) => r._time >= {start_time} and r._time <= {end_time})\n'''
-
-    query += '''
-    |> keep(columns: ["deployment_id", "_time", "customer_name", "operator"])
-    |> sort(columns: ["_time"], desc: true)
-    |> unique(column: "deployment_id")
-    '''
-    
-    query += '''|> limit(n: 500)\n'''  # Apply a default limit of 500 to avoid overwhelming the query results
-
-    # print(f"Query: {query}")  # Debugging: Print the query
-
-    result = client.query_api().query(query=query, org=influxdb_org)
-    
-    deployments = []
-    if result:
-        for table in result:
-            for record in table.records:
-                # print(f"Record: {record.values}")  # Debugging: Print the record values
-                deployments.append({
-                    "deployment_id": record["deployment_id"],
-                    "timestamp": record.get_time().strftime('%Y-%m-%d %H:%M:%S'),
-                    "customer_name": record["customer_name"],
-                    "operator": record.values.get("operator", "N/A")  # Handle missing operator field
-                })
-    else:
-        print("No deployments found.")
-
-    # Apply the limit if the --last argument is provided
-    if last:
-        deployments = deployments[:last]
-
-    return deployments
+    records = []
+    for table in client.query_api().query(query=query, org=influxdb_org):
+        for record in table.records:
+            timestamp = record.get_time().astimezone(timezone.utc).replace(tzinfo=None)
+            records.append((timestamp, record.values["deployment_id"], record.values["customer_name"],
+                            record.values.get("operator", "N/A"), json.loads(record.get_value())))
+    return rebuild_summaries(get_database(connection_string, database_name), summaries_from_audit_logs(records))
 
 def diff_check(deployment_id1, deployment_id2, influxdb_url, influxdb_token, influxdb_org, influxdb_bucket):
     entries1 = query_audit_log(deployment_id1, influxdb_url, influxdb_token, influxdb_org, influxdb_bucket)
@@ -96,10 +70,7 @@ def diff_check(deployment_id1, deployment_id2, influxdb_url, influxdb_token, inf
         return
     
     for entry1, entry2 in zip(entries1, entries2):
-        config1 = entry1['deployed_config_path'].splitlines()
-        config2 = entry2['deployed_config_path'].splitlines()
-        
-        diff = difflib.unified_diff(config2, config1, fromfile=deployment_id1, tofile=deployment_id2)
+        diff = section_diff(entry2['deployed_config_path'], entry1['deployed_config_path'], fromfile=deployment_id1, tofile=deployment_id2)
         print('\n'.join(diff))
 
 def main():
@@ -108,14 +79,18 @@ def main():
     influxdb_token = settings['influxdb']['token']
     influxdb_org = settings['influxdb']['org']
     influxdb_bucket = settings['influxdb']['bucket']
+    connection_string = settings['mongodb_connection']['uri']
+    database_name = settings['mongodb_connection']['database_name']
 
     parser = argparse.ArgumentParser(description="Query InfluxDB for audit log entries.")
     parser.add_argument("--customer", type=str, help="Filter deployments by customer name.")
     parser.add_argument("--deployment-id", type=str, help="Deployment ID to query the audit log entry.")
-    parser.add_argument("--deployment-list", action='store_true', help="List the last 500 deployments.")
+    parser.add_argument("--deployment-list", action='store_true', help=f"List deployments, newest first, {DEFAULT_PAGE_SIZE} per page.")
     parser.add_argument("--diff-check", nargs=2, metavar=('DEPLOYMENT_ID1', 'DEPLOYMENT_ID2'), help="Display the differences between two deployment IDs.")
     parser.add_argument("--timeframe", type=str, help="Filter deployments by date (YYYY-MM-DD).")
     parser.add_argument("--last", type=int, help="List the last N deployments.")
+    parser.add_argument("--cursor", type=str, help="Continue a deployment listing from the cursor printed at the end of the previous page.")
+    parser.add_argument("--rebuild-summaries", action='store_true', help="Rebuild the deployment summaries from the full audit log history.")
 
     args = parser.parse_args()
 
@@ -124,12 +99,26 @@ def main():
         if entries:
             for entry in entries:
                 print(json.dumps(entry, indent=4))
-    elif args.deployment_list or args.customer or args.timeframe or args.last:
-        deployments = list_deployments(influxdb_url, influxdb_token, influxdb_org, influxdb_bucket, args.customer, args.timeframe, args.last)
-        print(f"{'Deployment ID':<20} {'Timestamp':<30} {'Customer Name':<20} {'Operator':<20}")
-        print("="*90)
+    elif args.deployment_list or args.customer or args.timeframe or args.last or args.cursor:
+        try:
+            deployments, next_cursor = list_deployments(connection_string, database_name, args.customer, args.timeframe, args.last, args.cursor)
+        except ValueError as e:
+            print(f"Invalid --timeframe or --cursor: {e}")
+            return
+        if not deployments:
+            print("No deployments found.")
+            return
+        print(f"{'Deployment ID':<20} {'Timestamp':<22} {'Customer Name':<20} {'Operator':<15} {'Status':<8} {'Duration':<10} {'Devices'}")
+        print("="*120)
         for deployment in deployments:
-            print(f"{deployment['deployment_id']:<20} {deployment['timestamp']:<30} {deployment['customer_name']:<20} {deployment['operator']:<20}")
+            duration = f"{deployment['duration']:.2f}s" if deployment.get('duration') is not None else 'N/A'
+            print(f"{deployment['deployment_id']:<20} {deployment['timestamp'].strftime('%Y-%m-%d %H:%M:%S'):<22} {deployment['customer_name']:<20} "
+                  f"{deployment['operator']:<15} {deployment['status']:<8} {duration:<10} {', '.join(deployment['devices'])}")
+        if next_cursor and not args.last:
+            print(f"More deployments: --cursor {next_cursor}")
+    elif args.rebuild_summaries:
+        count = rebuild_deployment_summaries(connection_string, database_name, influxdb_url, influxdb_token, influxdb_org, influxdb_bucket)
+        print(f"Rebuilt {count} deployment summaries.")
     elif args.diff_check:
         diff_check(args.diff_check[0], args.diff_check[1], influxdb_url, influxdb_token, influxdb_org, influxdb_bucket)
     else:
@@ -1,21 +1,73 @@
 import argparse
 import getpass
+from config.load_settings import load_settings
+from config.load_config import load_devices, load_recipe
 from deployment.deploy import deploy_configurations
+from deployment.pipeline import generate_and_deploy, generate_and_deploy_bulk
+from generation.generate import service_from_recipe, service_from_customer_document, load_services
+
+def deploy_generated(args, settings):
+    """Render the configurations in memory and deploy them without the generated_configs/ file roundtrip."""
+    data_source = settings['data_source']
+
+    if args.all or args.recipes:
+        services, devices_config, failures = load_services(data_source, settings, args.recipes)
+        results = generate_and_deploy_bulk(args.username, args.password, services, devices_config, args.deactivate, args.workers)
+        failures.extend((name, result) for name, result in results if result)
+        print(f"Summary: {len(results) - sum(1 for _, result in results if result)} customers deployed successfully.")
+        if failures:
+            print(f"{len(failures)} customers failed:")
+            for name, reason in failures:
+                print(f"Customer: {name}, Reason: {reason}")
+        return
+
+    if data_source == 'mongodb':
+        customer_data, access_device_info, pe_device_info = load_devices('mongodb', customer_name=args.customer_name)
+        if not customer_data:
+            print(f"Customer {args.customer_name} not found in MongoDB.")
+            return
+        service = service_from_customer_document(customer_data)
+    else:
+        if not args.recipe:
+            print("A --recipe is required to generate and deploy in one step with the YAML data source.")
+            return
+        service = service_from_recipe(load_recipe(args.recipe))
+        devices_config, _, _ = load_devices('yaml')
+        access_device_info = devices_config.get(service['access_device'])
+        pe_device_info = devices_config.get(service['pe_device'])
+
+    result = generate_and_deploy(args.username, args.password, service, access_device_info, pe_device_info, args.deactivate)
+    print(result)
 
 def main():
     parser = argparse.ArgumentParser(description="Network Configuration Deployment")
-    parser.add_argument("--customer-name", required=True, help="Customer name to identify config files")
+    parser.add_argument("--customer-name", help="Customer name to identify config files")
     parser.add_argument("--username", required=True, help="Username for SSH and credential verification")
     parser.add_argument("--password", help="(Optional) Password for SSH and credential verification", type=str)
-    parser.add_argument("--access-device", required=True, help="Hostname of the access device")
-    parser.add_argument("--pe-device", required=True, help="Hostname of the PE device")
+    parser.add_argument("--access-device", help="Hostname of the access device")
+    parser.add_argument("--pe-device", help="Hostname of the PE device")
     parser.add_argument("--deactivate", action='store_true', help="Deploy only the removal configurations")
+    parser.add_argument("--generate", action='store_true', help="Render the configurations in memory and deploy them in the same run, without writing or reading generated_configs/.")
+    parser.add_argument("--recipe", type=str, help="With --generate and the YAML data source, the recipe file describing the customer.")
+    parser.add_argument("--recipes", type=str, nargs='+', help="With --generate, globs of recipe files to generate and deploy in bulk.")
+    parser.add_argument("--all", action='store_true', help="With --generate, generate and deploy every customer (MongoDB) or every recipe under recipes/customers (YAML).")
+    parser.add_argument("--workers", type=int, help="Number of worker processes used to render configurations in bulk.")
 
     args = parser.parse_args()
 
+    if args.generate:
+        if not (args.all or args.recipes or args.recipe or args.customer_name):
+            parser.error("--generate needs --customer-name, --recipe, --recipes or --all")
+    elif not (args.customer_name and args.access_device and args.pe_device):
+        parser.error("the following arguments are required: --customer-name, --access-device, --pe-device")
+
     if not args.password:
         args.password = getpass.getpass(prompt="Password: ")
 
+    if args.generate:
+        deploy_generated(args, load_settings())
+        return
+
     device_configurations = {
         args.access_device: 'access' if not args.deactivate else 'remove',
         args.pe_device: 'pe' if not args.deactivate else 'remove'
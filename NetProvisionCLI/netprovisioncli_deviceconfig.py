@@ -3,33 +3,51 @@ import os
 import paramiko
 from paramiko import SSHException
 import yaml
+import re
 import bcrypt
 import socket
 from getpass import getpass
-from pymongo import MongoClient
+from utils.mongo_utils import get_database
+from utils.config_archive import (spool_config, store_config_file, load_config_file, find_config_file, config_file_digest, config_digest,
+                                  latest_digest_file, read_blob_file)
+from utils.backup_catalog import record_backup, latest_config_path, backup_history, rebuild_catalog, get_catalog, timestamp_from_name, backups_around
+from utils.backup_scheduler import (change_indicator_command, parse_change_indicator, load_state, save_state, schedule_devices,
+                                    due_devices, record_check, now_timestamp, DEFAULT_INTERVAL, DEFAULT_JITTER)
+from utils.config_history import store_version_stream, load_document_config, load_latest_config, diff_documents, document_changes, DEFAULT_KEYFRAME_INTERVAL, LIVE
+from utils.config_retention import run_retention, expire_documents, retention_settings
+from utils.schema import ensure_indexes
+from utils.config_diff import section_diff, config_changes
+from utils.compliance import load_rules, check_config, DEFAULT_RULES_PATH
+from utils.config_drift import line_hashes, missing_lines, latest_deployed_files, latest_deployed_influxdb
+from utils.config_search import get_search_index, latest_indexed, index_version, reset_search_index, search
 from datetime import datetime, timedelta, timezone
 from influxdb_client import InfluxDBClient, Point, WritePrecision, QueryApi
 from influxdb_client.client.write_api import SYNCHRONOUS
 from prettytable import PrettyTable
-from difflib import unified_diff
 import logging
 import traceback
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
 logging.getLogger("paramiko").setLevel(logging.WARNING)
 
+DEFAULT_BACKUP_WORKERS = 16
+DEFAULT_BACKUP_TIMEOUT = 30
+CONFIG_CHUNK_SIZE = 64 * 1024
+CUTOFF_FORMATS = ['%Y-%m-%d_%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d']
+
 # Helper function to read YAML settings
 def read_yaml(file_path):
     with open(file_path, 'r') as file:
         return yaml.safe_load(file)
 
-# Helper function to fetch device configuration
-def fetch_device_config(device_details, username, password):
+# Helper function to open an SSH session to a device
+def open_ssh(device_details, username, password, timeout=DEFAULT_BACKUP_TIMEOUT):
     ip = device_details['ip_address']
-    device_type = device_details['device_type']
     ssh = paramiko.SSHClient()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
     try:
-        ssh.connect(ip, username=username, password=password, timeout=10)
+        ssh.connect(ip, username=username, password=password, timeout=timeout, banner_timeout=timeout, auth_timeout=timeout)
     except paramiko.ssh_exception.NoValidConnectionsError:
         print(f"Error: Unable to connect to {ip}. Please check the network connectivity and SSH settings. This could be transient, please retry.")
         return None
@@ -42,52 +60,80 @@ def fetch_device_config(device_details, username, password):
     except Exception as e:
         print(f"Error: {str(e)}. This could be transient, please retry.")
         return None
-    
+    return ssh
+
+# Helper function to run a show command on an open session
+def run_command(ssh, command, timeout=DEFAULT_BACKUP_TIMEOUT):
+    stdin, stdout, stderr = ssh.exec_command(command, timeout=timeout)
+    return stdout.read().decode()
+
+# Helper function to pick the command that prints the running configuration
+def config_command(device_type):
+    if device_type in ['cisco_ios', 'cisco_xe', 'cisco_xr']:
+        return "show running-config"
+    elif device_type == 'juniper_junos':
+        return "show configuration | display set | no-more"
+    elif device_type == 'huawei_vrp':
+        return "display current-configuration"
+    raise ValueError(f"Unsupported device type {device_type}")
+
+# Yield the running configuration in chunks as it arrives on the SSH channel; the whole read must finish
+# within timeout seconds, so a device that keeps sending slowly cannot hold a backup worker
+def stream_running_config(ssh, device_details, timeout=DEFAULT_BACKUP_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    device_type = device_details['device_type']
+    if device_type == 'juniper_junos':
+        ssh.exec_command("set cli screen-length 0")
+    stdin, stdout, stderr = ssh.exec_command(config_command(device_type), timeout=timeout)
+    # Read the channel directly: stdout.read(size) waits for a full chunk, restarting the timeout on every recv
+    channel = stdout.channel
     try:
-        if device_type in ['cisco_ios', 'cisco_xe', 'cisco_xr']:
-            command = "show running-config"
-        elif device_type == 'juniper_junos':
-            ssh.exec_command("set cli screen-length 0")
-            command = "show configuration | display set | no-more"
-        elif device_type == 'huawei_vrp':
-            command = "display current-configuration"
-        stdin, stdout, stderr = ssh.exec_command(command)
-        config = stdout.read().decode()
-    except Exception as e:
-        print(f"Error: Failed to fetch configuration from {ip}. Please check the command and the device response.")
-        logging.error(f"Error fetching configuration from {ip}: {traceback.format_exc()}")
-        return None
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{device_details['ip_address']} did not send its configuration within {timeout} seconds")
+            channel.settimeout(remaining)
+            try:
+                chunk = channel.recv(CONFIG_CHUNK_SIZE)
+            except socket.timeout:
+                raise TimeoutError(f"{device_details['ip_address']} did not send its configuration within {timeout} seconds")
+            if not chunk:
+                break
+            yield chunk
     finally:
-        ssh.close()
-    return config
+        channel.close()
+
+# Helper function to report a failed configuration read
+def report_fetch_error(device_details):
+    ip = device_details['ip_address']
+    print(f"Error: Failed to fetch configuration from {ip}. Please check the command and the device response.")
+    logging.error(f"Error fetching configuration from {ip}: {traceback.format_exc()}")
 
-# Helper function to store configuration in YAML
-def store_config_yaml(device_name, config):
+# Helper function to store configuration in YAML; config is text or an iterable of byte chunks streamed from the device
+def store_config_yaml(device_name, config, device_type=None):
     if config:
-        directory = 'device_configs'
-        os.makedirs(directory, exist_ok=True)
-        timestamp = datetime.now().strftime('%Y-%m-%d_%H_%M_%S')
-        file_path = os.path.join(directory, f'{device_name}-config-{timestamp}.txt')
-        with open(file_path, 'w') as file:
-            file.write(config)
-        print(f"Configuration for {device_name} saved to {file_path}")
-        return file_path
-
-# Helper function to store configuration in MongoDB
-def store_config_mongodb(device_name, config, mongo_uri, db_name):
+        stored = store_config_file(device_name, config, device_type)
+        if stored is None:
+            return None
+        if stored['changed']:
+            print(f"Configuration for {device_name} saved to {stored['path']}")
+        else:
+            print(f"Configuration for {device_name} unchanged, recorded {stored['path']}")
+        return stored['path']
+
+# Helper function to store configuration in MongoDB; config is text or an iterable of byte chunks streamed from the device
+def store_config_mongodb(device_name, config, mongo_uri, db_name, device_type=None, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
     if config:
-        client = MongoClient(mongo_uri)
-        db = client[db_name]
-        collection = db['deviceConfig']
-        timestamp = datetime.now(timezone.utc)
-        document = {
-            "device_name": device_name,
-            "config": config,
-            "timestamp": timestamp
-        }
-        collection.insert_one(document)
-        client.close()
-        print(f"Configuration for {device_name} stored in MongoDB")
+        stream, spool = spool_config(config, device_type)
+        with spool:
+            if not stream.raw_size:
+                return None
+            db = get_database(mongo_uri, db_name)
+            document = store_version_stream(db, device_name, spool, stream.digest, stream.size, keyframe_interval)
+        if not document['changed']:
+            print(f"Configuration for {device_name} unchanged, recorded pointer to version {document['version']} in MongoDB")
+        else:
+            print(f"Configuration for {device_name} stored in MongoDB as version {document['version']} ({document['kind']})")
         return None
 
 # Helper function to log audit in YAML
@@ -98,11 +144,15 @@ def log_audit_yaml(device_name, operation, user, duration, config_file_path):
     log_path = os.path.join(directory, f'BACKUP_{device_name}_{timestamp}.txt')
     with open(log_path, 'w') as file:
         file.write(f"Device: {device_name}\nOperation: {operation}\nUser: {user}\nDuration: {duration}s\nConfig File: {config_file_path}\n")
+    config_timestamp = timestamp_from_name(os.path.basename(config_file_path)) if config_file_path else timestamp
+    record_backup(device_name, config_timestamp, operation, user, duration, config_file_path, log_path)
     print(f"Audit log for {device_name} written to {log_path}")
 
 # Helper function to log audit in InfluxDB
-def log_audit_influxdb(device_name, operation, user, duration, influx_settings):
-    client = InfluxDBClient(url=influx_settings['url'], token=influx_settings['token'], org=influx_settings['org'])
+def log_audit_influxdb(device_name, operation, user, duration, influx_settings, client=None):
+    owns_client = client is None
+    if owns_client:
+        client = InfluxDBClient(url=influx_settings['url'], token=influx_settings['token'], org=influx_settings['org'])
     write_api = client.write_api(write_options=SYNCHRONOUS)
     point = Point("deviceConfigBackup") \
         .tag("device", device_name) \
@@ -111,69 +161,46 @@ def log_audit_influxdb(device_name, operation, user, duration, influx_settings):
         .field("duration", duration) \
         .time(datetime.now(timezone.utc), WritePrecision.NS)
     write_api.write(bucket=influx_settings['bucket'], org=influx_settings['org'], record=point)
-    client.close()
+    if owns_client:
+        client.close()
     print(f"Audit log for {device_name} written to InfluxDB")
 
 # Helper function to display configuration from YAML
 def display_config_yaml(device_name, date=None):
-    directory = 'device_configs'
-    if not os.path.exists(directory):
-        print(f"No configuration files found for {device_name}.")
-        return
-    files = [f for f in os.listdir(directory) if f.startswith(f"{device_name}-config-")]
-    if date:
-        files = [f for f in files if date in f]
-    if not files:
-        print(f"No configuration files found for {device_name} on date {date}.")
+    config_path = latest_config_path(device_name, date)
+    if not config_path:
+        if date:
+            print(f"No configuration files found for {device_name} on date {date}.")
+        else:
+            print(f"No configuration files found for {device_name}.")
         return
-    latest_file = max(files, key=lambda x: os.path.getctime(os.path.join(directory, x)))
-    with open(os.path.join(directory, latest_file), 'r') as file:
-        print(file.read())
+    print(load_config_file(config_path))
 
 # Helper function to display configuration from MongoDB
 def display_config_mongodb(device_name, mongo_uri, db_name, date=None):
-    client = MongoClient(mongo_uri)
-    db = client[db_name]
+    db = get_database(mongo_uri, db_name)
     collection = db['deviceConfig']
-    query = {"device_name": device_name}
+    query = {"device_name": device_name, **LIVE}
     if date:
         start_date = datetime.strptime(date, "%Y-%m-%d")
         end_date = start_date + timedelta(days=1)
         query["timestamp"] = {"$gte": start_date, "$lt": end_date}
     document = collection.find_one(query, sort=[("timestamp", -1)])
-    client.close()
     if document:
-        print(document["config"])
+        print(load_document_config(db, document))
     else:
         print(f"No configuration found for {device_name} in MongoDB on date {date}.")
 
 # Helper function to display audit history from YAML
 def display_audit_history_yaml(last=None, date=None, device=None):
-    directory = 'audit_logs'
-    if not os.path.exists(directory):
-        print("No audit logs found.")
-        return
-    files = [f for f in os.listdir(directory) if f.startswith("BACKUP_")]
-    if date:
-        files = [f for f in files if date in f]
-    if device:
-        files = [f for f in files if f'BACKUP_{device}_' in f]
-    if last:
-        files = sorted(files, key=lambda x: os.path.getctime(os.path.join(directory, x)), reverse=True)[:last]
-    if not files:
+    rows = backup_history(last, date, device)
+    if not rows:
         print("No audit logs found.")
         return
     table = PrettyTable(["Device", "Operation", "Date and Time", "Operator", "Config File"])
     table._max_width = {"Device": 20, "Operation": 20, "Date and Time": 20, "Operator": 20, "Config File": None}
-    for file in files:
-        with open(os.path.join(directory, file), 'r') as f:
-            lines = f.readlines()
-            device = lines[0].split(":")[1].strip() if len(lines) > 0 else "N/A"
-            operation = lines[1].split(":")[1].strip() if len(lines) > 1 else "N/A"
-            date_time = file.split("_")[2] + "_" + file.split("_")[3].split(".")[0]
-            operator = lines[2].split(":")[1].strip() if len(lines) > 2 else "N/A"
-            config_filename = lines[4].split(":")[1].strip() if len(lines) > 4 else "N/A"
-            table.add_row([device, operation, date_time, operator, config_filename])
+    for device_name, operation, timestamp, operator, config_path in rows:
+        table.add_row([device_name, operation, timestamp, operator or "N/A", config_path or "N/A"])
     table.max_width = 80
     print(table)
 
@@ -237,55 +264,384 @@ def diff_check(device1, timestamp1, device2, timestamp2, settings):
     timestamp1_dt = datetime.strptime(timestamp1, '%Y-%m-%d_%H:%M:%S')
     timestamp2_dt = datetime.strptime(timestamp2, '%Y-%m-%d_%H:%M:%S')
     if data_source == 'yaml':
-        file1 = f"device_configs/{device1}-config-{timestamp1}.txt"
-        file2 = f"device_configs/{device2}-config-{timestamp2}.txt"
-        if not os.path.exists(file1) or not os.path.exists(file2):
+        file1 = find_config_file(device1, timestamp1)
+        file2 = find_config_file(device2, timestamp2)
+        if not file1 or not file2:
             print(f"Error: One or both of the specified configuration files do not exist.")
             return
-        with open(file1, 'r') as f1, open(file2, 'r') as f2:
-            diff = list(unified_diff(f1.readlines(), f2.readlines(), fromfile=file1, tofile=file2))
-            if diff:
-                print("".join(diff))
-            else:
-                print("No differences found.")
+        diff = section_diff(load_config_file(file1) or '', load_config_file(file2) or '', fromfile=file1, tofile=file2)
+        if diff:
+            print("\n".join(diff))
+        else:
+            print("No differences found.")
     elif data_source == 'mongodb':
-        client = MongoClient(settings['mongodb_connection']['uri'])
-        db = client[settings['mongodb_connection']['database_name']]
+        db = get_database(settings['mongodb_connection']['uri'], settings['mongodb_connection']['database_name'])
         collection = db['deviceConfig']
         
-        doc1 = collection.find_one({"device_name": device1, "timestamp": {"$gte": timestamp1_dt, "$lt": timestamp1_dt + timedelta(seconds=1)}})
-        doc2 = collection.find_one({"device_name": device2, "timestamp": {"$gte": timestamp2_dt, "$lt": timestamp2_dt + timedelta(seconds=1)}})
+        doc1 = collection.find_one({"device_name": device1, "timestamp": {"$gte": timestamp1_dt, "$lt": timestamp1_dt + timedelta(seconds=1)}, **LIVE})
+        doc2 = collection.find_one({"device_name": device2, "timestamp": {"$gte": timestamp2_dt, "$lt": timestamp2_dt + timedelta(seconds=1)}, **LIVE})
 
         if not doc1 or not doc2:
             print(f"Error: One or both of the specified configuration records do not exist in MongoDB.")
             return
         
-        config1 = doc1['config'].splitlines(keepends=True)
-        config2 = doc2['config'].splitlines(keepends=True)
-        
-        diff = list(unified_diff(config1, config2, fromfile=f"{device1}-{timestamp1}", tofile=f"{device2}-{timestamp2}"))
+        diff = diff_documents(db, doc1, doc2, fromfile=f"{device1}-{timestamp1}", tofile=f"{device2}-{timestamp2}")
         if diff:
-            print("".join(diff))
+            print("\n".join(diff))
         else:
             print("No differences found.")
-        client.close()
+
+# Helper function to parse the --changes-since cutoff
+def parse_cutoff(value):
+    for fmt in CUTOFF_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+# Diff one device's backups on either side of the cutoff; runs in a report worker process
+def diff_backups_job(job):
+    device, before, after, settings = job
+    try:
+        if settings['data_source'] == 'yaml':
+            digest = config_file_digest(before)
+            if digest and digest == config_file_digest(after):
+                return device, [], None
+            return device, config_changes(load_config_file(before) or '', load_config_file(after) or ''), None
+        db = get_database(settings['mongodb_connection']['uri'], settings['mongodb_connection']['database_name'])
+        documents = {document['_id']: document for document in db['deviceConfig'].find({'_id': {'$in': [before, after]}})}
+        return device, document_changes(db, documents[before], documents[after]), None
+    except Exception as e:
+        return device, None, str(e)
+
+# Find, for every device, the newest backup before and after a cutoff
+def backups_around_cutoff(cutoff, settings):
+    if settings['data_source'] == 'yaml':
+        # Show catalog timestamps in the --diff-check format.
+        return {device: [(f"{side[0][:10]}_{side[0][11:].replace('_', ':')}", side[1], None) if side else None for side in sides]
+                for device, sides in backups_around(cutoff.strftime('%Y-%m-%d_%H_%M_%S')).items()}
+    db = get_database(settings['mongodb_connection']['uri'], settings['mongodb_connection']['database_name'])
+    collection = db['deviceConfig']
+    projection = {'timestamp': 1, 'hash': 1}
+    around = {}
+    for device in sorted(collection.distinct('device_name', LIVE)):
+        before = collection.find_one({'device_name': device, 'timestamp': {'$lt': cutoff}, **LIVE}, projection, sort=[('timestamp', -1)])
+        after = collection.find_one({'device_name': device, 'timestamp': {'$gte': cutoff}, **LIVE}, projection, sort=[('timestamp', -1)])
+        around[device] = [(document['timestamp'].strftime('%Y-%m-%d_%H:%M:%S'), document['_id'], document.get('hash')) if document else None
+                          for document in (before, after)]
+    return around
+
+# Fleet-wide report of configuration changes since a cutoff, diffed in parallel worker processes
+def changes_since(cutoff_value, settings, workers=None, device=None):
+    cutoff = parse_cutoff(cutoff_value)
+    if cutoff is None:
+        print(f"Error: Invalid date {cutoff_value}. Use YYYY-MM-DD, YYYY-MM-DD HH:MM or YYYY-MM-DD_HH:MM:SS.")
+        return
+    around = backups_around_cutoff(cutoff, settings)
+    if device:
+        around = {device: around[device]} if device in around else {}
+    if not around:
+        print("No backups found.")
+        return
+
+    jobs = []
+    unchanged, new_devices, stale_devices = [], [], []
+    for name, (before, after) in sorted(around.items()):
+        if not before:
+            new_devices.append(name)
+        elif not after:
+            stale_devices.append(name)
+        elif settings['data_source'] != 'yaml' and before[2] and before[2] == after[2]:
+            unchanged.append(name)
+        else:
+            jobs.append((name, before[1], after[1], settings))
+
+    results = {}
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            futures = [executor.submit(diff_backups_job, job) for job in jobs]
+            for future in as_completed(futures):
+                name, changes, error = future.result()
+                results[name] = (changes, error)
+
+    table = PrettyTable(["Device", "Before", "After", "Sections", "Added", "Removed"])
+    changed = 0
+    for name, (before, after) in sorted(around.items()):
+        if name not in results:
+            continue
+        changes, error = results[name]
+        if error:
+            table.add_row([name, before[0], after[0], f"Error: {error}", "", ""])
+        elif changes:
+            changed += 1
+            lines = [line for _, section_lines in changes for line in section_lines]
+            table.add_row([name, before[0], after[0], len(changes),
+                           sum(line.startswith('+') for line in lines), sum(line.startswith('-') for line in lines)])
+        else:
+            unchanged.append(name)
+
+    print(f"Configuration changes since {cutoff.strftime('%Y-%m-%d %H:%M:%S')}:")
+    if changed or any(error for _, error in results.values()):
+        print(table)
+        for name in sorted(results):
+            changes, error = results[name]
+            if changes:
+                print(f"\n{name}:")
+                for path, section_lines in changes:
+                    print(f"  {' > '.join(path) if path else 'global'} (+{sum(line.startswith('+') for line in section_lines)}"
+                          f" -{sum(line.startswith('-') for line in section_lines)})")
+    print(f"\n{changed} devices changed, {len(unchanged)} unchanged, {len(new_devices)} first backed up after the cutoff, "
+          f"{len(stale_devices)} not backed up since.")
+    if new_devices:
+        print(f"First backed up after the cutoff: {', '.join(new_devices)}")
+    if stale_devices:
+        print(f"Not backed up since the cutoff: {', '.join(stale_devices)}")
+
+# Rules compiled once per compliance worker process
+_compliance_rules = None
+
+def init_compliance_worker(rules):
+    global _compliance_rules
+    _compliance_rules = rules
+
+# Check one device's latest configuration against the rules; runs in a compliance worker process
+def compliance_job(job):
+    device, device_type, settings = job
+    try:
+        config = load_latest_config(device, settings)
+        if config is None:
+            return device, None, "No stored configuration"
+        return device, check_config(_compliance_rules, config, device, device_type), None
+    except Exception as e:
+        return device, None, str(e)
+
+# Check the latest stored configuration of every device against a compliance rule set
+def compliance_check(rules_path, settings, workers=None, device=None):
+    try:
+        rules = load_rules(rules_path)
+    except (OSError, yaml.YAMLError, KeyError, re.error) as e:
+        print(f"Error: Could not load compliance rules from {rules_path}: {e}")
+        return
+    devices = load_inventory(settings)
+    if device:
+        if device not in devices:
+            print(f"Device {device} not found in the inventory.")
+            return
+        devices = {device: devices[device]}
+    jobs = [(name, details.get('device_type'), settings) for name, details in sorted(devices.items())]
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=init_compliance_worker, initargs=(rules,)) as executor:
+        for name, violations, error in executor.map(compliance_job, jobs, chunksize=16):
+            results[name] = (violations, error)
+
+    table = PrettyTable(["Device", "Rule", "Section", "Violation"])
+    compliant, failing, unchecked = [], 0, []
+    for name, (violations, error) in sorted(results.items()):
+        if error:
+            unchecked.append(f"{name} ({error})")
+        elif violations:
+            failing += 1
+            for rule_name, section, problem in violations:
+                table.add_row([name, rule_name, section, problem])
+        else:
+            compliant.append(name)
+    if failing:
+        print(table)
+    print(f"Checked {len(results)} devices against {len(rules)} rules: {len(compliant)} compliant, {failing} with violations, "
+          f"{len(unchecked)} not checked.")
+    for entry in unchecked:
+        print(f"Not checked: {entry}")
+
+# Check the customers last deployed to one device against its latest backup; runs in a drift worker process
+def drift_job(job):
+    device, settings, deployments = job
+    try:
+        config = load_latest_config(device, settings)
+        if config is None:
+            return device, None, "No stored configuration"
+        hashes = line_hashes(config)
+        results = []
+        for customer, deployed in deployments:
+            if settings['data_source'] == 'yaml':
+                with open(deployed, 'r') as file:
+                    deployed = file.read()
+            results.append((customer, missing_lines(deployed, hashes)))
+        return device, results, None
+    except Exception as e:
+        return device, None, str(e)
+
+# Report customers whose last deployed configuration is no longer fully present in the latest backup of its device
+def drift_check(settings, workers=None, device=None):
+    devices = load_inventory(settings)
+    if device and device not in devices:
+        print(f"Device {device} not found in the inventory.")
+        return
+    if settings['data_source'] == 'yaml':
+        deployed = latest_deployed_files(devices)
+    else:
+        influx_settings = settings['influxdb']
+        client = InfluxDBClient(url=influx_settings['url'], token=influx_settings['token'], org=influx_settings['org'])
+        deployed = latest_deployed_influxdb(client.query_api(), influx_settings['bucket'], influx_settings['org'])
+    deployments = {}
+    for (customer, device_name), source in sorted(deployed.items()):
+        if device_name in devices and (not device or device_name == device):
+            deployments.setdefault(device_name, []).append((customer, source))
+    if not deployments:
+        print("No deployed configurations found.")
+        return
+
+    jobs = [(name, settings, deployments[name]) for name in sorted(deployments)]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        results = list(executor.map(drift_job, jobs, chunksize=16))
+
+    table = PrettyTable(["Customer", "Device", "Missing line"])
+    checked, deactivated, drifted, unchecked = 0, 0, set(), []
+    for name, customers, error in results:
+        if error:
+            unchecked.append(f"{name} ({error})")
+            continue
+        for customer, missing in customers:
+            if missing is None:
+                deactivated += 1
+                continue
+            checked += 1
+            if missing:
+                drifted.add(customer)
+                for line in missing:
+                    table.add_row([customer, name, line])
+    if drifted:
+        print(table)
+    print(f"Checked {checked} customer deployments on {len(results) - len(unchecked)} devices: {len(drifted)} customers drifted, "
+          f"{deactivated} deactivated deployments skipped.")
+    for entry in unchecked:
+        print(f"Not checked: {entry}")
+
+# Helper function to store a fetched or streaming configuration in the configured backend
+def store_device_config(device, device_details, config, settings):
+    if settings['data_source'] == 'yaml':
+        return store_config_yaml(device, config, device_details.get('device_type'))
+    return store_config_mongodb(device, config, settings['mongodb_connection']['uri'], settings['mongodb_connection']['database_name'],
+                                device_details.get('device_type'),
+                                (settings.get('backup') or {}).get('keyframe_interval', DEFAULT_KEYFRAME_INTERVAL))
+
+# Helper function to write the audit record of a completed backup and index it for --search
+def audit_backup(device, user, duration, config_file_path, settings, influx_client=None):
+    if settings['data_source'] == 'yaml':
+        log_audit_yaml(device, 'backup', user, duration, config_file_path)
+    else:
+        log_audit_influxdb(device, 'backup', user, duration, settings['influxdb'], client=influx_client)
+    try:
+        index_latest_backup(device, settings)
+    except Exception as e:
+        print(f"Warning: could not update the search index for {device}: {e}")
+
+# Index a device's newest stored configuration; only content not indexed yet is loaded
+def index_latest_backup(device, settings):
+    connection = get_search_index()
+    indexed_hash = latest_indexed(connection, device)[1]
+    if settings['data_source'] == 'yaml':
+        digest = latest_digest_file(device)
+        if not digest or digest == indexed_hash:
+            return False
+        config_path = latest_config_path(device)
+        timestamp = timestamp_from_name(os.path.basename(config_path)) if config_path else None
+        return index_version(connection, device, digest, timestamp and f"{timestamp[:10]}_{timestamp[11:].replace('_', ':')}",
+                             (read_blob_file(digest) or '').splitlines())
+    db = get_database(settings['mongodb_connection']['uri'], settings['mongodb_connection']['database_name'])
+    document = db['deviceConfig'].find_one({'device_name': device, 'changed': {'$ne': False}, **LIVE}, sort=[('timestamp', -1)])
+    if not document or (document.get('hash') and document['hash'] == indexed_hash):
+        return False
+    return index_documents(connection, db, [document])
+
+# Helper function to index MongoDB backups, oldest first
+def index_documents(connection, db, documents):
+    indexed = False
+    for document in documents:
+        config = load_document_config(db, document) or ''
+        indexed |= index_version(connection, document['device_name'], document.get('hash') or config_digest(config),
+                                 document['timestamp'].strftime('%Y-%m-%d_%H:%M:%S'), config.splitlines())
+    return indexed
+
+# Rebuild the search index from every stored backup
+def rebuild_search_index(settings):
+    connection = get_search_index()
+    reset_search_index(connection)
+    count = 0
+    if settings['data_source'] == 'yaml':
+        for device, operation, timestamp, operator, config_path in backup_history():
+            digest = config_file_digest(config_path) if config_path else None
+            if not config_path or (digest and digest == latest_indexed(connection, device)[1]):
+                continue
+            config = load_config_file(config_path) or ''
+            count += index_version(connection, device, digest or config_digest(config),
+                                   f"{timestamp[:10]}_{timestamp[11:].replace('_', ':')}", config.splitlines())
+    else:
+        db = get_database(settings['mongodb_connection']['uri'], settings['mongodb_connection']['database_name'])
+        for device in sorted(db['deviceConfig'].distinct('device_name', LIVE)):
+            documents = db['deviceConfig'].find({'device_name': device, 'changed': {'$ne': False}, **LIVE},
+                                                {'delta': 0}).sort('timestamp', 1)
+            for document in documents:
+                count += index_documents(connection, db, [document])
+    print(f"Search index rebuilt with {count} configuration versions.")
+
+# Search the latest configurations, or their history, for a pattern
+def search_configs(pattern, history=False, device=None):
+    connection = get_search_index()
+    if not connection.execute('SELECT 1 FROM versions LIMIT 1').fetchone():
+        print("The search index is empty. Run --rebuild-search-index to index existing backups.")
+        return
+    rows = search(connection, pattern, history, device)
+    if not rows:
+        print(f"No configuration lines matching '{pattern}' found.")
+        return
+    if history:
+        table = PrettyTable(["Device", "Line", "Added", "Removed"])
+        for device_name, line, added, removed in rows:
+            table.add_row([device_name, line, added or "N/A", removed or "present"])
+    else:
+        table = PrettyTable(["Device", "Line"])
+        for device_name, line, added, removed in rows:
+            table.add_row([device_name, line])
+    print(table)
+    print(f"{len(rows)} matching lines on {len({row[0] for row in rows})} devices.")
+
+# Helper function to load the device inventory from the configured backend
+def load_inventory(settings):
+    if settings['data_source'] == 'yaml':
+        return read_yaml('devices/network_devices.yaml')['devices']
+    db = get_database(settings['mongodb_connection']['uri'], settings['mongodb_connection']['database_name'])
+    return {device['device_name']: device for device in db['devices'].find()}
+
+# Stream one device's configuration straight into storage; runs in a backup worker thread
+def backup_one_device(device, device_details, username, password, settings, timeout):
+    start_time = datetime.now()
+    ssh = open_ssh(device_details, username, password, timeout)
+    if ssh is None:
+        return device, False, "Failed to fetch configuration", None, None
+    try:
+        config_file_path = store_device_config(device, device_details, stream_running_config(ssh, device_details, timeout), settings)
+    except Exception:
+        report_fetch_error(device_details)
+        return device, False, "Failed to fetch configuration", None, None
+    finally:
+        ssh.close()
+    duration = (datetime.now() - start_time).total_seconds()
+    return device, True, None, duration, config_file_path
 
 # Main function for backup operation
-def backup_device(device_name, username, password, settings):
+def backup_device(device_name, username, password, settings, workers=None, timeout=None):
     data_source = settings['data_source']
+    backup_settings = settings.get('backup') or {}
+    workers = workers or backup_settings.get('workers', DEFAULT_BACKUP_WORKERS)
+    timeout = timeout or backup_settings.get('timeout', DEFAULT_BACKUP_TIMEOUT)
     success_count = 0
     failure_count = 0
     failures = []
-    if data_source == 'yaml':
-        devices = read_yaml('devices/network_devices.yaml')['devices']
-    else:
-        client = MongoClient(settings['mongodb_connection']['uri'])
-        db = client[settings['mongodb_connection']['database_name']]
-        devices = {device['device_name']: device for device in db['devices'].find()}
-        client.close()
+    devices = load_inventory(settings)
 
     if device_name == 'all':
-        device_list = devices.keys()
+        device_list = list(devices.keys())
     else:
         device_list = [device_name]
 
@@ -294,22 +650,36 @@ def backup_device(device_name, username, password, settings):
             print(f"Device {device} not found in the inventory.")
             failures.append((device, "Device not found in the inventory"))
             failure_count += 1
-            continue
-        device_details = devices[device]
-        start_time = datetime.now()
-        config = fetch_device_config(device_details, username, password)
-        if config is None:
-            failures.append((device, "Failed to fetch configuration"))
-            failure_count += 1
-            continue
-        duration = (datetime.now() - start_time).total_seconds()
-        if data_source == 'yaml':
-            config_file_path = store_config_yaml(device, config)
-            log_audit_yaml(device, 'backup', os.getlogin(), duration, config_file_path)
-        else:
-            store_config_mongodb(device, config, settings['mongodb_connection']['uri'], settings['mongodb_connection']['database_name'])
-            log_audit_influxdb(device, 'backup', os.getlogin(), duration, settings['influxdb'])
-        success_count += 1
+    device_list = [device for device in device_list if device in devices]
+
+    user = os.getlogin()
+    influx_client = None
+    if data_source != 'yaml' and device_list:
+        influx_settings = settings['influxdb']
+        influx_client = InfluxDBClient(url=influx_settings['url'], token=influx_settings['token'], org=influx_settings['org'])
+
+    # Workers only fetch and store; results, audit logging and progress are handled here, one at a time.
+    total = len(device_list)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, total or 1))) as executor:
+        futures = {executor.submit(backup_one_device, device, devices[device], username, password, settings, timeout): device
+                   for device in device_list}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            try:
+                device, ok, reason, duration, config_file_path = future.result()
+            except Exception as e:
+                device = futures[future]
+                ok, reason = False, f"Unexpected error: {e}"
+            if not ok:
+                print(f"[{completed}/{total}] {device}: failed ({reason})")
+                failures.append((device, reason))
+                failure_count += 1
+                continue
+            audit_backup(device, user, duration, config_file_path, settings, influx_client)
+            success_count += 1
+            print(f"[{completed}/{total}] {device}: backed up in {duration:.1f}s")
+
+    if influx_client:
+        influx_client.close()
 
     print(f"Summary: {success_count} configurations successfully retrieved and written.")
     if failures:
@@ -317,18 +687,112 @@ def backup_device(device_name, username, password, settings):
         for device, reason in failures:
             print(f"Device: {device}, Reason: {reason}")
 
+# Check one device's change indicator and back it up only if it moved; runs in a scheduler worker thread
+def check_and_backup_device(device, device_details, username, password, settings, timeout, previous_indicator):
+    start_time = datetime.now()
+    ssh = open_ssh(device_details, username, password, timeout)
+    if ssh is None:
+        return device, False, "Failed to connect", previous_indicator, None, None
+    try:
+        indicator = None
+        command = change_indicator_command(device_details.get('device_type'))
+        if command:
+            try:
+                indicator = parse_change_indicator(device_details['device_type'], run_command(ssh, command, timeout))
+            except Exception:
+                indicator = None
+        if indicator is not None and indicator == previous_indicator:
+            return device, True, None, indicator, None, None
+        config_file_path = store_device_config(device, device_details, stream_running_config(ssh, device_details, timeout), settings)
+    except Exception:
+        report_fetch_error(device_details)
+        return device, False, "Failed to fetch configuration", previous_indicator, None, None
+    finally:
+        ssh.close()
+    duration = (datetime.now() - start_time).total_seconds()
+    return device, True, None, indicator, duration, config_file_path
+
+# Long-running, change-aware backup scheduler
+def run_scheduler(username, password, settings, interval=None, jitter=None, workers=None, timeout=None, once=False):
+    backup_settings = settings.get('backup') or {}
+    interval = interval or backup_settings.get('schedule_interval', DEFAULT_INTERVAL)
+    jitter = jitter if jitter is not None else backup_settings.get('schedule_jitter', DEFAULT_JITTER)
+    workers = workers or backup_settings.get('workers', DEFAULT_BACKUP_WORKERS)
+    timeout = timeout or backup_settings.get('timeout', DEFAULT_BACKUP_TIMEOUT)
+    user = os.getlogin()
+    state = load_state()
+    influx_client = None
+    if settings['data_source'] != 'yaml':
+        influx_settings = settings['influxdb']
+        influx_client = InfluxDBClient(url=influx_settings['url'], token=influx_settings['token'], org=influx_settings['org'])
+
+    print(f"Backup scheduler started: interval {interval}s, jitter {jitter:.0%}, {workers} workers.")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                devices = load_inventory(settings)
+                if once:
+                    due = sorted(devices)
+                else:
+                    schedule_devices(state, list(devices), interval)
+                    due = due_devices(state, list(devices))
+                    if not due:
+                        wake_at = min(state[name]['next_due'] for name in devices) if devices else now_timestamp() + interval
+                        time.sleep(max(1, min(wake_at - now_timestamp(), 60)))
+                        continue
+
+                futures = {executor.submit(check_and_backup_device, device, devices[device], username, password, settings,
+                                           timeout, state.get(device, {}).get('indicator')): device for device in due}
+                changed = unchanged = failed = 0
+                for future in as_completed(futures):
+                    try:
+                        device, ok, reason, indicator, duration, config_file_path = future.result()
+                    except Exception as e:
+                        device, ok, reason, indicator, duration, config_file_path = futures[future], False, f"Unexpected error: {e}", None, None, None
+                    backed_up = ok and duration is not None
+                    record_check(state, device, indicator, backed_up, ok, interval, jitter)
+                    if not ok:
+                        failed += 1
+                        print(f"{device}: check failed ({reason})")
+                    elif backed_up:
+                        changed += 1
+                        audit_backup(device, user, duration, config_file_path, settings, influx_client)
+                    else:
+                        unchanged += 1
+                save_state(state)
+                print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: checked {len(due)} devices, "
+                      f"{changed} backed up, {unchanged} unchanged, {failed} failed.")
+                if once:
+                    break
+    except KeyboardInterrupt:
+        save_state(state)
+        print("Backup scheduler stopped.")
+    finally:
+        if influx_client:
+            influx_client.close()
+
 # Helper function to purge configurations from MongoDB
 def purge_configs(date, username, password, settings):
-    client = MongoClient(settings['mongodb_connection']['uri'])
-    db = client[settings['mongodb_connection']['database_name']]
+    db = get_database(settings['mongodb_connection']['uri'], settings['mongodb_connection']['database_name'])
     collection = db['deviceConfig']
     start_date = datetime.strptime(date, "%Y-%m-%d")
-    result = collection.delete_many({"timestamp": {"$gte": start_date}})
-    client.close()
-    print(f"Purged {result.deleted_count} configurations from MongoDB.")
+    ensure_indexes(db)
+    # Mark in batches and let the TTL index delete in the background instead of one large blocking delete_many.
+    ids = [document['_id'] for document in collection.find({"timestamp": {"$gte": start_date}, **LIVE}, {'_id': 1})]
+    purged = expire_documents(collection, ids, datetime.now(timezone.utc).replace(tzinfo=None), retention_settings(settings)['batch_size'])
+    print(f"Purged {purged} configurations from MongoDB.")
     log_purge_influxdb(username, settings['influxdb'])
     purge_audit_logs_influxdb(start_date, settings['influxdb'])
 
+# Apply the retention tiers to the MongoDB configuration history
+def compact_configs(settings, devices=None):
+    db = get_database(settings['mongodb_connection']['uri'], settings['mongodb_connection']['database_name'])
+    for error in ensure_indexes(db):
+        print(f"Warning: could not create index {error}")
+    totals = run_retention(db, settings, devices)
+    print(f"Compacted {totals['devices']} devices: kept {totals['kept']} backups, expired {totals['expired']}, "
+          f"rewrote {totals['keyframes']} as keyframes, expired {totals['blobs']} unreferenced blobs.")
+
 # Helper function to purge audit logs from InfluxDB
 def purge_audit_logs_influxdb(start_date, influx_settings):
     client = InfluxDBClient(url=influx_settings['url'], token=influx_settings['token'], org=influx_settings['org'])
@@ -347,8 +811,22 @@ def main():
     parser.add_argument('--last', type=int, help='Display the last N backup operations')
     parser.add_argument('--date', type=str, help='Display backup operations for a specific date (YYYY-MM-DD)')
     parser.add_argument('--diff-check', nargs=4, type=str, help='Display differences between two versions. Usage: --diff-check <device1> <timestamp1> <device2> <timestamp2>')
+    parser.add_argument('--changes-since', type=str, metavar='DATETIME', help='Report every device whose configuration changed since DATETIME (YYYY-MM-DD, "YYYY-MM-DD HH:MM" or YYYY-MM-DD_HH:MM:SS), optionally only for --device')
+    parser.add_argument('--compliance', nargs='?', const=DEFAULT_RULES_PATH, metavar='RULES_FILE', help=f'Check the latest stored configuration of every device (or --device) against a rule set (default: {DEFAULT_RULES_PATH})')
+    parser.add_argument('--drift', action='store_true', help='Report customers whose last deployed configuration lines are missing from the latest backup of the device, optionally only for --device')
+    parser.add_argument('--search', type=str, metavar='PATTERN', help='Find the devices whose latest configuration contains PATTERN (case-insensitive), optionally only for --device')
+    parser.add_argument('--history', action='store_true', help='With --search, also search past configurations and show when each line was added and removed')
+    parser.add_argument('--rebuild-search-index', action='store_true', help='Rebuild the --search index from every stored backup')
     parser.add_argument('--username', type=str, help='Username for backup operations and purgedb')
     parser.add_argument('--password', type=str, help='Password for backup operations and purgedb')
+    parser.add_argument('--workers', type=int, help='Number of devices backed up concurrently (default: backup.workers in settings.yaml, or 16), or of processes for --changes-since and --drift (default: CPU count)')
+    parser.add_argument('--timeout', type=int, help='Per-device SSH connect timeout and limit on reading the configuration in seconds (default: backup.timeout in settings.yaml, or 30)')
+    parser.add_argument('--schedule', action='store_true', help='Run the change-aware backup scheduler: check each device on a jittered interval and back up only devices whose configuration changed')
+    parser.add_argument('--once', action='store_true', help='With --schedule, check every device once and exit (for cron)')
+    parser.add_argument('--interval', type=int, help='Seconds between checks of each device for --schedule (default: backup.schedule_interval in settings.yaml, or 3600)')
+    parser.add_argument('--jitter', type=float, help='Fraction of the interval used to stagger devices for --schedule (default: backup.schedule_jitter, or 0.1)')
+    parser.add_argument('--rebuild-catalog', action='store_true', help='Rebuild the backup catalog from device_configs/ and audit_logs/ (YAML data source)')
+    parser.add_argument('--compact', action='store_true', help='Apply the retention tiers in settings.yaml to the MongoDB configuration history (optionally only for --device)')
     parser.add_argument('--purgedb', type=str, help='Purge configurations from MongoDB from a specific date (YYYY-MM-DD) or view purge history. Usage: --purgedb <YYYY-MM-DD> or --purgedb history')
 
     args = parser.parse_args()
@@ -361,7 +839,15 @@ def main():
             print("Username is required for backup operations.")
             return
         password = args.password if args.password else getpass("Password: ")
-        backup_device(args.backup, username, password, settings)
+        backup_device(args.backup, username, password, settings, workers=args.workers, timeout=args.timeout)
+    elif args.schedule:
+        username = args.username
+        if not username:
+            print("Username is required for backup operations.")
+            return
+        password = args.password if args.password else getpass("Password: ")
+        run_scheduler(username, password, settings, interval=args.interval, jitter=args.jitter,
+                      workers=args.workers, timeout=args.timeout, once=args.once)
     elif args.display:
         if settings['data_source'] == 'yaml':
             display_config_yaml(args.display, args.date)
@@ -372,8 +858,26 @@ def main():
             display_audit_history_yaml(args.last, args.date, args.device)
         else:
             display_audit_history_influxdb(settings['influxdb'], args.last, args.date, args.device)
+    elif args.rebuild_catalog:
+        count = rebuild_catalog(get_catalog())
+        print(f"Backup catalog rebuilt with {count} entries.")
     elif args.diff_check:
         diff_check(*args.diff_check, settings)
+    elif args.compliance:
+        compliance_check(args.compliance, settings, args.workers, args.device)
+    elif args.drift:
+        drift_check(settings, args.workers, args.device)
+    elif args.search:
+        search_configs(args.search, args.history, args.device)
+    elif args.rebuild_search_index:
+        rebuild_search_index(settings)
+    elif args.changes_since:
+        changes_since(args.changes_since, settings, args.workers, args.device)
+    elif args.compact:
+        if settings['data_source'] == 'yaml':
+            print("Compaction is not supported for YAML data source.")
+            return
+        compact_configs(settings, [args.device] if args.device else None)
     elif args.purgedb:
         if settings['data_source'] == 'yaml':
             print("Purge operation is not supported for YAML data source.")
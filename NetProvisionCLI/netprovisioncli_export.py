@@ -1,6 +1,6 @@
 import os
 import pandas as pd
-from pymongo import MongoClient
+from utils.mongo_utils import get_database
 from influxdb_client import InfluxDBClient
 import argparse
 import json
@@ -78,14 +78,12 @@ def export_to_excel(customers, device_list, deployments, file_path):
     writer.close()
 
 def get_customers(connection_string, database_name):
-    client = MongoClient(connection_string)
-    db = client[database_name]
+    db = get_database(connection_string, database_name)
     customers_collection = db['customers']
     return list(customers_collection.find({}))
 
 def get_devices(connection_string, database_name):
-    client = MongoClient(connection_string)
-    db = client[database_name]
+    db = get_database(connection_string, database_name)
     devices_collection = db['devices']
     devices = list(devices_collection.find({}))
     print(f"Retrieved devices: {devices}")  # Debugging line
@@ -1,6 +1,6 @@
 import argparse
 import yaml
-from pymongo import MongoClient
+from utils.mongo_utils import get_database
 from prettytable import PrettyTable
 
 def load_settings():
@@ -17,8 +17,7 @@ def load_settings():
         return {}
 
 def get_customer_details(connection_string, database_name, customer_name=None):
-    client = MongoClient(connection_string)
-    db = client[database_name]
+    db = get_database(connection_string, database_name)
     customers_collection = db['customers']
 
     if customer_name:
@@ -31,14 +30,14 @@ def get_customer_details(connection_string, database_name, customer_name=None):
         return list(customers_collection.find({}))
 
 def get_device_details(connection_string, database_name, device_names=None):
-    client = MongoClient(connection_string)
-    db = client[database_name]
+    db = get_database(connection_string, database_name)
     devices_collection = db['devices']
 
     if device_names:
+        found = {device['device_name']: device for device in devices_collection.find({"device_name": {"$in": device_names}})}
         device_data_list = []
         for device_name in device_names:
-            device_data = devices_collection.find_one({"device_name": device_name})
+            device_data = found.get(device_name)
             if not device_data:
                 print(f"Device {device_name} not found in MongoDB.")
             else:
@@ -2,7 +2,8 @@ import os
 import json
 import argparse
 import getpass
-from pymongo import MongoClient
+from utils.mongo_utils import get_database
+from utils.prefix_index import rebuild_prefix_collection
 from influxdb_client import InfluxDBClient, Point
 from influxdb_client.client.write_api import SYNCHRONOUS
 
@@ -21,8 +22,7 @@ def load_settings():
         return {}
 
 def import_mongodb_data(connection_string, database_name, input_file):
-    client = MongoClient(connection_string)
-    db = client[database_name]
+    db = get_database(connection_string, database_name)
     
     with open(input_file, 'r') as file:
         data = json.load(file)
@@ -32,6 +32,7 @@ def import_mongodb_data(connection_string, database_name, input_file):
     
     db['customers'].insert_many(data['customers'])
     db['devices'].insert_many(data['devices'])
+    rebuild_prefix_collection(db)
     
     print(f"MongoDB data imported from {input_file}")
 
@@ -1,6 +1,38 @@
 import cmd2
 import subprocess
 import os
+import yaml
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from utils.mongo_utils import get_database
+from utils.schema import ensure_indexes
+
+# An unreachable MongoDB delays the shell by this much instead of the driver's 30 second server selection timeout.
+STARTUP_PING_TIMEOUT_MS = 2000
+
+def ping_mongodb(uri):
+    """Ping MongoDB through a short-lived client with a short server selection timeout; raises PyMongoError if unreachable."""
+    client = MongoClient(uri, serverSelectionTimeoutMS=STARTUP_PING_TIMEOUT_MS)
+    try:
+        client.admin.command('ping')
+    finally:
+        client.close()
+
+def startup_checks():
+    """Make sure the MongoDB indexes exist before the shell starts (no-op for the YAML data source)."""
+    try:
+        with open('settings/settings.yaml', 'r') as file:
+            settings = yaml.safe_load(file) or {}
+    except (OSError, yaml.YAMLError):
+        return
+    if settings.get('data_source') != 'mongodb':
+        return
+    try:
+        ping_mongodb(settings['mongodb_connection']['uri'])
+        for error in ensure_indexes(get_database(settings['mongodb_connection']['uri'], settings['mongodb_connection']['database_name'])):
+            print(f"Warning: could not create index {error}")
+    except (PyMongoError, KeyError) as e:
+        print(f"Warning: MongoDB schema check skipped: {e}")
 
 def show_man(poutput):
     """Display the manual pages."""
@@ -20,15 +52,28 @@ customer --recipe recipes/customers/CUSTOMEREXAMPLE.yaml --username USERNAME
 # Generate the customer's configuration files
 generate --customer-name CUSTOMEREXAMPLE
 
+# Regenerate every customer in parallel (MongoDB customers, or all recipes with YAML)
+generate --all --workers 8
+
 # Deployment of a customer
 deploy --customer-name CUSTOMEREXAMPLE --username USERNAME --password PASSWORD --access-device DEVICE1 --pe-device DEVICE2
 
+# Generate and deploy in one step, straight from memory (no generated_configs/ files)
+deploy --generate --customer-name CUSTOMEREXAMPLE --username USERNAME --password PASSWORD
+
+# Define IRB/LAN prefix pools per PE or region (recipes can then use 'auto' or 'auto/NN' for addressing and IDs)
+customer --prefix-pools recipes/prefix_pools/prefix_pools.yaml --username USERNAME
+
+# Create MongoDB indexes and check that hot queries use them
+customer --init-schema --check-schema --username USERNAME
+
 # Query customers from MongoDB
 query --customer CUSTOMEREXAMPLE
 query --customer CUSTOMEREXAMPLE --device DEVICE1 --device DEVICE2
 
-# List all deployments
+# List all deployments (page by page; continue with the printed --cursor)
 commitdb --deployment-list
+commitdb --deployment-list --cursor CURSOR
 
 # Check for one particular deployment
 commitdb --deployment-id DEPLOYMENT_ID
@@ -251,5 +296,6 @@ class AdminShell(cmd2.Cmd):
         return [name[3:] for name in dir(self) if name.startswith('do_')]
 
 if __name__ == '__main__':
+    startup_checks()
     app = NetProvisionShell()
     app.cmdloop()
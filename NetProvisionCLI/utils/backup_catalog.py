@@ -0,0 +1,128 @@
+import os
+import sqlite3
+from typing import Optional, List, Tuple, Dict
+
+CONFIG_DIR = 'device_configs'
+AUDIT_DIR = 'audit_logs'
+CATALOG_PATH = os.path.join(CONFIG_DIR, 'catalog.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    id INTEGER PRIMARY KEY,
+    device TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    operator TEXT,
+    duration REAL,
+    config_path TEXT,
+    audit_path TEXT
+);
+CREATE INDEX IF NOT EXISTS backups_device_timestamp ON backups (device, timestamp);
+CREATE INDEX IF NOT EXISTS backups_timestamp ON backups (timestamp);
+"""
+
+_connections = {}
+
+def get_catalog(path: str = CATALOG_PATH) -> sqlite3.Connection:
+    """Open (once per process) the backup catalog, creating it from the existing archive on first use."""
+    connection = _connections.get(path)
+    if connection is None:
+        is_new = not os.path.exists(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = sqlite3.connect(path)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(SCHEMA)
+        _connections[path] = connection
+        if is_new:
+            rebuild_catalog(connection)
+    return connection
+
+def timestamp_from_name(file_name: str) -> str:
+    """YYYY-MM-DD_HH_MM_SS from a '<device>-config-<ts>.<ext>' or 'BACKUP_<device>_<ts>.txt' file name."""
+    stem = os.path.splitext(file_name)[0]
+    return '_'.join(stem.replace('-config-', '_').split('_')[-4:])
+
+def record_backup(device: str, timestamp: str, operation: str, operator: str, duration: float,
+                  config_path: Optional[str], audit_path: Optional[str], path: str = CATALOG_PATH) -> None:
+    connection = get_catalog(path)
+    with connection:
+        connection.execute('INSERT INTO backups (device, timestamp, operation, operator, duration, config_path, audit_path) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           (device, timestamp, operation, operator, duration, config_path, audit_path))
+
+def latest_config_path(device: str, date: Optional[str] = None, path: str = CATALOG_PATH) -> Optional[str]:
+    """Most recent stored configuration of a device, optionally on a given date (or date prefix)."""
+    query = 'SELECT config_path FROM backups WHERE device = ? AND config_path IS NOT NULL'
+    parameters = [device]
+    if date:
+        query += ' AND timestamp GLOB ?'
+        parameters.append(f'{date}*')
+    row = get_catalog(path).execute(query + ' ORDER BY timestamp DESC LIMIT 1', parameters).fetchone()
+    return row[0] if row else None
+
+def backup_history(last: Optional[int] = None, date: Optional[str] = None, device: Optional[str] = None,
+                   path: str = CATALOG_PATH) -> List[Tuple[str, str, str, str, str]]:
+    """(device, operation, timestamp, operator, config_path) rows, oldest first, or the last N newest first."""
+    query = 'SELECT device, operation, timestamp, operator, config_path FROM backups WHERE 1 = 1'
+    parameters = []
+    if device:
+        query += ' AND device = ?'
+        parameters.append(device)
+    if date:
+        query += ' AND timestamp GLOB ?'
+        parameters.append(f'{date}*')
+    if last:
+        query += ' ORDER BY timestamp DESC LIMIT ?'
+        parameters.append(last)
+    else:
+        query += ' ORDER BY timestamp'
+    return get_catalog(path).execute(query, parameters).fetchall()
+
+def backups_around(cutoff: str, path: str = CATALOG_PATH) -> Dict[str, List[Optional[Tuple[str, str]]]]:
+    """{device: [(timestamp, config_path) of the newest backup before cutoff, of the newest at or after it]}."""
+    connection = get_catalog(path)
+    devices = {}
+    # SQLite returns the other columns from the row holding MAX(timestamp).
+    for side, condition in enumerate(('timestamp < ?', 'timestamp >= ?')):
+        for device, timestamp, config_path in connection.execute(
+                f'SELECT device, MAX(timestamp), config_path FROM backups WHERE config_path IS NOT NULL AND {condition} '
+                'GROUP BY device', (cutoff,)):
+            devices.setdefault(device, [None, None])[side] = (timestamp, config_path)
+    return devices
+
+def rebuild_catalog(connection: sqlite3.Connection, config_dir: str = CONFIG_DIR, audit_dir: str = AUDIT_DIR) -> int:
+    """Index the backups already on disk: every audit log, plus config files that have none. Returns the row count."""
+    rows = []
+    audited = set()
+    if os.path.isdir(audit_dir):
+        for file_name in os.listdir(audit_dir):
+            if not file_name.startswith('BACKUP_'):
+                continue
+            fields = {}
+            try:
+                with open(os.path.join(audit_dir, file_name), 'r') as file:
+                    for line in file:
+                        key, _, value = line.partition(':')
+                        fields[key.strip()] = value.strip()
+            except OSError:
+                continue
+            duration = fields.get('Duration', '').rstrip('s')
+            config_path = fields.get('Config File')
+            config_path = config_path if config_path not in (None, '', 'None') else None
+            audited.add(config_path)
+            timestamp = timestamp_from_name(os.path.basename(config_path) if config_path else file_name)
+            rows.append((fields.get('Device'), timestamp, fields.get('Operation', 'backup'),
+                         fields.get('User'), float(duration) if duration.replace('.', '', 1).isdigit() else None,
+                         config_path, os.path.join(audit_dir, file_name)))
+    if os.path.isdir(config_dir):
+        for file_name in os.listdir(config_dir):
+            if '-config-' not in file_name or not file_name.endswith(('.txt', '.ref')):
+                continue
+            config_path = os.path.join(config_dir, file_name)
+            if config_path not in audited:
+                rows.append((file_name.split('-config-')[0], timestamp_from_name(file_name), 'backup', None, None, config_path, None))
+    with connection:
+        connection.execute('DELETE FROM backups')
+        connection.executemany('INSERT INTO backups (device, timestamp, operation, operator, duration, config_path, audit_path) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?)', [row for row in rows if row[0]])
+    return len(rows)
@@ -0,0 +1,88 @@
+import os
+import re
+import json
+import random
+import hashlib
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List
+
+STATE_PATH = os.path.join('device_configs', 'scheduler_state.json')
+DEFAULT_INTERVAL = 3600
+DEFAULT_JITTER = 0.1
+
+# Cheap per-vendor commands whose output moves whenever the configuration changes, and the lines that carry it.
+CHANGE_INDICATORS = {
+    'cisco_ios': ('show running-config | include Last configuration change|No configuration change',
+                  r'^! (Last configuration change|No configuration change)'),
+    'cisco_xe': ('show running-config | include Last configuration change|No configuration change',
+                 r'^! (Last configuration change|No configuration change)'),
+    'cisco_xr': ('show configuration commit list 1', r'^\s*1\s+\d+'),
+    'juniper_junos': ('show system commit | no-more', r'^0\s'),
+    'huawei_vrp': ('display configuration commit list 1', r'^\s*1\s+\d+'),
+}
+
+def change_indicator_command(device_type: str) -> Optional[str]:
+    indicator = CHANGE_INDICATORS.get(device_type)
+    return indicator[0] if indicator else None
+
+def parse_change_indicator(device_type: str, output: str) -> Optional[str]:
+    """Digest of the indicator lines in a command's output, or None when the output carries no usable indicator."""
+    indicator = CHANGE_INDICATORS.get(device_type)
+    if not indicator or not output:
+        return None
+    pattern = re.compile(indicator[1])
+    lines = [line.strip() for line in output.splitlines() if pattern.match(line)]
+    if not lines:
+        return None
+    return hashlib.sha256('\n'.join(lines).encode()).hexdigest()
+
+def load_state(path: str = STATE_PATH) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(state: Dict[str, Dict[str, Any]], path: str = STATE_PATH) -> None:
+    """Atomically replace the scheduler state file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(state, file, indent=4, sort_keys=True)
+    os.replace(temp_path, path)
+
+def now_timestamp() -> float:
+    return datetime.now(timezone.utc).timestamp()
+
+def next_due(last_checked: float, interval: float, jitter: float) -> float:
+    """Next check time: one interval later, moved by up to +/- jitter of the interval so devices drift apart."""
+    return last_checked + interval * (1 + random.uniform(-jitter, jitter))
+
+def schedule_devices(state: Dict[str, Dict[str, Any]], device_names: List[str], interval: float) -> None:
+    """Give devices never seen before a first check spread uniformly over one interval, so they do not all start together."""
+    now = now_timestamp()
+    for device_name in device_names:
+        entry = state.setdefault(device_name, {})
+        if 'next_due' not in entry:
+            entry['next_due'] = now + random.uniform(0, interval)
+
+def due_devices(state: Dict[str, Dict[str, Any]], device_names: List[str], now: Optional[float] = None) -> List[str]:
+    now = now if now is not None else now_timestamp()
+    return sorted((name for name in device_names if state.get(name, {}).get('next_due', 0) <= now),
+                  key=lambda name: state[name]['next_due'])
+
+def record_check(state: Dict[str, Dict[str, Any]], device_name: str, indicator: Optional[str], backed_up: bool,
+                 ok: bool, interval: float, jitter: float) -> None:
+    now = now_timestamp()
+    entry = state.setdefault(device_name, {})
+    entry['last_checked'] = now
+    if ok:
+        entry['indicator'] = indicator
+        entry['failures'] = 0
+        if backed_up:
+            entry['last_backup'] = now
+        entry['next_due'] = next_due(now, interval, jitter)
+    else:
+        # Retry failed devices sooner, backing off up to a full interval.
+        entry['failures'] = entry.get('failures', 0) + 1
+        entry['next_due'] = now + min(interval, 60 * 2 ** min(entry['failures'], 10))
@@ -0,0 +1,71 @@
+import re
+import yaml
+from typing import Optional, List, Tuple
+from utils.config_diff import parse_config, Section
+
+DEFAULT_RULES_PATH = 'recipes/compliance/rules.yaml'
+
+class ComplianceRule:
+    """One golden rule, compiled once.
+
+    section is a list of regexes matched in full against the section headers from the top level down
+    (e.g. ['l2vpn', 'bridge group .*', 'bridge-domain .*']); without it the rule applies to the whole configuration.
+    Every require regex must match some line of each selected section and no forbid regex may match any.
+    """
+
+    def __init__(self, definition: dict):
+        self.name = definition['name']
+        self.description = definition.get('description', self.name)
+        section = definition.get('section') or []
+        self.section = [re.compile(pattern) for pattern in ([section] if isinstance(section, str) else section)]
+        self.require = [re.compile(pattern) for pattern in definition.get('require', [])]
+        self.forbid = [re.compile(pattern) for pattern in definition.get('forbid', [])]
+        self.device_types = set(definition.get('device_types', []))
+        self.devices = re.compile(definition['devices']) if definition.get('devices') else None
+
+    def applies_to(self, device_name: str, device_type: Optional[str]) -> bool:
+        if self.device_types and device_type not in self.device_types:
+            return False
+        return not self.devices or bool(self.devices.fullmatch(device_name))
+
+    def selects(self, path: Tuple[str, ...]) -> bool:
+        return len(path) == len(self.section) and all(regex.fullmatch(header) for regex, header in zip(self.section, path))
+
+    def check(self, lines: List[str]) -> List[str]:
+        problems = [f"missing line matching '{regex.pattern}'" for regex in self.require
+                    if not any(regex.search(line) for line in lines)]
+        problems.extend(f"forbidden line '{line}'" for regex in self.forbid for line in lines if regex.search(line))
+        return problems
+
+def load_rules(path: str = DEFAULT_RULES_PATH) -> List[ComplianceRule]:
+    with open(path, 'r') as file:
+        return [ComplianceRule(definition) for definition in (yaml.safe_load(file) or {}).get('rules', [])]
+
+def _sections(root: Section, max_depth: int) -> List[Tuple[Tuple[str, ...], Section]]:
+    sections = []
+    pending = [((key[0],), child) for key, child in root.children.items()]
+    while pending:
+        path, section = pending.pop()
+        sections.append((path, section))
+        if len(path) < max_depth:
+            pending.extend((path + (key[0],), child) for key, child in section.children.items())
+    return sections
+
+def check_config(rules: List[ComplianceRule], config: str, device_name: str,
+                 device_type: Optional[str] = None) -> List[Tuple[str, str, str]]:
+    """(rule name, section, problem) for every violation in one configuration."""
+    rules = [rule for rule in rules if rule.applies_to(device_name, device_type)]
+    if not rules:
+        return []
+    root = parse_config(config, device_type)
+    sections = _sections(root, max(len(rule.section) for rule in rules))
+    violations = []
+    for rule in rules:
+        if not rule.section:
+            violations.extend((rule.name, 'global', problem) for problem in rule.check([line.strip() for line in root.lines()]))
+            continue
+        for path, section in sections:
+            if rule.selects(path):
+                lines = [line.strip() for line in section.lines()[1:]]
+                violations.extend((rule.name, ' > '.join(path), problem) for problem in rule.check(lines))
+    return sorted(violations, key=lambda violation: (violation[1], violation[0]))
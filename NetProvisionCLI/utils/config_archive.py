@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import codecs
+import hashlib
+import tempfile
+from datetime import datetime, timezone
+from typing import Optional, Iterable, Union, BinaryIO
+import zstandard
+from bson.binary import Binary
+
+CONFIG_DIR = 'device_configs'
+OBJECTS_DIR = os.path.join(CONFIG_DIR, 'objects')
+REFS_DIR = os.path.join(CONFIG_DIR, 'refs')
+BLOB_COLLECTION = 'deviceConfigBlobs'
+POINTER_SUFFIX = '.ref'
+COMPRESSION_LEVEL = 3
+SPOOL_MAX_SIZE = 1024 * 1024
+
+# Lines that change on every read without any configuration change, per vendor family.
+VOLATILE_PATTERNS = {
+    'cisco': [r'^Building configuration', r'^Current configuration\s*:', r'^! Last configuration change at',
+              r'^! NVRAM config last updated at', r'^! No configuration change since last restart', r'^ntp clock-period'],
+    'juniper': [r'^## Last commit:', r'^## Last changed:', r'^# Last commit:'],
+    'huawei': [r'^!Software Version', r'^!Last configuration was (updated|saved) at', r'^!Time:'],
+}
+
+_volatile_regexes = {family: re.compile('|'.join(f'(?:{pattern})' for pattern in patterns))
+                     for family, patterns in VOLATILE_PATTERNS.items()}
+_any_volatile = re.compile('|'.join(f'(?:{regex.pattern})' for regex in _volatile_regexes.values()))
+
+def _vendor_family(device_type: Optional[str]) -> Optional[str]:
+    if not device_type:
+        return None
+    for family in VOLATILE_PATTERNS:
+        if device_type.startswith(family):
+            return family
+    return None
+
+def normalize_config(config: str, device_type: Optional[str] = None) -> str:
+    """Drop volatile lines, unify line endings and strip trailing whitespace so identical configs hash identically."""
+    family = _vendor_family(device_type)
+    volatile = _volatile_regexes[family] if family else _any_volatile
+    lines = (line.rstrip() for line in config.replace('\r\n', '\n').replace('\r', '\n').split('\n'))
+    normalized = '\n'.join(line for line in lines if not volatile.match(line)).strip('\n')
+    return normalized + '\n' if normalized else ''
+
+def config_digest(normalized: str) -> str:
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+def compress_config(text: str) -> bytes:
+    return zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).compress(text.encode())
+
+def decompress_config(data: bytes) -> str:
+    # Streamed frames carry no content size, so decompress through a stream object rather than one-shot.
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data).decode()
+
+class ConfigStream:
+    """Normalize, hash and compress a configuration fed in byte chunks, writing compressed output to a sink as it goes.
+    Memory stays bounded by the longest line; the result hashes and decompresses identically to normalize_config."""
+
+    def __init__(self, sink: BinaryIO, device_type: Optional[str] = None):
+        family = _vendor_family(device_type)
+        self._volatile = _volatile_regexes[family] if family else _any_volatile
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).compressobj()
+        self._hash = hashlib.sha256()
+        self._sink = sink
+        self._partial = ''
+        self._blank_lines = 0
+        self._started = False
+        self.raw_size = 0
+        self.size = 0
+        self.digest = None
+
+    def _write(self, text: str) -> None:
+        data = text.encode()
+        self._hash.update(data)
+        self.size += len(data)
+        self._sink.write(self._compressor.compress(data))
+
+    def _line(self, line: str) -> None:
+        line = line.rstrip()
+        if self._volatile.match(line):
+            return
+        if not line:
+            # Blank lines only count once more content follows, so leading and trailing ones are dropped.
+            self._blank_lines += self._started
+            return
+        self._write('\n' * (self._blank_lines + 1) + line if self._started else line)
+        self._started = True
+        self._blank_lines = 0
+
+    def _text(self, text: str, final: bool = False) -> None:
+        text = self._partial + text
+        # Hold back a trailing CR so a CRLF split across chunks is not read as two line breaks.
+        held = '\r' if not final and text.endswith('\r') else ''
+        lines = text[:len(text) - len(held)].replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        self._partial = '' if final else lines.pop() + held
+        for line in lines:
+            self._line(line)
+
+    def feed(self, chunk: bytes) -> None:
+        self.raw_size += len(chunk)
+        self._text(self._decoder.decode(chunk))
+
+    def close(self) -> str:
+        """Flush everything to the sink and return the digest of the normalized configuration."""
+        self._text(self._decoder.decode(b'', final=True), final=True)
+        if self._started:
+            self._write('\n')
+        self._sink.write(self._compressor.flush())
+        self.digest = self._hash.hexdigest()
+        return self.digest
+
+def config_chunks(config: Union[str, Iterable[bytes]]) -> Iterable[bytes]:
+    return [config.encode()] if isinstance(config, str) else config
+
+def stream_config(chunks: Iterable[bytes], sink: BinaryIO, device_type: Optional[str] = None) -> ConfigStream:
+    stream = ConfigStream(sink, device_type)
+    for chunk in chunks:
+        stream.feed(chunk)
+    stream.close()
+    return stream
+
+# YAML (file) backend: content-addressed blobs under objects/, one small pointer file per backup,
+# and a per-device ref holding the digest of the latest backup.
+
+def _blob_path(digest: str) -> str:
+    return os.path.join(OBJECTS_DIR, digest[:2], f"{digest}.zst")
+
+def _write_atomic(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{id(data)}.tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(data)
+    os.replace(temp_path, path)
+
+def latest_digest_file(device_name: str) -> Optional[str]:
+    try:
+        with open(os.path.join(REFS_DIR, device_name), 'r') as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+def _write_pointer(device_name: str, digest: str, changed: bool) -> str:
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H_%M_%S')
+    pointer_path = os.path.join(CONFIG_DIR, f'{device_name}-config-{timestamp}{POINTER_SUFFIX}')
+    pointer = {'device': device_name, 'hash': digest, 'changed': changed, 'timestamp': timestamp}
+    _write_atomic(pointer_path, json.dumps(pointer).encode())
+    if changed:
+        _write_atomic(os.path.join(REFS_DIR, device_name), digest.encode())
+    return pointer_path
+
+def store_config_file(device_name: str, config: Union[str, Iterable[bytes]], device_type: Optional[str] = None) -> Optional[dict]:
+    """Archive a backup on disk, streaming text or byte chunks through a temporary compressed blob.
+    Returns {'path', 'hash', 'changed'}, or None when the configuration is empty; unchanged content is discarded."""
+    os.makedirs(OBJECTS_DIR, exist_ok=True)
+    temp_file = tempfile.NamedTemporaryFile(dir=OBJECTS_DIR, suffix='.tmp', delete=False)
+    try:
+        with temp_file:
+            stream = stream_config(config_chunks(config), temp_file, device_type)
+        if not stream.raw_size:
+            return None
+        changed = stream.digest != latest_digest_file(device_name)
+        blob_path = _blob_path(stream.digest)
+        if changed and not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(temp_file.name, blob_path)
+    finally:
+        if os.path.exists(temp_file.name):
+            os.remove(temp_file.name)
+    return {'path': _write_pointer(device_name, stream.digest, changed), 'hash': stream.digest, 'changed': changed}
+
+def read_blob_file(digest: str) -> Optional[str]:
+    try:
+        with open(_blob_path(digest), 'rb') as file:
+            return decompress_config(file.read())
+    except OSError:
+        return None
+
+def load_config_file(path: str) -> Optional[str]:
+    """Read a stored backup, either a pointer file or a legacy plain-text copy."""
+    try:
+        if path.endswith(POINTER_SUFFIX):
+            with open(path, 'r') as file:
+                return read_blob_file(json.load(file)['hash'])
+        with open(path, 'r') as file:
+            return file.read()
+    except (OSError, ValueError, KeyError):
+        return None
+
+def config_file_digest(path: str) -> Optional[str]:
+    """Content digest recorded in a pointer file, without loading the blob; None for legacy copies."""
+    if not path.endswith(POINTER_SUFFIX):
+        return None
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)['hash']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def find_config_file(device_name: str, timestamp: str) -> Optional[str]:
+    """Path of the backup taken at a timestamp (YYYY-MM-DD_HH_MM_SS or YYYY-MM-DD_HH:MM:SS), pointer or legacy file."""
+    timestamp = timestamp.replace(':', '_')
+    for suffix in (POINTER_SUFFIX, '.txt'):
+        path = os.path.join(CONFIG_DIR, f"{device_name}-config-{timestamp}{suffix}")
+        if os.path.exists(path):
+            return path
+    return None
+
+# MongoDB backend: compressed blobs keyed by digest in deviceConfigBlobs; deviceConfig keeps one small document per backup.
+
+def store_blob_mongodb(db, digest: str, normalized: str) -> None:
+    store_compressed_blob_mongodb(db, digest, compress_config(normalized), len(normalized))
+
+def store_compressed_blob_mongodb(db, digest: str, compressed: bytes, size: int) -> None:
+    db[BLOB_COLLECTION].update_one(
+        {'_id': digest},
+        # Reusing a blob cancels any pending expiry set by retention.
+        {'$setOnInsert': {'data': Binary(compressed), 'size': size, 'created': datetime.now(timezone.utc)},
+         '$unset': {'expire_at': ''}},
+        upsert=True
+    )
+
+def spool_config(config: Union[str, Iterable[bytes]], device_type: Optional[str] = None):
+    """Stream a configuration into a spooled temporary file of compressed normalized content.
+    Returns (stream, spool); the spool only touches disk once it outgrows SPOOL_MAX_SIZE."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    return stream_config(config_chunks(config), spool, device_type), spool
+
+def read_blob_mongodb(db, digest: str) -> Optional[str]:
+    blob = db[BLOB_COLLECTION].find_one({'_id': digest})
+    return decompress_config(blob['data']) if blob else None
+
+def load_config_document(db, document: dict) -> Optional[str]:
+    """Configuration text of a deviceConfig document, whether it embeds the config (legacy) or points to a blob."""
+    if 'config' in document:
+        return document['config']
+    if 'hash' in document:
+        return read_blob_mongodb(db, document['hash'])
+    return None
@@ -0,0 +1,204 @@
+import hashlib
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple, Iterable, Union
+
+# Lines that only delimit blocks (IOS/XR '!', VRP '#', Junos braces) and carry no configuration.
+SEPARATORS = {'!', '#', '}', '{', ']'}
+# Junos set-style lines are grouped by up to this many path words after the verb.
+SET_SECTION_DEPTH = 2
+SET_VERBS = ('set ', 'delete ', 'deactivate ', 'activate ')
+# Top-level lines are ordered among lines sharing their first words (access-list 10, ip community-list ...).
+ORDER_GROUP_WORDS = 2
+
+class Section:
+    """A configuration line and the lines nested under it, keyed so moved blocks still match."""
+    __slots__ = ('line', 'children', 'digest')
+
+    def __init__(self, line: str = ''):
+        self.line = line
+        self.children: Dict[Tuple[str, int], 'Section'] = {}
+        self.digest = b''
+
+    def add(self, line: str) -> 'Section':
+        # Repeated identical lines under one parent get distinct keys by occurrence.
+        key = (line.strip(), 0)
+        while key in self.children:
+            key = (key[0], key[1] + 1)
+        child = Section(line)
+        self.children[key] = child
+        return child
+
+    def child(self, line: str) -> 'Section':
+        """The first child with this line, created if missing (set-style sections are shared by many lines)."""
+        return self.children.get((line.strip(), 0)) or self.add(line)
+
+    def lines(self) -> List[str]:
+        result = [self.line] if self.line else []
+        for child in self.children.values():
+            result.extend(child.lines())
+        return result
+
+def _seal(section: Section) -> bytes:
+    digest = hashlib.blake2b(section.line.strip().encode(), digest_size=16)
+    for child in section.children.values():
+        digest.update(_seal(child))
+    section.digest = digest.digest()
+    return section.digest
+
+def _text_lines(config: Union[str, Iterable[str]]) -> List[str]:
+    if isinstance(config, str):
+        config = config.replace('\r\n', '\n').split('\n')
+    return [line.rstrip('\r\n').rstrip() for line in config]
+
+def is_set_style(lines: List[str], device_type: Optional[str] = None) -> bool:
+    if device_type:
+        return device_type.startswith('juniper') and any(line.startswith(SET_VERBS) for line in lines)
+    # Configurations are uniformly one style, so a sample of the content lines decides.
+    content = []
+    for line in lines:
+        if line.strip() and line.strip() not in SEPARATORS:
+            content.append(line)
+            if len(content) == 200:
+                break
+    return bool(content) and sum(line.startswith(SET_VERBS) for line in content) * 2 > len(content)
+
+def parse_config(config: Union[str, Iterable[str]], device_type: Optional[str] = None, set_style: Optional[bool] = None) -> Section:
+    """Parse a configuration into a section tree: indentation for IOS/XR/VRP (and Junos brace format),
+    set paths for Junos set-style configurations."""
+    lines = _text_lines(config)
+    root = Section()
+    if set_style if set_style is not None else is_set_style(lines, device_type):
+        for line in lines:
+            words = line.split()
+            if not words:
+                continue
+            path = words[1:-1][:SET_SECTION_DEPTH]
+            parent = root
+            for depth in range(1, len(path) + 1):
+                parent = parent.child(' '.join(path[:depth]))
+            parent.add(line)
+    else:
+        stack = [(-1, root)]
+        for line in lines:
+            stripped = line.strip()
+            if not stripped or stripped in SEPARATORS:
+                continue
+            indent = len(line.expandtabs()) - len(line.expandtabs().lstrip())
+            while stack[-1][0] >= indent:
+                stack.pop()
+            stack.append((indent, stack[-1][1].add(line)))
+    _seal(root)
+    return root
+
+def _order_group(key: Tuple[str, int], path: Tuple[str, ...]):
+    # All lines of a section are ordered together; top-level lines only within their group.
+    return tuple(key[0].split()[:ORDER_GROUP_WORDS]) if not path else None
+
+def _order_groups(section: Section, keys: Iterable[Tuple[str, int]], path: Tuple[str, ...]) -> Dict[Optional[tuple], List[Tuple[str, int]]]:
+    """Keys of leaf lines (no nested lines) by order group, in configuration order."""
+    groups = {}
+    for key in keys:
+        if not section.children[key].children:
+            groups.setdefault(_order_group(key, path), []).append(key)
+    return groups
+
+def diff_sections(old: Section, new: Section, path: Tuple[str, ...] = (), ordered: bool = True) -> List[Tuple[Tuple[str, ...], List[str]]]:
+    """(section path, '-'/'+' lines) for every section whose content differs; identical sections are skipped by hash.
+    With ordered, lines that only moved within their section (or, at the top level, among lines of their order
+    group) are reported too."""
+    changes = []
+    if old.digest == new.digest:
+        return changes
+    removed, added = [], []
+    for key, child in old.children.items():
+        if key not in new.children:
+            if child.children:
+                changes.append((path + (key[0],), ['-' + line for line in child.lines()]))
+            else:
+                removed.append('-' + child.line)
+    for key, child in new.children.items():
+        if key not in old.children:
+            if child.children:
+                changes.append((path + (key[0],), ['+' + line for line in child.lines()]))
+            else:
+                added.append('+' + child.line)
+    common_old = [key for key in old.children if key in new.children]
+    if ordered:
+        # Lines that only moved matter for ordered lines (ACLs, route maps); moved blocks do not.
+        groups_new = _order_groups(new, (key for key in new.children if key in old.children), path)
+        for group, leaves_old in _order_groups(old, common_old, path).items():
+            leaves_new = groups_new.get(group, [])
+            if leaves_old != leaves_new:
+                for tag, i1, i2, j1, j2 in SequenceMatcher(None, leaves_old, leaves_new, autojunk=False).get_opcodes():
+                    if tag != 'equal':
+                        removed.extend('-' + old.children[key].line for key in leaves_old[i1:i2])
+                        added.extend('+' + new.children[key].line for key in leaves_new[j1:j2])
+    if removed or added:
+        changes.insert(0, (path, removed + added))
+    for key in common_old:
+        changes.extend(diff_sections(old.children[key], new.children[key], path + (key[0],), ordered))
+    return changes
+
+def _top_level_blocks(lines: List[str], set_style: bool) -> Dict[Tuple[str, int], List[str]]:
+    """Split a configuration into top-level blocks (a header and its indented lines, or a set path) keyed like sections."""
+    blocks = {}
+    block = blocks.setdefault(('', 0), [])
+    for line in lines:
+        if not line:
+            continue
+        if set_style:
+            words = line.split()
+            key = (words[1] if len(words) > 2 else line.strip(), 0)
+            block = blocks.setdefault(key, [])
+        elif line[0] not in ' \t':
+            if line in SEPARATORS:
+                continue
+            key = (line, 0)
+            while key in blocks:
+                key = (key[0], key[1] + 1)
+            block = blocks[key] = []
+        block.append(line)
+    return blocks
+
+def _leaf_groups(blocks: Dict[Tuple[str, int], List[str]], other: Dict[Tuple[str, int], List[str]]) -> Dict[tuple, List[Tuple[str, int]]]:
+    groups = {}
+    for key, block in blocks.items():
+        if len(block) == 1 and key in other:
+            groups.setdefault(_order_group(key, ()), []).append(key)
+    return groups
+
+def _reordered_groups(old_blocks: Dict[Tuple[str, int], List[str]], new_blocks: Dict[Tuple[str, int], List[str]]) -> set:
+    """Order groups whose unchanged top-level lines appear in a different order."""
+    groups_new = _leaf_groups(new_blocks, old_blocks)
+    return {group for group, keys in _leaf_groups(old_blocks, new_blocks).items() if groups_new.get(group) != keys}
+
+def _in_groups(key: Tuple[str, int], block: List[str], groups: set) -> bool:
+    return bool(groups) and len(block) == 1 and _order_group(key, ()) in groups
+
+def config_changes(old_config: Union[str, Iterable[str]], new_config: Union[str, Iterable[str]],
+                   device_type: Optional[str] = None) -> List[Tuple[Tuple[str, ...], List[str]]]:
+    """(section path, '-'/'+' lines) per changed section. Identical top-level blocks are dropped before any parsing,
+    so the cost follows the size of the change."""
+    old_lines, new_lines = _text_lines(old_config), _text_lines(new_config)
+    # Parse both sides the same way even if one is empty; set-style lines are order-independent.
+    set_style = is_set_style(old_lines or new_lines, device_type)
+    old_blocks, new_blocks = _top_level_blocks(old_lines, set_style), _top_level_blocks(new_lines, set_style)
+    reordered = set() if set_style else _reordered_groups(old_blocks, new_blocks)
+    changed_old = [line for key, block in old_blocks.items() if new_blocks.get(key) != block or _in_groups(key, block, reordered)
+                   for line in block]
+    changed_new = [line for key, block in new_blocks.items() if old_blocks.get(key) != block or _in_groups(key, block, reordered)
+                   for line in block]
+    return diff_sections(parse_config(changed_old, set_style=set_style), parse_config(changed_new, set_style=set_style),
+                         ordered=not set_style)
+
+def section_diff(old_config: Union[str, Iterable[str]], new_config: Union[str, Iterable[str]], fromfile: str = 'old_config',
+                 tofile: str = 'new_config', device_type: Optional[str] = None) -> List[str]:
+    """Changes between two configurations grouped by section, as lines without newlines; empty when they match."""
+    changes = config_changes(old_config, new_config, device_type)
+    if not changes:
+        return []
+    output = [f'--- {fromfile}', f'+++ {tofile}']
+    for path, lines in changes:
+        output.append(f"@@ {' > '.join(path) if path else 'global'} @@")
+        output.extend(lines)
+    return output
@@ -0,0 +1,108 @@
+import os
+import hashlib
+import ipaddress
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Iterable
+
+DEPLOYED_DIR = 'deployed_configs'
+# Mode and commit commands sent around a deployment; they never appear in a running configuration.
+SESSION_LINES = {'!', '#', 'exit', 'end', 'commit', 'commit and-quit', 'return', 'quit'}
+NEGATIONS = ('no ', 'delete ', 'undo ')
+
+def _normalize(line: str) -> str:
+    return ' '.join(line.split())
+
+def _address_token(token: str) -> Optional[str]:
+    if not ('.' in token or ':' in token) or token[0] not in '0123456789abcdefABCDEF:':
+        return None
+    try:
+        return str(ipaddress.ip_interface(token)) if '/' in token else str(ipaddress.ip_address(token))
+    except ValueError:
+        return None
+
+def _canonical(line: str) -> str:
+    """A line with addresses in one form: 'address mask' and 'address/length' both become 'address/length',
+    and IPv6 addresses are compressed, so a deployed line matches however the vendor displays it."""
+    words = line.split()
+    result = []
+    index = 0
+    while index < len(words):
+        address = _address_token(words[index])
+        if address and '/' not in address and index + 1 < len(words) and '.' in words[index + 1]:
+            try:
+                result.append(str(ipaddress.ip_interface(f"{address}/{words[index + 1]}")))
+                index += 2
+                continue
+            except ValueError:
+                pass
+        result.append(address or words[index])
+        index += 1
+    return ' '.join(result)
+
+def line_hash(line: str) -> bytes:
+    return hashlib.blake2b(_canonical(line).encode(), digest_size=8).digest()
+
+def line_hashes(config: str) -> set:
+    """Hashes of every line of a configuration, with whitespace and addresses normalized."""
+    return {line_hash(line) for line in config.splitlines() if line.strip()}
+
+def expected_lines(config: str) -> Optional[List[str]]:
+    """Lines of a deployed configuration that must be present on the device, or None for a deactivation
+    (a configuration removing the service at the top level)."""
+    lines = []
+    for line in config.splitlines():
+        stripped = _normalize(line)
+        if not stripped or stripped in SESSION_LINES:
+            continue
+        if stripped.startswith(NEGATIONS):
+            if line[0] not in ' \t':
+                return None
+            continue
+        lines.append(stripped)
+    return lines
+
+def missing_lines(config: str, hashes: set) -> Optional[List[str]]:
+    """Lines of a deployed configuration absent from a device's line hashes; None for a deactivation."""
+    lines = expected_lines(config)
+    if lines is None:
+        return None
+    return [line for line in lines if line_hash(line) not in hashes]
+
+def latest_deployed_files(device_names: Iterable[str], directory: str = DEPLOYED_DIR) -> Dict[Tuple[str, str], str]:
+    """Path of the last configuration deployed per (customer, device), from one scan of deployed_configs/.
+
+    Files are named <customer>_<device>_<YYYYmmdd>_<HHMMSS>.txt; customer names may contain underscores,
+    so the device is recognized by name.
+    """
+    if not os.path.isdir(directory):
+        return {}
+    # Longest names first, so a device whose name ends another's is not mistaken for it.
+    device_names = sorted(device_names, key=len, reverse=True)
+    latest = {}
+    for file_name in os.listdir(directory):
+        if not file_name.endswith('.txt'):
+            continue
+        prefix, _, stamp = file_name[:-len('.txt')].rpartition('_')
+        prefix, _, date = prefix.rpartition('_')
+        try:
+            timestamp = datetime.strptime(f"{date}_{stamp}", '%Y%m%d_%H%M%S')
+        except ValueError:
+            continue
+        device = next((name for name in device_names if prefix.endswith(f"_{name}")), None)
+        if device is None:
+            continue
+        key = (prefix[:-len(device) - 1], device)
+        if key not in latest or timestamp > latest[key][0]:
+            latest[key] = (timestamp, os.path.join(directory, file_name))
+    return {key: path for key, (_timestamp, path) in latest.items()}
+
+def latest_deployed_influxdb(query_api, bucket: str, org: Optional[str] = None) -> Dict[Tuple[str, str], str]:
+    """Content of the last configuration deployed per (customer, device), from the deployed_configs measurement."""
+    query = (f'from(bucket:"{bucket}") |> range(start: 0) '
+             '|> filter(fn: (r) => r._measurement == "deployed_configs" and r._field == "config_content") '
+             '|> group(columns: ["customer_name", "device_name"]) |> sort(columns: ["_time"]) |> last()')
+    latest = {}
+    for table in query_api.query(query, org=org):
+        for record in table.records:
+            latest[(record.values['customer_name'], record.values['device_name'])] = record.get_value()
+    return latest
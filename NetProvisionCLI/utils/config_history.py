@@ -0,0 +1,193 @@
+import json
+from difflib import SequenceMatcher
+from datetime import datetime, timezone
+from typing import Optional, List, Tuple, Callable
+from bson.binary import Binary
+from pymongo.errors import DuplicateKeyError
+from utils.config_diff import section_diff, config_changes
+from utils.config_archive import (compress_config, decompress_config, store_compressed_blob_mongodb, read_blob_mongodb, load_config_document,
+                                  latest_digest_file, read_blob_file, load_config_file)
+from utils.backup_catalog import latest_config_path
+from utils.mongo_utils import get_database
+
+HISTORY_COLLECTION = 'deviceConfig'
+DEFAULT_KEYFRAME_INTERVAL = 30
+# Larger configurations are always stored as keyframes, so they are never decompressed into memory for diffing.
+DELTA_MAX_SIZE = 4 * 1024 * 1024
+# Documents marked for deletion by retention carry expire_at until the TTL monitor removes them; readers skip them.
+EXPIRE_FIELD = 'expire_at'
+LIVE = {EXPIRE_FIELD: {'$exists': False}}
+# Concurrent backups of one device race for the next version; the loser recomputes against the winner.
+MAX_VERSION_RETRIES = 5
+
+# deviceConfig documents, one per backup:
+#   keyframe: {device_name, timestamp, version, hash, changed: True, kind: 'keyframe', keyframe_version: version}
+#             full content in deviceConfigBlobs under hash
+#   delta:    {..., kind: 'delta', base_version, keyframe_version, delta: zstd(JSON line ops against base_version)}
+#   pointer:  {..., changed: False, version: latest content version}  (backup identical to the previous one)
+# version counts content changes per device, so a delta always applies to version - 1.
+
+def compute_delta(old_lines: List[str], new_lines: List[str]) -> List[list]:
+    """Line ops [start, end, replacement lines] turning old_lines into new_lines, with offsets into old_lines."""
+    return [[i1, i2, new_lines[j1:j2]] for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes()
+            if tag != 'equal']
+
+def apply_delta(old_lines: List[str], ops: List[list]) -> List[str]:
+    result = []
+    position = 0
+    for start, end, replacement in ops:
+        result.extend(old_lines[position:start])
+        result.extend(replacement)
+        position = end
+    result.extend(old_lines[position:])
+    return result
+
+def _encode_delta(ops: List[list]) -> Binary:
+    return Binary(compress_config(json.dumps(ops, separators=(',', ':'))))
+
+def _decode_delta(data: bytes) -> List[list]:
+    return json.loads(decompress_config(data))
+
+def _latest_content(db, device_name: str) -> Optional[dict]:
+    return db[HISTORY_COLLECTION].find_one({'device_name': device_name, 'changed': {'$ne': False}, **LIVE}, sort=[('timestamp', -1)])
+
+def store_version_stream(db, device_name: str, spool, digest: str, size: int,
+                         keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL) -> dict:
+    """Record a backup already compressed into a spool file (see spool_config) as a pointer (unchanged), a delta
+    against the previous version, or a new keyframe. Unchanged backups never read the spool back, and oversized ones
+    are stored without decompressing it."""
+    def compressed():
+        spool.seek(0)
+        return spool.read()
+    return _store_version(db, device_name, digest, size, lambda: decompress_config(compressed()), compressed, keyframe_interval)
+
+def _store_version(db, device_name: str, digest: str, size: int, normalized: Callable[[], str],
+                   compressed: Callable[[], bytes], keyframe_interval: int) -> dict:
+    for _ in range(MAX_VERSION_RETRIES):
+        try:
+            return _insert_version(db, device_name, digest, size, normalized, compressed, keyframe_interval)
+        except DuplicateKeyError:
+            # The unique (device_name, version) index rejected a version another backup stored first.
+            continue
+    raise RuntimeError(f"Could not store a new version for {device_name} after {MAX_VERSION_RETRIES} attempts.")
+
+def _insert_version(db, device_name: str, digest: str, size: int, normalized: Callable[[], str],
+                    compressed: Callable[[], bytes], keyframe_interval: int) -> dict:
+    collection = db[HISTORY_COLLECTION]
+    previous = _latest_content(db, device_name)
+    timestamp = datetime.now(timezone.utc)
+
+    if previous and previous.get('hash') == digest and 'version' in previous:
+        document = {'device_name': device_name, 'timestamp': timestamp, 'hash': digest, 'changed': False,
+                    'version': previous['version']}
+        collection.insert_one(document)
+        return document
+
+    # Documents marked for expiry still hold their version numbers until the TTL monitor removes them.
+    highest = collection.find_one({'device_name': device_name, 'changed': True, 'version': {'$exists': True}},
+                                  {'version': 1}, sort=[('version', -1)])
+    version = highest['version'] + 1 if highest else 1
+    document = {'device_name': device_name, 'timestamp': timestamp, 'hash': digest, 'changed': True, 'version': version}
+    # A delta always applies to version - 1, so a gap after expired versions starts a new keyframe.
+    keyframe = (previous is None or 'version' not in previous or previous['version'] != version - 1 or size > DELTA_MAX_SIZE
+                or version - previous.get('keyframe_version', previous['version']) >= keyframe_interval)
+    if not keyframe:
+        new_lines = normalized().splitlines(keepends=True)
+        ops = compute_delta(list(load_version_lines(db, device_name, previous['version'])), new_lines)
+        delta = _encode_delta(ops)
+        # A delta larger than half the compressed size of a full copy is not worth chaining.
+        if len(delta) * 2 < len(compressed()):
+            document.update({'kind': 'delta', 'base_version': previous['version'],
+                             'keyframe_version': previous['keyframe_version'], 'delta': delta})
+        else:
+            keyframe = True
+    if keyframe:
+        store_compressed_blob_mongodb(db, digest, compressed(), size)
+        document.update({'kind': 'keyframe', 'keyframe_version': version})
+    collection.insert_one(document)
+    return document
+
+# Recently reconstructed versions, keyed by (database, device, version, hash).
+_version_cache = {}
+VERSION_CACHE_SIZE = 256
+
+def _remember(key, lines: Tuple[str, ...]) -> None:
+    if len(_version_cache) >= VERSION_CACHE_SIZE:
+        _version_cache.pop(next(iter(_version_cache)))
+    _version_cache[key] = lines
+
+def _chain_documents(db, device_name: str, from_version: int, to_version: int) -> List[dict]:
+    return list(db[HISTORY_COLLECTION].find(
+        {'device_name': device_name, 'changed': True, 'version': {'$gte': from_version, '$lte': to_version}, **LIVE},
+        sort=[('version', 1)]))
+
+def _roll_forward(db, lines: List[str], documents: List[dict], device_name: str, version: Optional[int] = None) -> List[str]:
+    """Apply documents in version order to lines, the content of version (None for no content yet)."""
+    for document in documents:
+        if document.get('kind') != 'keyframe' and document.get('base_version') != version:
+            raise RuntimeError(f"Version {document['version']} of {device_name} is a delta against missing version {document.get('base_version')}.")
+        version = document['version']
+        if document.get('kind') == 'keyframe':
+            content = read_blob_mongodb(db, document['hash'])
+            if content is None:
+                raise RuntimeError(f"Configuration blob {document['hash']} of {device_name} version {document['version']} is missing.")
+            lines = content.splitlines(keepends=True)
+        else:
+            lines = apply_delta(lines, _decode_delta(document['delta']))
+        _remember((db.name, device_name, document['version'], document['hash']), tuple(lines))
+    return lines
+
+def load_version_lines(db, device_name: str, version: int) -> Tuple[str, ...]:
+    """Reconstruct a content version: its keyframe plus the deltas after it, fetched in one indexed query."""
+    target = db[HISTORY_COLLECTION].find_one({'device_name': device_name, 'changed': True, 'version': version, **LIVE})
+    if target is None:
+        return ()
+    cached = _version_cache.get((db.name, device_name, version, target['hash']))
+    if cached is not None:
+        return cached
+    keyframe_version = target.get('keyframe_version', version)
+    documents = _chain_documents(db, device_name, keyframe_version, version)
+    if [document['version'] for document in documents] != list(range(keyframe_version, version + 1)):
+        raise RuntimeError(f"Version chain {keyframe_version}-{version} of {device_name} is incomplete.")
+    return tuple(_roll_forward(db, [], documents, device_name))
+
+def load_document_config(db, document: dict) -> Optional[str]:
+    """Configuration text for any deviceConfig document: versioned (keyframe, delta or pointer) or legacy."""
+    if 'version' not in document:
+        return load_config_document(db, document)
+    return ''.join(load_version_lines(db, document['device_name'], document['version']))
+
+def load_latest_config(device_name: str, settings: dict) -> Optional[str]:
+    """Latest stored configuration of a device from whichever backend the settings select, or None if it has none."""
+    if settings['data_source'] == 'yaml':
+        digest = latest_digest_file(device_name)
+        if digest:
+            return read_blob_file(digest)
+        config_path = latest_config_path(device_name)
+        return load_config_file(config_path) if config_path else None
+    db = get_database(settings['mongodb_connection']['uri'], settings['mongodb_connection']['database_name'])
+    document = db[HISTORY_COLLECTION].find_one({'device_name': device_name, **LIVE}, {'delta': 0}, sort=[('timestamp', -1)])
+    return load_document_config(db, document) if document else None
+
+def _document_pair_lines(db, document1: dict, document2: dict) -> Tuple[List[str], List[str]]:
+    """Both backups' lines. Nearby versions of one device are reconstructed by rolling the older one forward
+    through the stored deltas instead of reconstructing both versions independently."""
+    if ('version' in document1 and 'version' in document2 and document1['device_name'] == document2['device_name']
+            and document1['version'] <= document2['version']):
+        device_name = document1['device_name']
+        old_lines = list(load_version_lines(db, device_name, document1['version']))
+        new_lines = old_lines
+        if document2['version'] > document1['version']:
+            new_lines = _roll_forward(db, old_lines, _chain_documents(db, device_name, document1['version'] + 1, document2['version']),
+                                      device_name, document1['version'])
+        return old_lines, new_lines
+    return ((load_document_config(db, document1) or '').splitlines(keepends=True),
+            (load_document_config(db, document2) or '').splitlines(keepends=True))
+
+def diff_documents(db, document1: dict, document2: dict, fromfile: str, tofile: str) -> List[str]:
+    """Section-grouped diff between two backups."""
+    return section_diff(*_document_pair_lines(db, document1, document2), fromfile=fromfile, tofile=tofile)
+
+def document_changes(db, document1: dict, document2: dict) -> List[Tuple[Tuple[str, ...], List[str]]]:
+    """Changed sections between two backups, as returned by config_changes."""
+    return config_changes(*_document_pair_lines(db, document1, document2))
@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Iterable
+from utils.config_archive import BLOB_COLLECTION, store_blob_mongodb
+from utils.config_history import HISTORY_COLLECTION, EXPIRE_FIELD, LIVE, load_version_lines
+
+# Backups younger than the first tier are all kept; older ones are thinned to the latest backup per bucket of the
+# tier covering their age, and backups older than expire_after_days are dropped. The newest backup of a device is always kept.
+DEFAULT_TIERS = [
+    {'older_than_days': 1, 'keep': 'daily'},
+    {'older_than_days': 30, 'keep': 'weekly'},
+    {'older_than_days': 365, 'keep': 'monthly'},
+]
+DEFAULT_EXPIRE_AFTER_DAYS = 1095
+DEFAULT_BATCH_SIZE = 500
+# Blobs younger than this are never collected, so a backup being written cannot lose its blob.
+BLOB_GRACE = timedelta(days=1)
+
+BUCKETS = {
+    'daily': lambda timestamp: timestamp.date(),
+    'weekly': lambda timestamp: tuple(timestamp.isocalendar())[:2],
+    'monthly': lambda timestamp: (timestamp.year, timestamp.month),
+}
+
+# Metadata needed to decide retention; delta payloads and legacy embedded configs are never loaded.
+METADATA = {'timestamp': 1, 'version': 1, 'changed': 1, 'kind': 1, 'keyframe_version': 1, 'hash': 1}
+
+def retention_settings(settings: dict) -> dict:
+    retention = settings.get('retention') or {}
+    return {
+        'tiers': sorted(retention.get('tiers') or DEFAULT_TIERS, key=lambda tier: tier['older_than_days']),
+        'expire_after_days': retention.get('expire_after_days', DEFAULT_EXPIRE_AFTER_DAYS),
+        'batch_size': retention.get('batch_size', DEFAULT_BATCH_SIZE),
+    }
+
+def _utc(timestamp: datetime) -> datetime:
+    """Naive UTC, whether the driver returned an aware or a naive datetime."""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+def select_retained(documents: List[dict], now: datetime, tiers: List[dict], expire_after_days: int) -> set:
+    """_ids of the backups a device keeps; documents must be sorted by timestamp."""
+    retained = set()
+    bucket_latest = {}
+    for document in documents:
+        timestamp = _utc(document['timestamp'])
+        age_days = (now - timestamp).total_seconds() / 86400
+        if age_days >= expire_after_days:
+            continue
+        tier = None
+        for index, candidate in enumerate(tiers):
+            if age_days >= candidate['older_than_days']:
+                tier = index
+        if tier is None:
+            retained.add(document['_id'])
+        else:
+            # Later documents overwrite earlier ones, leaving the latest backup of each bucket.
+            bucket_latest[(tier, BUCKETS[tiers[tier]['keep']](timestamp))] = document['_id']
+    retained.update(bucket_latest.values())
+    if documents:
+        retained.add(documents[-1]['_id'])
+    return retained
+
+def expire_documents(collection, ids: Iterable, now: datetime, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Mark documents for the TTL monitor in batches of batch_size; returns how many were marked."""
+    ids = list(ids)
+    marked = 0
+    for start in range(0, len(ids), batch_size):
+        result = collection.update_many({'_id': {'$in': ids[start:start + batch_size]}, **LIVE}, {'$set': {EXPIRE_FIELD: now}})
+        marked += result.modified_count
+    return marked
+
+def _make_keyframe(db, device_name: str, document: dict) -> None:
+    """Rewrite a delta as a self-contained keyframe before its base versions go away."""
+    store_blob_mongodb(db, document['hash'], ''.join(load_version_lines(db, device_name, document['version'])))
+    db[HISTORY_COLLECTION].update_one({'_id': document['_id']},
+                                      {'$set': {'kind': 'keyframe', 'keyframe_version': document['version']},
+                                       '$unset': {'delta': '', 'base_version': ''}})
+
+def compact_device(db, device_name: str, now: datetime, tiers: List[dict], expire_after_days: int,
+                   batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+    """Thin one device's history to its retention tiers. Kept deltas whose base is dropped become keyframes first,
+    so every remaining backup stays reconstructable; dropped documents are only marked and left to the TTL index."""
+    collection = db[HISTORY_COLLECTION]
+    documents = list(collection.find({'device_name': device_name, **LIVE}, METADATA).sort('timestamp', 1))
+    retained = select_retained(documents, now, tiers, expire_after_days)
+    needed_versions = {document['version'] for document in documents if document['_id'] in retained and 'version' in document}
+
+    keyframes = 0
+    keyframe_of = {}
+    for document in sorted((document for document in documents if document.get('changed') and 'version' in document),
+                           key=lambda document: document['version']):
+        version = document['version']
+        if version not in needed_versions:
+            continue
+        retained.add(document['_id'])
+        if document.get('kind') == 'delta':
+            if version - 1 not in keyframe_of:
+                _make_keyframe(db, device_name, document)
+                keyframes += 1
+                keyframe_of[version] = version
+                continue
+            if document.get('keyframe_version') != keyframe_of[version - 1]:
+                collection.update_one({'_id': document['_id']}, {'$set': {'keyframe_version': keyframe_of[version - 1]}})
+            keyframe_of[version] = keyframe_of[version - 1]
+        else:
+            keyframe_of[version] = version
+
+    expired = expire_documents(collection, (document['_id'] for document in documents if document['_id'] not in retained),
+                               now, batch_size)
+    return {'kept': len(retained), 'expired': expired, 'keyframes': keyframes}
+
+def collect_blobs(db, now: datetime, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Mark content blobs no live backup references. Returns the number of blobs marked.
+
+    References are looked up per batch of candidate blobs through the hash index, so the set of referenced hashes
+    is never materialized (a distinct over all of deviceConfig would exceed the 16 MB result limit on large fleets).
+    """
+    blobs = db[BLOB_COLLECTION]
+    cursor = blobs.find({'created': {'$lt': now - BLOB_GRACE}, **LIVE}, {'_id': 1}).batch_size(batch_size)
+    candidates = [blob['_id'] for blob in cursor]
+    marked = 0
+    for start in range(0, len(candidates), batch_size):
+        batch = candidates[start:start + batch_size]
+        referenced = set(db[HISTORY_COLLECTION].distinct('hash', {'hash': {'$in': batch}, **LIVE}))
+        batch = [blob_id for blob_id in batch if blob_id not in referenced]
+        if not batch:
+            continue
+        marked += blobs.update_many({'_id': {'$in': batch}, **LIVE}, {'$set': {EXPIRE_FIELD: now}}).modified_count
+        # A backup may have started referencing a blob since the scan; give those back.
+        reused = db[HISTORY_COLLECTION].distinct('hash', {'hash': {'$in': batch}, **LIVE})
+        if reused:
+            marked -= blobs.update_many({'_id': {'$in': reused}}, {'$unset': {EXPIRE_FIELD: ''}}).modified_count
+    return marked
+
+def run_retention(db, settings: dict, devices: Optional[List[str]] = None) -> Dict[str, int]:
+    """Compact every device (or the given ones) one at a time, then collect orphaned blobs."""
+    options = retention_settings(settings)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    totals = {'devices': 0, 'kept': 0, 'expired': 0, 'keyframes': 0, 'blobs': 0}
+    for device_name in devices or sorted(db[HISTORY_COLLECTION].distinct('device_name', LIVE)):
+        result = compact_device(db, device_name, now, options['tiers'], options['expire_after_days'], options['batch_size'])
+        totals['devices'] += 1
+        for key, value in result.items():
+            totals[key] += value
+    totals['blobs'] = collect_blobs(db, now, options['batch_size'])
+    return totals
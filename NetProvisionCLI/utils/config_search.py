@@ -0,0 +1,114 @@
+import os
+import sqlite3
+from typing import Optional, List, Tuple, Iterable
+
+SEARCH_PATH = os.path.join('device_configs', 'search.db')
+MIN_TRIGRAM = 3
+
+# Every distinct configuration line is stored once and indexed by trigrams. A posting records that a device's
+# configuration contained a line from first_version to last_version (NULL while it still does), so history costs
+# one row per line change rather than one row per line per backup.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL UNIQUE
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts USING fts5(text, content='lines', content_rowid='id', tokenize='trigram');
+CREATE TABLE IF NOT EXISTS versions (
+    device TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    timestamp TEXT,
+    PRIMARY KEY (device, version)
+);
+CREATE TABLE IF NOT EXISTS postings (
+    line_id INTEGER NOT NULL,
+    device TEXT NOT NULL,
+    first_version INTEGER NOT NULL,
+    last_version INTEGER
+);
+CREATE INDEX IF NOT EXISTS postings_line ON postings (line_id, device);
+CREATE INDEX IF NOT EXISTS postings_current ON postings (device, last_version);
+"""
+
+_connections = {}
+
+def get_search_index(path: str = SEARCH_PATH) -> sqlite3.Connection:
+    connection = _connections.get(path)
+    if connection is None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = sqlite3.connect(path)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(SCHEMA)
+        _connections[path] = connection
+    return connection
+
+def latest_indexed(connection: sqlite3.Connection, device: str) -> Tuple[int, Optional[str]]:
+    row = connection.execute('SELECT version, hash FROM versions WHERE device = ? ORDER BY version DESC LIMIT 1', (device,)).fetchone()
+    return (row[0], row[1]) if row else (0, None)
+
+def _line_ids(connection: sqlite3.Connection, texts: set) -> set:
+    ids = set()
+    texts = list(texts)
+    for start in range(0, len(texts), 500):
+        batch = texts[start:start + 500]
+        placeholders = ','.join('?' * len(batch))
+        known = dict(connection.execute(f'SELECT text, id FROM lines WHERE text IN ({placeholders})', batch).fetchall())
+        new_texts = [text for text in batch if text not in known]
+        if new_texts:
+            connection.executemany('INSERT INTO lines (text) VALUES (?)', [(text,) for text in new_texts])
+            added = connection.execute(f"SELECT id, text FROM lines WHERE text IN ({','.join('?' * len(new_texts))})", new_texts).fetchall()
+            connection.executemany('INSERT INTO lines_fts (rowid, text) VALUES (?, ?)', added)
+            ids.update(line_id for line_id, _ in added)
+        ids.update(known.values())
+    return ids
+
+def index_version(connection: sqlite3.Connection, device: str, digest: str, timestamp: Optional[str], lines: Iterable[str]) -> bool:
+    """Index a device's new configuration content. Returns False when it matches the latest indexed version."""
+    version, latest_hash = latest_indexed(connection, device)
+    if latest_hash == digest:
+        return False
+    with connection:
+        new_ids = _line_ids(connection, {line.strip() for line in lines if line.strip()})
+        current = {row[0] for row in connection.execute('SELECT line_id FROM postings WHERE device = ? AND last_version IS NULL', (device,))}
+        version += 1
+        connection.execute('INSERT INTO versions (device, version, hash, timestamp) VALUES (?, ?, ?, ?)', (device, version, digest, timestamp))
+        connection.executemany('UPDATE postings SET last_version = ? WHERE device = ? AND line_id = ? AND last_version IS NULL',
+                               [(version - 1, device, line_id) for line_id in current - new_ids])
+        connection.executemany('INSERT INTO postings (line_id, device, first_version) VALUES (?, ?, ?)',
+                               [(line_id, device, version) for line_id in new_ids - current])
+    return True
+
+def reset_search_index(connection: sqlite3.Connection) -> None:
+    with connection:
+        for table in ('postings', 'versions', 'lines'):
+            connection.execute(f'DELETE FROM {table}')
+        connection.execute("INSERT INTO lines_fts (lines_fts) VALUES ('delete-all')")
+
+def _matching_lines(connection: sqlite3.Connection, pattern: str) -> List[int]:
+    if len(pattern) >= MIN_TRIGRAM:
+        phrase = '"' + pattern.replace('"', '""') + '"'
+        return [row[0] for row in connection.execute('SELECT rowid FROM lines_fts WHERE lines_fts MATCH ?', (phrase,))]
+    # Patterns shorter than a trigram cannot use the index.
+    return [row[0] for row in connection.execute('SELECT id FROM lines WHERE instr(lower(text), lower(?)) > 0', (pattern,))]
+
+def search(connection: sqlite3.Connection, pattern: str, history: bool = False,
+           device: Optional[str] = None) -> List[Tuple[str, str, Optional[str], Optional[str]]]:
+    """Lines containing pattern (case-insensitive) as (device, line, added, removed) rows with backup timestamps.
+    Without history only current configurations are searched; removed is None while a line is still present."""
+    line_ids = _matching_lines(connection, pattern)
+    rows = []
+    for start in range(0, len(line_ids), 500):
+        batch = line_ids[start:start + 500]
+        query = ('SELECT p.device, l.text, first.timestamp, last.timestamp FROM postings p JOIN lines l ON l.id = p.line_id '
+                 'LEFT JOIN versions first ON first.device = p.device AND first.version = p.first_version '
+                 'LEFT JOIN versions last ON last.device = p.device AND last.version = p.last_version + 1 '
+                 f"WHERE p.line_id IN ({','.join('?' * len(batch))})")
+        parameters = list(batch)
+        if not history:
+            query += ' AND p.last_version IS NULL'
+        if device:
+            query += ' AND p.device = ?'
+            parameters.append(device)
+        rows.extend(connection.execute(query, parameters).fetchall())
+    return sorted(rows, key=lambda row: (row[0], row[2] or '', row[1]))
@@ -0,0 +1,91 @@
+import re
+from datetime import datetime, timedelta
+from typing import Optional, List, Tuple, Iterable
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+
+SUMMARY_COLLECTION = 'deployment_summaries'
+DEFAULT_PAGE_SIZE = 100
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+# deployment_summaries documents, one per deployment and customer (bulk deployments can share a deployment ID):
+#   {deployment_id, customer_name, operator, devices, status: 'success' | 'failed', duration, timestamp, error}
+# Listing pages through them newest first on (timestamp, _id), so every page is an index range scan.
+
+def summary_document(deployment_id: str, customer_name: str, operator: str, devices: List[str], status: str,
+                     duration: Optional[float], timestamp: datetime, error: Optional[str] = None) -> dict:
+    return {
+        'deployment_id': deployment_id,
+        'customer_name': customer_name,
+        'operator': operator,
+        'devices': sorted(set(devices)),
+        'status': status,
+        'duration': round(duration, 2) if duration is not None else None,
+        'timestamp': timestamp,
+        'error': error,
+    }
+
+def record_deployment(db, summary: dict) -> None:
+    """Write the summary of one deployment; recording the same deployment again replaces it."""
+    db[SUMMARY_COLLECTION].update_one({'deployment_id': summary['deployment_id'], 'customer_name': summary['customer_name']},
+                                      {'$set': summary}, upsert=True)
+
+def encode_cursor(document: dict) -> str:
+    return f"{document['timestamp'].strftime(CURSOR_TIME_FORMAT)}-{document['_id']}"
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """(timestamp, _id) of the last summary of the previous page; raises ValueError for a malformed cursor."""
+    timestamp, _, document_id = cursor.partition('-')
+    try:
+        return datetime.strptime(timestamp, CURSOR_TIME_FORMAT), ObjectId(document_id)
+    except InvalidId as e:
+        raise ValueError(str(e))
+
+def list_summaries(db, customer: Optional[str] = None, date: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                   cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """One page of summaries, newest first, and the cursor of the next page (None on the last page)."""
+    conditions = []
+    if customer:
+        conditions.append({'customer_name': customer})
+    if date:
+        start = datetime.strptime(date, '%Y-%m-%d')
+        conditions.append({'timestamp': {'$gte': start, '$lt': start + timedelta(days=1)}})
+    if cursor:
+        timestamp, last_id = decode_cursor(cursor)
+        conditions.append({'$or': [{'timestamp': {'$lt': timestamp}}, {'timestamp': timestamp, '_id': {'$lt': last_id}}]})
+    query = conditions[0] if len(conditions) == 1 else {'$and': conditions} if conditions else {}
+    # One extra document tells whether another page follows without counting.
+    documents = list(db[SUMMARY_COLLECTION].find(query).sort([('timestamp', -1), ('_id', -1)]).limit(limit + 1))
+    next_cursor = encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+    return documents[:limit], next_cursor
+
+def _elapsed_seconds(entry: dict) -> Optional[float]:
+    match = re.search(r'([\d.]+) seconds', entry.get('elapsed_time') or '')
+    return float(match.group(1)) if match else None
+
+def summaries_from_audit_logs(records: Iterable[Tuple[datetime, str, str, str, dict]]) -> List[dict]:
+    """Summaries rebuilt from audit_logs records given as (time, deployment_id, customer_name, operator, entry)."""
+    grouped = {}
+    for time, deployment_id, customer_name, operator, entry in records:
+        summary = grouped.setdefault((deployment_id, customer_name), {'operator': operator, 'devices': [], 'durations': [], 'timestamp': time})
+        summary['timestamp'] = min(summary['timestamp'], time)
+        if entry.get('device_name'):
+            summary['devices'].append(entry['device_name'])
+        if _elapsed_seconds(entry) is not None:
+            summary['durations'].append(_elapsed_seconds(entry))
+    # Audit entries are only written for deployments that completed.
+    return [summary_document(deployment_id, customer_name, summary['operator'], summary['devices'], 'success',
+                             max(summary['durations']) if summary['durations'] else None, summary['timestamp'])
+            for (deployment_id, customer_name), summary in sorted(grouped.items())]
+
+def rebuild_summaries(db, summaries: List[dict]) -> int:
+    """Upsert rebuilt summaries with one bulk_write; returns how many were written."""
+    if not summaries:
+        return 0
+    db[SUMMARY_COLLECTION].bulk_write(
+        [UpdateOne({'deployment_id': summary['deployment_id'], 'customer_name': summary['customer_name']}, {'$set': summary}, upsert=True)
+         for summary in summaries],
+        ordered=False
+    )
+    return len(summaries)
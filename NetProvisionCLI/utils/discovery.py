@@ -0,0 +1,213 @@
+import os
+import ipaddress
+from typing import Optional, Dict, List, Tuple
+from ttp import ttp
+from utils.config_history import load_latest_config
+
+TEMPLATE_DIR = os.path.join('templates', 'discovery')
+
+def load_templates(directory: str = TEMPLATE_DIR) -> Dict[str, str]:
+    """TTP discovery templates keyed by device type (the file name without .ttp)."""
+    templates = {}
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith('.ttp'):
+            with open(os.path.join(directory, file_name), 'r') as file:
+                templates[file_name[:-len('.ttp')]] = file.read()
+    return templates
+
+def _as_list(value) -> List[dict]:
+    # TTP returns a dict for a single match and a list for several.
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+def _interface_address(value: Optional[str]) -> Optional[str]:
+    """'address/length' for 'address/length' or 'address mask', None if value is not an interface address."""
+    if not value:
+        return None
+    try:
+        return str(ipaddress.ip_interface('/'.join(value.split())))
+    except ValueError:
+        return None
+
+def _split_service_name(description: str, circuit_id: Optional[int] = None) -> Tuple[str, Optional[int]]:
+    # Provisioned services are described as <customer name>-<service instance id>.
+    name, _, suffix = description.rpartition('-')
+    if name and suffix.isdigit() and (circuit_id is None or int(suffix) == circuit_id):
+        return name, int(suffix)
+    return description, circuit_id
+
+def _access_services(result: dict) -> List[dict]:
+    contexts = {}
+    for xconnect in _as_list(result.get('xconnects')):
+        contexts[xconnect['context']] = ('p2p', xconnect)
+    for vfi in _as_list(result.get('vfis')):
+        contexts[vfi['context']] = ('p2mp', vfi)
+    services = []
+    for interface in _as_list(result.get('interfaces')):
+        for instance in _as_list(interface.get('service_instances')):
+            service_type, context = contexts.get(instance.get('description'), (None, {}))
+            if 'peer' not in context or 'pw_id' not in context:
+                continue
+            name, circuit_id = _split_service_name(instance['description'], instance['service_instance_id'])
+            services.append({
+                'name': name,
+                'service_type': service_type,
+                'interface': interface['interface'],
+                'circuit_id': circuit_id,
+                'vlan_id': instance.get('vlan_id'),
+                'vlan_id_outer': instance.get('vlan_id_outer'),
+                'qos_input': instance.get('qos_input'),
+                'qos_output': instance.get('qos_output'),
+                'peer': context['peer'],
+                'pw_id': context['pw_id'],
+            })
+    return services
+
+def _pe_service(name: str, peer: str, pw_id: int, ipv4_address: Optional[str], ipv6_address: Optional[str],
+                routes: List[dict]) -> dict:
+    service = {'name': name, 'peer': peer, 'pw_id': pw_id,
+               'irb_ipaddr': _interface_address(ipv4_address), 'irb_ipv6addr': _interface_address(ipv6_address),
+               'ipv4_lan': None, 'ipv4_nexthop': None, 'ipv6_lan': None, 'ipv6_nexthop': None}
+    for route in routes:
+        try:
+            network = ipaddress.ip_network(route['network'], strict=False)
+        except ValueError:
+            continue
+        family = f'ipv{network.version}'
+        if service[f'{family}_lan'] is None:
+            service[f'{family}_lan'] = str(network)
+            service[f'{family}_nexthop'] = route['next_hop']
+    return service
+
+def _xr_services(result: dict) -> List[dict]:
+    bvis = {bvi['interface']: bvi for bvi in _as_list(result.get('bvis'))}
+    routes = {}
+    for route in _as_list(result.get('static_routes')):
+        routes.setdefault(route.get('description'), []).append(route)
+    services = []
+    for domain in _as_list(result.get('bridge_domains')):
+        if 'peer' not in domain or 'pw_id' not in domain:
+            continue
+        bvi = bvis.get(domain.get('routed_interface'), {})
+        # XR shows IPv4 interface addresses as 'address mask'; configurations pushed as address/length have no mask.
+        ipv4_address = ' '.join(filter(None, (bvi.get('ipv4_address'), bvi.get('ipv4_mask'))))
+        services.append(_pe_service(domain['name'], domain['peer'], domain['pw_id'], ipv4_address,
+                                    bvi.get('ipv6_address'), routes.get(domain['name'], [])))
+    return services
+
+def _address_in(address: str, network) -> bool:
+    try:
+        return ipaddress.ip_address(address) in network
+    except ValueError:
+        return False
+
+def _junos_services(result: dict) -> List[dict]:
+    instances = {}
+    for group in ('instance_types', 'routing_interfaces', 'vpls_ids', 'vpls_neighbors'):
+        for match in _as_list(result.get(group)):
+            instances.setdefault(match['name'], {}).update(match)
+    irb_addresses = {}
+    for match in _as_list(result.get('irb_addresses')):
+        irb_addresses.setdefault(f"irb.{match['unit']}", {}).setdefault(match['family'], match['address'])
+    routes = _as_list(result.get('static_routes'))
+    services = []
+    for name, instance in sorted(instances.items()):
+        if instance.get('instance_type') != 'vpls' or 'peer' not in instance or 'pw_id' not in instance:
+            continue
+        addresses = irb_addresses.get(instance.get('routing_interface'), {})
+        subnets = [ipaddress.ip_interface(address).network for address in filter(None, map(_interface_address, addresses.values()))]
+        # Junos static routes carry no description; a route belongs to the instance whose IRB subnet holds its next hop.
+        own_routes = [route for route in routes if any(_address_in(route['next_hop'], subnet) for subnet in subnets)]
+        services.append(_pe_service(name, instance['peer'], instance['pw_id'], addresses.get('inet'),
+                                    addresses.get('inet6'), own_routes))
+    return services
+
+# Device types with a discovery template, the side of the service they hold and how their TTP results become services.
+# huawei_vrp has no usable provisioning template to infer services from yet.
+EXTRACTORS = {
+    'cisco_xe': ('access', _access_services),
+    'cisco_xr': ('pe', _xr_services),
+    'juniper_junos': ('pe', _junos_services),
+}
+
+def parse_device_config(config: str, device_type: str, templates: Dict[str, str]) -> Tuple[str, List[dict]]:
+    """(side, services) found in one configuration; side is 'access' or 'pe'."""
+    side, extract = EXTRACTORS[device_type]
+    parser = ttp(data=config, template=templates[device_type])
+    parser.parse()
+    results = parser.result()
+    result = results[0][0] if results and results[0] else {}
+    return side, extract(result or {})
+
+# Templates loaded once per discovery worker process
+_templates = None
+
+def init_discovery_worker(templates: Dict[str, str]) -> None:
+    global _templates
+    _templates = templates
+
+def discover_device_job(job: Tuple[str, str, dict]) -> Tuple[str, Optional[Tuple[str, List[dict]]], Optional[str]]:
+    """Worker entry point: returns (device, (side, services), error) for a device's latest stored configuration."""
+    device, device_type, settings = job
+    try:
+        config = load_latest_config(device, settings)
+        if config is None:
+            return device, None, "No stored configuration"
+        return device, parse_device_config(config, device_type, _templates), None
+    except Exception as e:
+        return device, None, str(e)
+
+def build_customers(discovered: Dict[str, Tuple[str, List[dict]]],
+                    inventory: Dict[str, dict]) -> Tuple[List[Tuple[str, dict]], List[Tuple[str, str]]]:
+    """Join access services with the PE service at the far end of their pseudowire into customer records shaped like
+    transformed recipes. Returns ([(source, customer_data)], [(source, problem)])."""
+    device_by_loopback = {details['loopback']: name for name, details in inventory.items() if details.get('loopback')}
+    pe_services = {}
+    for device, (side, services) in discovered.items():
+        if side == 'pe':
+            for service in services:
+                pe_services[(device, service['peer'], service['pw_id'])] = service
+
+    customers = []
+    problems = []
+    for device, (side, services) in sorted(discovered.items()):
+        if side != 'access':
+            continue
+        loopback = inventory.get(device, {}).get('loopback')
+        for service in services:
+            source = f"{device} {service['interface']} service instance {service['circuit_id']}"
+            pe_name = device_by_loopback.get(service['peer'])
+            if pe_name is None:
+                problems.append((source, f"Pseudowire peer {service['peer']} is not the loopback of any inventory device."))
+                continue
+            pe_service = pe_services.get((pe_name, loopback, service['pw_id']))
+            if pe_service is None:
+                problems.append((source, f"No service with pseudowire {service['pw_id']} towards {device} found on {pe_name}."))
+                continue
+            customers.append((source, {
+                'name': service['name'],
+                'service_type': service['service_type'],
+                'discovered': True,
+                'customer_details': {
+                    'devices': {
+                        'access': {'name': device, 'interface': service['interface']},
+                        'pe': {'name': pe_name},
+                    },
+                    'service_details': {
+                        'circuit_id': service['circuit_id'],
+                        'qos_input': service['qos_input'],
+                        'qos_output': service['qos_output'],
+                        'vlan_id': service['vlan_id'],
+                        'vlan_id_outer': service['vlan_id_outer'],
+                        'pw_id': service['pw_id'],
+                        'irb_ipaddr': pe_service['irb_ipaddr'],
+                        'irb_ipv6addr': pe_service['irb_ipv6addr'],
+                        'ipv4_lan': pe_service['ipv4_lan'],
+                        'ipv4_nexthop': pe_service['ipv4_nexthop'],
+                        'ipv6_lan': pe_service['ipv6_lan'],
+                        'ipv6_nexthop': pe_service['ipv6_nexthop'],
+                    },
+                },
+            }))
+    return customers, problems
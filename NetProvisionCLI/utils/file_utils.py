@@ -2,19 +2,32 @@ import os
 import json
 import time
 
-def write_to_file(directory, filename, data):
-    """Write data to a file and ensure the directory exists."""
+def customer_output_dir(customer_name, directory='generated_configs'):
+    """Return the per-customer output directory for generated configurations."""
+    return os.path.join(directory, customer_name)
+
+def write_to_file(directory, filename, data, verbose=True):
+    """Write data to a file and ensure the directory exists. The file is replaced atomically so readers never see a partial write."""
     base_path = os.path.abspath(directory)
     filepath = os.path.join(base_path, filename)
     os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    with open(filepath, 'w') as file:
-        file.write(data)
-    print(f"Configuration written to {filepath}")
+    tmp_path = f"{filepath}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as file:
+            file.write(data)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if verbose:
+        print(f"Configuration written to {filepath}")
 
 def log_error(directory, customer_name, message, error_code):
     """Log an error message with an error code to a structured JSON file for future reference. The deploy script should not move forward if an error is logged."""
     error_file = f"{customer_name}_error.json"
     error_path = os.path.join(directory, error_file)
+    os.makedirs(directory, exist_ok=True)
     error_info = {
         "error_message": message,
         "error_code": error_code,
@@ -1,17 +1,68 @@
-# db/mongo_utils.py
+import os
+import atexit
+import threading
+from typing import Optional, List, Tuple
 from pymongo import MongoClient
 
-def get_mongo_client():
-    """Establish and return a MongoDB client connection."""
-    return MongoClient('mongodb://localhost:27017/')
-
-def load_customer_and_device_info(customer_name, access_device, pe_device):
-    """Load customer and device information from MongoDB."""
-    client = get_mongo_client()
-    db = client.netprovision
-    
-    customer_info = db.customers.find_one({'name': customer_name})
-    access_device_info = db.devices.find_one({'name': access_device})
-    pe_device_info = db.devices.find_one({'name': pe_device})
-    
-    return customer_info, access_device_info, pe_device_info
+DEFAULT_MAX_POOL_SIZE = 50
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_mongo_client(connection_string: str = 'mongodb://localhost:27017/', max_pool_size: int = DEFAULT_MAX_POOL_SIZE) -> MongoClient:
+    """Return the shared MongoDB client for a connection string, creating it on first use.
+
+    Every entry point in the process shares one client and its connection pool. Clients are keyed by
+    process ID so workers forked from a process pool open their own pool instead of reusing the parent's sockets.
+    """
+    key = (os.getpid(), connection_string)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = MongoClient(connection_string, maxPoolSize=max_pool_size)
+                _clients[key] = client
+    return client
+
+def get_database(connection_string: str, database_name: str):
+    """Return a database handle backed by the shared, pooled client."""
+    return get_mongo_client(connection_string)[database_name]
+
+def close_mongo_clients() -> None:
+    """Close every client opened by this process."""
+    with _clients_lock:
+        for key in [key for key in _clients if key[0] == os.getpid()]:
+            _clients.pop(key).close()
+
+atexit.register(close_mongo_clients)
+
+def _customer_devices_pipeline(match: dict, limit: Optional[int] = None) -> list:
+    """Aggregation pipeline that joins a customer with its access and PE device documents."""
+    pipeline = [{'$match': match}]
+    if limit:
+        pipeline.append({'$limit': limit})
+    pipeline += [
+        {'$lookup': {'from': 'devices', 'localField': 'customer_details.devices.access.name',
+                     'foreignField': 'device_name', 'as': '_access_device'}},
+        {'$lookup': {'from': 'devices', 'localField': 'customer_details.devices.pe.name',
+                     'foreignField': 'device_name', 'as': '_pe_device'}}
+    ]
+    return pipeline
+
+def _split_customer_devices(document: dict) -> Tuple[dict, Optional[dict], Optional[dict]]:
+    access_devices = document.pop('_access_device', [])
+    pe_devices = document.pop('_pe_device', [])
+    return document, access_devices[0] if access_devices else None, pe_devices[0] if pe_devices else None
+
+def load_customer_with_devices(db, customer_name: str) -> Tuple[Optional[dict], Optional[dict], Optional[dict]]:
+    """Fetch a customer together with its access and PE devices in a single round trip."""
+    documents = list(db['customers'].aggregate(_customer_devices_pipeline({'name': customer_name}, limit=1)))
+    if not documents:
+        return None, None, None
+    return _split_customer_devices(documents[0])
+
+def load_customers_with_devices(db, customer_names: Optional[List[str]] = None) -> List[Tuple[dict, Optional[dict], Optional[dict]]]:
+    """Fetch many customers (all of them when no names are given) with their devices in one aggregation."""
+    match = {'name': {'$in': list(customer_names)}} if customer_names else {}
+    return [_split_customer_devices(document) for document in db['customers'].aggregate(_customer_devices_pipeline(match))]
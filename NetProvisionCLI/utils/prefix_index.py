@@ -0,0 +1,218 @@
+import bisect
+import ipaddress
+from typing import Optional, Tuple, Dict, List
+from pymongo import ASCENDING
+
+# Service fields holding allocated prefixes, in the order conflicts are reported, with their message wording.
+PREFIX_FIELDS = {
+    'irb_ipaddr': ('IRB IPv4', 'address'),
+    'irb_ipv6addr': ('IRB IPv6', 'address'),
+    'ipv4_lan': ('IPv4 LAN', 'route'),
+    'ipv6_lan': ('IPv6 LAN', 'route'),
+}
+
+PREFIX_COLLECTION = 'customer_prefixes'
+# Number of customers when customer_prefixes was last brought in line with the customers collection.
+PREFIX_STATE_COLLECTION = 'customer_prefixes_state'
+
+def prefix_bounds(prefix: str) -> Tuple[int, int, int, int]:
+    """Return (version, start, end, prefixlen) for a prefix, with host bits ignored as ip_network(strict=False) does."""
+    network = ipaddress.ip_network(prefix, strict=False)
+    start = int(network.network_address)
+    return network.version, start, start + network.num_addresses - 1, network.prefixlen
+
+def _supernet_starts(version: int, start: int, prefixlen: int) -> List[Tuple[int, int]]:
+    """(start, prefixlen) of every strictly shorter prefix that contains the given one."""
+    bits = 32 if version == 4 else 128
+    return [(start & ~((1 << (bits - length)) - 1), length) for length in range(prefixlen)]
+
+def conflict_message(field: str, new_prefix: str, existing_prefix: str, owner: str, equal: bool) -> str:
+    label, noun = PREFIX_FIELDS[field]
+    if equal:
+        return f"Conflict: {label} {noun} {new_prefix} is already in use by customer {owner}."
+    return f"Conflict: {label} prefix {new_prefix} overlaps with {existing_prefix} owned by customer {owner}."
+
+class PrefixIndex:
+    """In-memory index of allocated prefixes per service field.
+
+    Two CIDR blocks overlap only if one contains the other, so an overlap lookup is a hash probe for each of
+    the (at most 32 or 128) supernets of the candidate plus a binary search for prefixes starting inside it.
+    """
+
+    def __init__(self):
+        self._exact: Dict[str, Dict[Tuple[int, int], List[Tuple[str, str]]]] = {}
+        self._starts: Dict[str, List[Tuple[int, int, str, str]]] = {}
+        self._owners: Dict[str, List[Tuple[str, str]]] = {}
+
+    def add(self, field: str, prefix: str, owner: str, _sorted: bool = True) -> None:
+        version, start, end, prefixlen = prefix_bounds(prefix)
+        self._exact.setdefault(field, {}).setdefault((start, prefixlen), []).append((prefix, owner))
+        entry = (start, end, prefix, owner)
+        if _sorted:
+            bisect.insort(self._starts.setdefault(field, []), entry)
+        else:
+            self._starts.setdefault(field, []).append(entry)
+        self._owners.setdefault(owner, []).append((field, prefix))
+
+    def add_service(self, owner: str, service_details: dict) -> None:
+        """Index every prefix field of a customer's service details."""
+        for field in PREFIX_FIELDS:
+            prefix = service_details.get(field)
+            if prefix:
+                self.add(field, prefix, owner)
+
+    def remove_owner(self, owner: str) -> None:
+        """Drop every prefix held by a customer, e.g. before re-indexing an updated recipe."""
+        for field, prefix in self._owners.pop(owner, []):
+            version, start, end, prefixlen = prefix_bounds(prefix)
+            holders = self._exact[field][(start, prefixlen)]
+            holders[:] = [holder for holder in holders if holder[1] != owner]
+            starts = self._starts[field]
+            position = bisect.bisect_left(starts, (start, end, prefix, owner))
+            if position < len(starts) and starts[position] == (start, end, prefix, owner):
+                del starts[position]
+
+    def find_overlap(self, field: str, prefix: str, exclude_owner: Optional[str] = None) -> Optional[Tuple[str, str, bool]]:
+        """Return (existing_prefix, owner, equal) for a prefix overlapping the candidate, or None."""
+        version, start, end, prefixlen = prefix_bounds(prefix)
+        exact = self._exact.get(field, {})
+
+        # Same block first, so duplicates are reported as "already in use" rather than as an overlap.
+        for existing_prefix, owner in exact.get((start, prefixlen), []):
+            if owner != exclude_owner:
+                return existing_prefix, owner, True
+
+        for key in _supernet_starts(version, start, prefixlen):
+            for existing_prefix, owner in exact.get(key, []):
+                if owner != exclude_owner and prefix_bounds(existing_prefix)[0] == version:
+                    return existing_prefix, owner, False
+
+        starts = self._starts.get(field, [])
+        position = bisect.bisect_left(starts, (start,))
+        while position < len(starts) and starts[position][0] <= end:
+            existing_start, existing_end, existing_prefix, owner = starts[position]
+            if owner != exclude_owner and prefix_bounds(existing_prefix)[0] == version:
+                return existing_prefix, owner, False
+            position += 1
+        return None
+
+    def find_conflict(self, customer_name: str, service_details: dict) -> Optional[str]:
+        """Return the first prefix conflict message for a customer's service details, or None."""
+        for field in PREFIX_FIELDS:
+            prefix = service_details.get(field)
+            if not prefix:
+                continue
+            overlap = self.find_overlap(field, prefix, exclude_owner=customer_name)
+            if overlap:
+                return conflict_message(field, prefix, *overlap)
+        return None
+
+def build_prefix_index(customers_collection) -> PrefixIndex:
+    """Build an in-memory index from every customer in one projected scan."""
+    index = PrefixIndex()
+    projection = {'name': 1, **{f'customer_details.service_details.{field}': 1 for field in PREFIX_FIELDS}}
+    for customer in customers_collection.find({}, projection):
+        service_details = customer.get('customer_details', {}).get('service_details', {})
+        for field in PREFIX_FIELDS:
+            prefix = service_details.get(field)
+            if not prefix:
+                continue
+            try:
+                index.add(field, prefix, customer['name'], _sorted=False)
+            except ValueError:
+                continue
+    for starts in index._starts.values():
+        starts.sort()
+    return index
+
+def _encode(value: int) -> str:
+    """Fixed-width hex so lexicographic order in MongoDB matches numeric order for both IPv4 and IPv6."""
+    return f"{value:032x}"
+
+def prefix_documents(customer_name: str, service_details: dict) -> List[dict]:
+    """Documents persisted in the customer_prefixes collection for one customer."""
+    documents = []
+    for field in PREFIX_FIELDS:
+        prefix = service_details.get(field)
+        if not prefix:
+            continue
+        try:
+            version, start, end, prefixlen = prefix_bounds(prefix)
+        except ValueError:
+            continue
+        documents.append({'customer': customer_name, 'field': field, 'version': version, 'prefix': prefix,
+                          'prefixlen': prefixlen, 'start': _encode(start), 'end': _encode(end)})
+    return documents
+
+def ensure_prefix_indexes(db) -> None:
+    db[PREFIX_COLLECTION].create_index([('field', ASCENDING), ('start', ASCENDING), ('prefixlen', ASCENDING)])
+    db[PREFIX_COLLECTION].create_index([('customer', ASCENDING)])
+
+def mark_prefix_collection(db) -> None:
+    """Record that customer_prefixes covers the customers collection as it is now; call after every synced write."""
+    db[PREFIX_STATE_COLLECTION].update_one({'_id': 'customers'}, {'$set': {'count': db['customers'].estimated_document_count()}},
+                                           upsert=True)
+
+def sync_customer_prefixes(db, customer_name: str, service_details: dict) -> None:
+    """Replace a customer's persisted prefixes after it is added or updated."""
+    db[PREFIX_COLLECTION].delete_many({'customer': customer_name})
+    documents = prefix_documents(customer_name, service_details)
+    if documents:
+        db[PREFIX_COLLECTION].insert_many(documents)
+    mark_prefix_collection(db)
+
+def remove_customer_prefixes(db, customer_name: str) -> None:
+    db[PREFIX_COLLECTION].delete_many({'customer': customer_name})
+    mark_prefix_collection(db)
+
+def rebuild_prefix_collection(db) -> int:
+    """Rebuild the persisted prefix bounds from the customers collection. Returns the number of prefixes stored."""
+    ensure_prefix_indexes(db)
+    db[PREFIX_COLLECTION].delete_many({})
+    documents = []
+    projection = {'name': 1, **{f'customer_details.service_details.{field}': 1 for field in PREFIX_FIELDS}}
+    for customer in db['customers'].find({}, projection):
+        documents.extend(prefix_documents(customer['name'], customer.get('customer_details', {}).get('service_details', {})))
+    if documents:
+        db[PREFIX_COLLECTION].insert_many(documents)
+    mark_prefix_collection(db)
+    return len(documents)
+
+def ensure_prefix_collection(db) -> None:
+    """Rebuild the persisted prefix bounds when the customer count no longer matches the one recorded at the last
+    synced write: on first use against an existing customer base, or after customers were added or removed without
+    sync_customer_prefixes (sample_populate_mongodb.py, manual edits). The check reads two counters, never the
+    customers themselves. Prefixes changed in place, or as many customers added as removed, are not detected; run
+    netprovisioncli_admin.py --rebuild-prefix-index after such edits."""
+    state = db[PREFIX_STATE_COLLECTION].find_one({'_id': 'customers'})
+    if state is None or state['count'] != db['customers'].estimated_document_count():
+        rebuild_prefix_collection(db)
+
+def find_persisted_overlap(db, field: str, prefix: str, exclude_owner: Optional[str] = None) -> Optional[Tuple[str, str, bool]]:
+    """Indexed overlap lookup against the customer_prefixes collection. Returns (existing_prefix, owner, equal) or None."""
+    version, start, end, prefixlen = prefix_bounds(prefix)
+    clauses = [{'field': field, 'version': version, 'start': {'$gte': _encode(start), '$lte': _encode(end)}}]
+    clauses += [{'field': field, 'version': version, 'start': _encode(supernet_start), 'prefixlen': length}
+                for supernet_start, length in _supernet_starts(version, start, prefixlen)]
+    query = {'$or': clauses}
+    if exclude_owner is not None:
+        query['customer'] = {'$ne': exclude_owner}
+
+    match = None
+    for document in db[PREFIX_COLLECTION].find(query, {'prefix': 1, 'customer': 1, 'start': 1, 'prefixlen': 1}):
+        equal = document['start'] == _encode(start) and document['prefixlen'] == prefixlen
+        if equal:
+            return document['prefix'], document['customer'], True
+        match = match or (document['prefix'], document['customer'], False)
+    return match
+
+def find_persisted_conflict(db, customer_name: str, service_details: dict) -> Optional[str]:
+    """Return the first prefix conflict message using the persisted index, or None."""
+    for field in PREFIX_FIELDS:
+        prefix = service_details.get(field)
+        if not prefix:
+            continue
+        overlap = find_persisted_overlap(db, field, prefix, exclude_owner=customer_name)
+        if overlap:
+            return conflict_message(field, prefix, *overlap)
+    return None
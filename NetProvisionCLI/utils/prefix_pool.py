@@ -0,0 +1,317 @@
+import ipaddress
+from typing import Optional, Dict, List, Tuple
+from utils.prefix_index import PREFIX_FIELDS, PREFIX_COLLECTION, ensure_prefix_collection
+
+POOL_COLLECTION = 'prefix_pools'
+AUTO = 'auto'
+
+IRB_FIELDS = ('irb_ipaddr', 'irb_ipv6addr')
+FIELD_VERSIONS = {'irb_ipaddr': 4, 'irb_ipv6addr': 6, 'ipv4_lan': 4, 'ipv6_lan': 6}
+
+MAX_RETRIES = 50
+
+def _encode(value: int) -> str:
+    return f"{value:032x}"
+
+class PrefixPool:
+    """Buddy allocator over one pool network.
+
+    Free space is kept as free lists per prefix length, sorted highest start first so the lowest block is popped
+    off the end; allocating a /L takes the smallest free block that fits and splits it down into lengths whose
+    lists were empty, releasing merges a block with its free buddy, so both walk at most the pool-to-block
+    length difference.
+    """
+
+    def __init__(self, network: str, free: Optional[Dict[int, List[int]]] = None):
+        self.network = ipaddress.ip_network(network)
+        self.bits = self.network.max_prefixlen
+        self.base = self.network.prefixlen
+        if free is None:
+            free = {self.base: [int(self.network.network_address)]}
+        self.free = {length: sorted(starts, reverse=True) for length, starts in free.items() if starts}
+
+    @classmethod
+    def from_document(cls, document: dict) -> 'PrefixPool':
+        return cls(document['network'], {int(length): [int(start, 16) for start in starts]
+                                         for length, starts in document.get('free', {}).items()})
+
+    def to_document(self) -> Dict[str, List[str]]:
+        return {str(length): [_encode(start) for start in starts] for length, starts in self.free.items() if starts}
+
+    @staticmethod
+    def _position(starts: List[int], start: int) -> int:
+        """Index of the first start not above start in a list sorted highest first."""
+        low, high = 0, len(starts)
+        while low < high:
+            middle = (low + high) // 2
+            if starts[middle] > start:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _take(self, length: int, start: int) -> bool:
+        starts = self.free.get(length, [])
+        position = self._position(starts, start)
+        if position < len(starts) and starts[position] == start:
+            del starts[position]
+            return True
+        return False
+
+    def _put(self, length: int, start: int) -> None:
+        starts = self.free.setdefault(length, [])
+        starts.insert(self._position(starts, start), start)
+
+    def _mask(self, value: int, length: int) -> int:
+        return value & ~((1 << (self.bits - length)) - 1)
+
+    def allocate(self, length: int) -> Optional[int]:
+        """Return the start of a free /length block, or None when none is left."""
+        if length < self.base or length > self.bits:
+            return None
+        for block_length in range(length, self.base - 1, -1):
+            if self.free.get(block_length):
+                start = self.free[block_length].pop()
+                for split_length in range(block_length + 1, length + 1):
+                    self._put(split_length, start + (1 << (self.bits - split_length)))
+                return start
+        return None
+
+    def reserve(self, start: int, length: int) -> bool:
+        """Mark a specific block as allocated. Returns False if it is outside the pool or not entirely free."""
+        if length < self.base or length > self.bits or self._mask(start, self.base) != int(self.network.network_address):
+            return False
+        for block_length in range(length, self.base - 1, -1):
+            block_start = self._mask(start, block_length)
+            if self._take(block_length, block_start):
+                for split_length in range(block_length + 1, length + 1):
+                    self._put(split_length, self._mask(start, split_length) ^ (1 << (self.bits - split_length)))
+                return True
+        return False
+
+    def is_free(self, start: int, length: int) -> bool:
+        """Whether any part of a block is currently free: the block itself, a block containing it or one inside it."""
+        for block_length in range(self.base, length + 1):
+            starts = self.free.get(block_length, [])
+            position = self._position(starts, self._mask(start, block_length))
+            if position < len(starts) and starts[position] == self._mask(start, block_length):
+                return True
+        last = start + (1 << (self.bits - length)) - 1
+        for block_length, starts in self.free.items():
+            if block_length > length:
+                position = self._position(starts, last)
+                if position < len(starts) and starts[position] >= start:
+                    return True
+        return False
+
+    def release(self, start: int, length: int) -> bool:
+        """Return an allocated block to the pool, merging it with its buddy while possible.
+        Returns False, changing nothing, if the block is outside the pool or any part of it is already free."""
+        if length < self.base or length > self.bits or self._mask(start, self.base) != int(self.network.network_address):
+            return False
+        if self.is_free(start, length):
+            return False
+        while length > self.base:
+            buddy = start ^ (1 << (self.bits - length))
+            if not self._take(length, buddy):
+                break
+            start = min(start, buddy)
+            length -= 1
+        self._put(length, start)
+        return True
+
+    def free_addresses(self) -> int:
+        return sum(len(starts) << (self.bits - length) for length, starts in self.free.items())
+
+def build_pool(db, document: dict) -> PrefixPool:
+    """Build a pool's free lists from every customer prefix inside the pool network, whichever PE or pool it came from,
+    so overlapping pools and customers addressed by hand are never handed out again."""
+    pool = PrefixPool(document['network'])
+    start = int(pool.network.network_address)
+    end = start + pool.network.num_addresses - 1
+    fields = [field for field, version in FIELD_VERSIONS.items() if version == pool.network.version]
+    # A prefix covering the whole pool network leaves nothing to allocate.
+    supernets = [_encode(pool._mask(start, length)) for length in range(pool.base + 1)]
+    if db[PREFIX_COLLECTION].find_one({'field': {'$in': fields}, 'start': {'$in': supernets},
+                                       'end': {'$gte': _encode(end)}}, {'_id': 1}):
+        pool.free = {}
+        return pool
+    for prefix in db[PREFIX_COLLECTION].find({'field': {'$in': fields}, 'start': {'$gte': _encode(start), '$lte': _encode(end)}},
+                                             {'start': 1, 'prefixlen': 1}):
+        # Overlapping customer prefixes fail to reserve once their space is taken, which is what is wanted.
+        pool.reserve(int(prefix['start'], 16), prefix['prefixlen'])
+    return pool
+
+def define_pool(db, definition: dict) -> str:
+    """Create or replace a pool from a definition (name, field, network, prefixlen and pe or region). Returns a status message."""
+    name = definition.get('name')
+    field = definition.get('field')
+    if not name or field not in PREFIX_FIELDS:
+        return f"Invalid prefix pool {name}: field must be one of {', '.join(PREFIX_FIELDS)}."
+    if not definition.get('pe') and not definition.get('region'):
+        return f"Invalid prefix pool {name}: either pe or region is required."
+    try:
+        network = ipaddress.ip_network(definition['network'])
+    except (KeyError, ValueError) as e:
+        return f"Invalid prefix pool {name}: {e}"
+    if network.version != FIELD_VERSIONS[field]:
+        return f"Invalid prefix pool {name}: {network} is not an IPv{FIELD_VERSIONS[field]} network."
+    default_length = int(definition.get('prefixlen', 30 if network.version == 4 else 127))
+
+    document = {'_id': name, 'field': field, 'pe': definition.get('pe'), 'region': definition.get('region'),
+                'network': str(network), 'prefixlen': default_length}
+    ensure_prefix_collection(db)
+    pool = build_pool(db, document)
+    document['free'] = pool.to_document()
+    existing = db[POOL_COLLECTION].find_one({'_id': name}, {'version': 1})
+    document['version'] = (existing or {}).get('version', 0) + 1
+    db[POOL_COLLECTION].replace_one({'_id': name}, document, upsert=True)
+    return f"Prefix pool {name} ({field} {network}) defined with {pool.free_addresses()} free addresses."
+
+def rebuild_pools(db, pe_names: Optional[List[str]] = None) -> int:
+    """Rebuild the free lists of every pool (or the pools serving the given PEs) from the customers collection."""
+    query = {}
+    if pe_names is not None:
+        regions = [device.get('region') for device in db['devices'].find({'device_name': {'$in': list(pe_names)}}, {'region': 1})]
+        query = {'$or': [{'pe': {'$in': list(pe_names)}}, {'region': {'$in': [region for region in regions if region]}}]}
+    ensure_prefix_collection(db)
+    count = 0
+    for document in db[POOL_COLLECTION].find(query):
+        pool = build_pool(db, document)
+        db[POOL_COLLECTION].update_one({'_id': document['_id']}, {'$set': {'free': pool.to_document()}, '$inc': {'version': 1}})
+        count += 1
+    return count
+
+def format_prefix(field: str, start: int, length: int) -> str:
+    """IRB fields hold the first usable address with its length, LAN fields the network itself."""
+    network_class = ipaddress.IPv4Network if FIELD_VERSIONS[field] == 4 else ipaddress.IPv6Network
+    network = network_class((start, length))
+    if field in IRB_FIELDS:
+        return f"{next(network.hosts())}/{length}"
+    return str(network)
+
+def parse_auto(value) -> Optional[int]:
+    """Requested length for 'auto/NN', 0 for a bare 'auto' (pool default), None when the value is not automatic."""
+    if not isinstance(value, str) or not value.startswith(AUTO):
+        return None
+    suffix = value[len(AUTO):]
+    if not suffix:
+        return 0
+    if suffix.startswith('/') and suffix[1:].isdigit():
+        return int(suffix[1:])
+    return None
+
+class PrefixPoolAllocator:
+    """Allocates IRB and LAN prefixes from the pools serving a customer's PE, with version compare-and-swap updates."""
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db[POOL_COLLECTION]
+        self._regions = {}
+
+    def _region(self, pe_name: str) -> Optional[str]:
+        if pe_name not in self._regions:
+            device = self.db['devices'].find_one({'device_name': pe_name}, {'region': 1})
+            self._regions[pe_name] = (device or {}).get('region')
+        return self._regions[pe_name]
+
+    def find_pools(self, field: str, pe_name: str) -> List[dict]:
+        """Pools for a field serving a PE: the PE's own pools first, then its region's."""
+        clauses = [{'field': field, 'pe': pe_name}]
+        region = self._region(pe_name)
+        if region:
+            clauses.append({'field': field, 'region': region})
+        return sorted(self.collection.find({'$or': clauses}), key=lambda document: (not document.get('pe'), document['_id']))
+
+    def _update(self, pool_id: str, change) -> Optional[int]:
+        """Apply change(pool) under compare-and-swap, retrying on concurrent updates. Returns change's result."""
+        for _ in range(MAX_RETRIES):
+            document = self.collection.find_one({'_id': pool_id})
+            if document is None:
+                return None
+            pool = PrefixPool.from_document(document)
+            result = change(pool)
+            if result is None or result is False:
+                return result
+            updated = self.collection.update_one({'_id': pool_id, 'version': document['version']},
+                                                 {'$set': {'free': pool.to_document()}, '$inc': {'version': 1}})
+            if updated.modified_count == 1:
+                return result
+        raise RuntimeError(f"Could not update prefix pool {pool_id} after {MAX_RETRIES} attempts.")
+
+    def allocate(self, field: str, pe_name: str, length: Optional[int] = None) -> Optional[Tuple[str, str]]:
+        """Allocate a prefix for a field on a PE. Returns (pool name, formatted prefix) or None when no pool has room."""
+        for document in self.find_pools(field, pe_name):
+            requested = length or document['prefixlen']
+            start = self._update(document['_id'], lambda pool: pool.allocate(requested))
+            if start is not None:
+                return document['_id'], format_prefix(field, start, requested)
+        return None
+
+    def _pool_for(self, field: str, pe_name: str, prefix: str) -> Optional[Tuple[str, int, int]]:
+        try:
+            network = ipaddress.ip_network(prefix, strict=False)
+        except (TypeError, ValueError):
+            return None
+        for document in self.find_pools(field, pe_name):
+            pool_network = ipaddress.ip_network(document['network'])
+            if network.version == pool_network.version and network.subnet_of(pool_network):
+                return document['_id'], int(network.network_address), network.prefixlen
+        return None
+
+    def reserve(self, field: str, pe_name: str, prefix: str) -> None:
+        """Mark an explicitly chosen prefix as used in the pool that contains it, if any."""
+        located = self._pool_for(field, pe_name, prefix)
+        if located:
+            pool_id, start, length = located
+            self._update(pool_id, lambda pool: pool.reserve(start, length))
+
+    def release(self, field: str, pe_name: str, prefix: str) -> None:
+        """Return a prefix to the pool that contains it, if any; a prefix that is not allocated is left alone."""
+        located = self._pool_for(field, pe_name, prefix)
+        if located:
+            pool_id, start, length = located
+            self._update(pool_id, lambda pool: pool.release(start, length))
+
+    def resolve_auto(self, customer_data: dict, existing: Optional[dict] = None) -> Tuple[List[Tuple[str, str]], Optional[str]]:
+        """Replace 'auto' and 'auto/NN' prefixes in a transformed customer with allocated ones.
+
+        An existing customer on the same PE keeps its current prefixes. Returns (allocated (field, prefix) pairs,
+        error message or None); on error nothing stays allocated.
+        """
+        pe_name = customer_data['customer_details']['devices']['pe']['name']
+        service_details = customer_data['customer_details']['service_details']
+        allocated = []
+        for field in PREFIX_FIELDS:
+            length = parse_auto(service_details.get(field))
+            if length is None:
+                continue
+            if existing and existing['customer_details']['devices']['pe']['name'] == pe_name:
+                current = existing['customer_details']['service_details'].get(field)
+                if current and parse_auto(current) is None:
+                    service_details[field] = current
+                    continue
+            result = self.allocate(field, pe_name, length or None)
+            if result is None:
+                self.release_all(allocated, pe_name)
+                label = PREFIX_FIELDS[field][0]
+                return [], f"No {label} prefix pool on {pe_name} has a free /{length or 'default'} block."
+            service_details[field] = result[1]
+            allocated.append((field, result[1]))
+        return allocated, None
+
+    def release_all(self, allocated: List[Tuple[str, str]], pe_name: str) -> None:
+        for field, prefix in allocated:
+            self.release(field, pe_name, prefix)
+
+    def sync_customer(self, old: Optional[dict], new: Optional[dict]) -> None:
+        """Keep pools in line with a customer that was added, updated (old and new) or removed (new is None)."""
+        for field in PREFIX_FIELDS:
+            old_value = old['customer_details']['service_details'].get(field) if old else None
+            new_value = new['customer_details']['service_details'].get(field) if new else None
+            old_pe = old['customer_details']['devices']['pe']['name'] if old else None
+            new_pe = new['customer_details']['devices']['pe']['name'] if new else None
+            if old and old_value and (old_value != new_value or old_pe != new_pe):
+                self.release(field, old_pe, old_value)
+            if new and new_value:
+                self.reserve(field, new_pe, new_value)
@@ -0,0 +1,187 @@
+from typing import Optional, Dict, List, Tuple
+from bson.binary import Binary
+from pymongo.errors import DuplicateKeyError
+
+RESOURCE_COLLECTION = 'resource_allocations'
+AUTO = 'auto'
+
+# Allocatable range per resource; settings.yaml can override it under resource_pools.
+DEFAULT_POOLS = {
+    'vlan_id': (2, 4094),
+    'circuit_id': (1, 65535),
+    'pw_id': (1, 65535),
+}
+
+RESOURCE_LABELS = {'vlan_id': 'VLAN ID', 'circuit_id': 'Circuit ID', 'pw_id': 'Pseudowire ID'}
+
+ACCESS_NAME = 'customer_details.devices.access.name'
+ACCESS_INTERFACE = 'customer_details.devices.access.interface'
+PE_NAME = 'customer_details.devices.pe.name'
+
+MAX_RETRIES = 50
+
+def resource_scopes(resource: str, devices: dict) -> List[Tuple[str, ...]]:
+    """Scopes an ID must be unique in, mirroring check_for_conflicts: VLAN and circuit IDs per access interface,
+    pseudowire IDs per access device and per PE device."""
+    if resource == 'pw_id':
+        return [('access', devices['access']['name']), ('pe', devices['pe']['name'])]
+    return [('access', devices['access']['name'], devices['access']['interface'])]
+
+def _scope_key(resource: str, scope: Tuple[str, ...]) -> str:
+    return '|'.join((resource,) + scope)
+
+def _scope_filter(scope: Tuple[str, ...]) -> dict:
+    if scope[0] == 'pe':
+        return {PE_NAME: scope[1]}
+    query = {ACCESS_NAME: scope[1]}
+    if len(scope) > 2:
+        query[ACCESS_INTERFACE] = scope[2]
+    return query
+
+def _first_free(used: int, low: int, high: int) -> Optional[int]:
+    """Lowest clear bit in [low, high], found with integer bit tricks rather than a Python-level loop."""
+    candidate = used | ((1 << low) - 1)
+    free = (~candidate & (candidate + 1)).bit_length() - 1
+    return free if free <= high else None
+
+class ResourceAllocator:
+    """Per-scope bitmaps of used VLAN, pseudowire and circuit IDs stored in MongoDB.
+
+    Each bitmap document carries a version counter and is only replaced if the version is unchanged since it was
+    read, so concurrent admins never hand out the same ID. Missing bitmaps are built from the customers collection.
+    """
+
+    def __init__(self, db, pools: Optional[Dict[str, Tuple[int, int]]] = None):
+        self.db = db
+        self.collection = db[RESOURCE_COLLECTION]
+        self.pools = dict(DEFAULT_POOLS)
+        for resource, bounds in (pools or {}).items():
+            self.pools[resource] = (int(bounds[0]), int(bounds[1]))
+
+    def _build(self, resource: str, scope: Tuple[str, ...]) -> int:
+        used = 0
+        field = f'customer_details.service_details.{resource}'
+        for customer in self.db['customers'].find(_scope_filter(scope), {field: 1}):
+            value = customer.get('customer_details', {}).get('service_details', {}).get(resource)
+            if isinstance(value, int) and value >= 0:
+                used |= 1 << value
+        return used
+
+    def _load(self, resource: str, scope: Tuple[str, ...]) -> Tuple[int, int]:
+        """Return (bitmap, version) for a scope, building and storing the bitmap on first use."""
+        key = _scope_key(resource, scope)
+        document = self.collection.find_one({'_id': key})
+        if document is None:
+            used = self._build(resource, scope)
+            try:
+                self.collection.insert_one({'_id': key, 'resource': resource, 'scope': list(scope),
+                                            'bitmap': Binary(used.to_bytes((used.bit_length() + 7) // 8, 'little')), 'version': 0})
+            except DuplicateKeyError:
+                pass
+            document = self.collection.find_one({'_id': key})
+        return int.from_bytes(document['bitmap'], 'little'), document['version']
+
+    def _compare_and_swap(self, resource: str, scope: Tuple[str, ...], version: int, used: int) -> bool:
+        result = self.collection.update_one(
+            {'_id': _scope_key(resource, scope), 'version': version},
+            {'$set': {'bitmap': Binary(used.to_bytes((used.bit_length() + 7) // 8, 'little'))}, '$inc': {'version': 1}}
+        )
+        return result.modified_count == 1
+
+    def _update_bit(self, resource: str, scope: Tuple[str, ...], value: int, used_bit: bool) -> None:
+        for _ in range(MAX_RETRIES):
+            used, version = self._load(resource, scope)
+            updated = used | (1 << value) if used_bit else used & ~(1 << value)
+            if updated == used or self._compare_and_swap(resource, scope, version, updated):
+                return
+        raise RuntimeError(f"Could not update {_scope_key(resource, scope)} after {MAX_RETRIES} attempts.")
+
+    def allocate(self, resource: str, devices: dict) -> Optional[int]:
+        """Claim the lowest free ID for a resource in every scope it must be unique in. Returns None when the pool is exhausted."""
+        low, high = self.pools[resource]
+        scopes = resource_scopes(resource, devices)
+        for _ in range(MAX_RETRIES):
+            states = [self._load(resource, scope) for scope in scopes]
+            combined = 0
+            for used, _version in states:
+                combined |= used
+            value = _first_free(combined, low, high)
+            if value is None:
+                return None
+            claimed = []
+            for scope, (used, version) in zip(scopes, states):
+                if not self._compare_and_swap(resource, scope, version, used | (1 << value)):
+                    break
+                claimed.append(scope)
+            else:
+                return value
+            # Another admin changed one of the bitmaps in between; give back what was claimed and retry.
+            for scope in claimed:
+                self._update_bit(resource, scope, value, False)
+        raise RuntimeError(f"Could not allocate {RESOURCE_LABELS[resource]} after {MAX_RETRIES} attempts.")
+
+    def reserve(self, resource: str, devices: dict, value) -> None:
+        """Mark an explicitly chosen ID as used."""
+        if isinstance(value, int) and value >= 0:
+            for scope in resource_scopes(resource, devices):
+                self._update_bit(resource, scope, value, True)
+
+    def release(self, resource: str, devices: dict, value) -> None:
+        """Return an ID to the pool."""
+        if isinstance(value, int) and value >= 0:
+            for scope in resource_scopes(resource, devices):
+                self._update_bit(resource, scope, value, False)
+
+    def resolve_auto(self, customer_data: dict, existing: Optional[dict] = None) -> Tuple[List[Tuple[str, int]], Optional[str]]:
+        """Replace 'auto' IDs in a transformed customer with allocated ones.
+
+        An existing customer on the same devices keeps its current IDs. Returns (newly allocated (resource, value)
+        pairs, error message or None); on error nothing stays allocated.
+        """
+        devices = customer_data['customer_details']['devices']
+        service_details = customer_data['customer_details']['service_details']
+        allocated = []
+        for resource in DEFAULT_POOLS:
+            if service_details.get(resource) != AUTO:
+                continue
+            if existing and existing['customer_details']['devices'] == devices:
+                current = existing['customer_details']['service_details'].get(resource)
+                if isinstance(current, int):
+                    service_details[resource] = current
+                    continue
+            value = self.allocate(resource, devices)
+            if value is None:
+                self.release_all(allocated, devices)
+                scope = ' '.join(resource_scopes(resource, devices)[0][1:])
+                return [], f"No free {RESOURCE_LABELS[resource]} left in the pool on {scope}."
+            service_details[resource] = value
+            allocated.append((resource, value))
+        return allocated, None
+
+    def release_all(self, allocated: List[Tuple[str, int]], devices: dict) -> None:
+        for resource, value in allocated:
+            self.release(resource, devices, value)
+
+    def sync_customer(self, old: Optional[dict], new: Optional[dict]) -> None:
+        """Keep the bitmaps in line with a customer that was added, updated (old and new) or removed (new is None)."""
+        for resource in DEFAULT_POOLS:
+            old_value = old['customer_details']['service_details'].get(resource) if old else None
+            new_value = new['customer_details']['service_details'].get(resource) if new else None
+            old_devices = old['customer_details']['devices'] if old else None
+            new_devices = new['customer_details']['devices'] if new else None
+            if old and (old_value != new_value or old_devices != new_devices):
+                self.release(resource, old_devices, old_value)
+            if new:
+                self.reserve(resource, new_devices, new_value)
+
+    def invalidate(self, customers: List[dict]) -> None:
+        """Drop the bitmaps touched by a batch of customers so they are rebuilt from the customers collection on next use.
+        Used after bulk writes, where one rebuild beats a compare-and-swap per customer and resource."""
+        keys = {_scope_key(resource, scope) for customer in customers for resource in DEFAULT_POOLS
+                for scope in resource_scopes(resource, customer['customer_details']['devices'])}
+        if keys:
+            self.collection.delete_many({'_id': {'$in': list(keys)}})
+
+def reset_allocations(db) -> None:
+    """Drop every bitmap; they are rebuilt from the customers collection on next use."""
+    db[RESOURCE_COLLECTION].delete_many({})
@@ -0,0 +1,133 @@
+from typing import List, Tuple
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from utils.prefix_index import PREFIX_COLLECTION
+from utils.prefix_pool import POOL_COLLECTION
+from utils.config_archive import BLOB_COLLECTION
+from utils.config_history import EXPIRE_FIELD
+from utils.deployment_summary import SUMMARY_COLLECTION
+
+ACCESS_NAME = 'customer_details.devices.access.name'
+ACCESS_INTERFACE = 'customer_details.devices.access.interface'
+PE_NAME = 'customer_details.devices.pe.name'
+SERVICE = 'customer_details.service_details'
+
+# (collection, keys, options) for every index the CLI relies on.
+INDEX_SPEC = [
+    ('customers', [('name', ASCENDING)], {'unique': True}),
+    ('customers', [(ACCESS_NAME, ASCENDING), (ACCESS_INTERFACE, ASCENDING), (f'{SERVICE}.vlan_id', ASCENDING)], {}),
+    ('customers', [(ACCESS_NAME, ASCENDING), (ACCESS_INTERFACE, ASCENDING), (f'{SERVICE}.circuit_id', ASCENDING)], {}),
+    ('customers', [(ACCESS_NAME, ASCENDING), (f'{SERVICE}.pw_id', ASCENDING)], {}),
+    ('customers', [(PE_NAME, ASCENDING), (f'{SERVICE}.pw_id', ASCENDING)], {}),
+    ('devices', [('device_name', ASCENDING)], {'unique': True}),
+    ('deviceConfig', [('device_name', ASCENDING), ('timestamp', DESCENDING)], {}),
+    ('deviceConfig', [('timestamp', ASCENDING)], {}),
+    # One content version per number and device, so concurrent backups cannot chain deltas onto the wrong base.
+    ('deviceConfig', [('device_name', ASCENDING), ('version', ASCENDING)], {'unique': True, 'partialFilterExpression': {'changed': True}}),
+    # Blob collection looks up which candidate blobs are still referenced, a batch of hashes at a time.
+    ('deviceConfig', [('hash', ASCENDING)], {}),
+    # TTL indexes: retention marks documents with expire_at and the server deletes them in the background.
+    ('deviceConfig', [(EXPIRE_FIELD, ASCENDING)], {'expireAfterSeconds': 0}),
+    (BLOB_COLLECTION, [(EXPIRE_FIELD, ASCENDING)], {'expireAfterSeconds': 0}),
+    (BLOB_COLLECTION, [('created', ASCENDING)], {}),
+    (PREFIX_COLLECTION, [('field', ASCENDING), ('start', ASCENDING), ('prefixlen', ASCENDING)], {}),
+    (PREFIX_COLLECTION, [('customer', ASCENDING)], {}),
+    (POOL_COLLECTION, [('field', ASCENDING), ('pe', ASCENDING)], {}),
+    (POOL_COLLECTION, [('field', ASCENDING), ('region', ASCENDING)], {}),
+    (SUMMARY_COLLECTION, [('deployment_id', ASCENDING), ('customer_name', ASCENDING)], {'unique': True}),
+    (SUMMARY_COLLECTION, [('timestamp', DESCENDING), ('_id', DESCENDING)], {}),
+    (SUMMARY_COLLECTION, [('customer_name', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)], {}),
+]
+
+# Representative hot queries (collection, filter, sort) whose plans must not scan the whole collection.
+HOT_QUERIES = [
+    ('customers', {'name': 'CUSTOMER'}, None),
+    ('customers', {f'{SERVICE}.vlan_id': 100, ACCESS_NAME: 'DEVICE', ACCESS_INTERFACE: 'IFACE', 'name': {'$ne': 'CUSTOMER'}}, None),
+    ('customers', {f'{SERVICE}.circuit_id': 100, ACCESS_NAME: 'DEVICE', ACCESS_INTERFACE: 'IFACE', 'name': {'$ne': 'CUSTOMER'}}, None),
+    ('customers', {'$or': [{ACCESS_NAME: 'DEVICE'}, {PE_NAME: 'DEVICE'}], f'{SERVICE}.pw_id': 100, 'name': {'$ne': 'CUSTOMER'}}, None),
+    ('devices', {'device_name': {'$in': ['DEVICE']}}, None),
+    ('deviceConfig', {'device_name': 'DEVICE'}, [('timestamp', -1)]),
+    ('deviceConfig', {'timestamp': {'$gte': 0}}, None),
+    ('deviceConfig', {'device_name': 'DEVICE', 'changed': True, 'version': {'$gte': 1, '$lte': 30}}, [('version', 1)]),
+    ('deviceConfig', {'hash': {'$in': ['HASH']}}, None),
+    (PREFIX_COLLECTION, {'customer': 'CUSTOMER'}, None),
+    (SUMMARY_COLLECTION, {}, [('timestamp', -1), ('_id', -1)]),
+    (SUMMARY_COLLECTION, {'customer_name': 'CUSTOMER'}, [('timestamp', -1), ('_id', -1)]),
+]
+
+# IndexOptionsConflict and IndexKeySpecsConflict
+INDEX_OPTION_CONFLICTS = (85, 86)
+
+def _index_name(keys) -> str:
+    return '_'.join(f"{field}_{direction}" for field, direction in keys)
+
+def ensure_indexes(db) -> List[str]:
+    """Create every index in INDEX_SPEC. Idempotent; returns a list of error messages for indexes that could not be built."""
+    errors = []
+    for collection, keys, options in INDEX_SPEC:
+        try:
+            try:
+                db[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                # An index built from an older spec with other options is replaced.
+                if e.code not in INDEX_OPTION_CONFLICTS:
+                    raise
+                db[collection].drop_index(_index_name(keys))
+                db[collection].create_index(keys, **options)
+        except OperationFailure as e:
+            errors.append(f"{collection}.{_index_name(keys)}: {e.details.get('errmsg', e) if e.details else e}")
+    return errors
+
+def missing_indexes(db) -> List[Tuple[str, str]]:
+    """Return (collection, index name) for every index in INDEX_SPEC not present in the database."""
+    existing = {}
+    missing = []
+    for collection, keys, options in INDEX_SPEC:
+        if collection not in existing:
+            existing[collection] = [list(info['key']) for info in db[collection].index_information().values()]
+        if [tuple(key) for key in keys] not in [[tuple(key) for key in index] for index in existing[collection]]:
+            missing.append((collection, _index_name(keys)))
+    return missing
+
+def _plan_stages(plan) -> List[str]:
+    stages = []
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, dict):
+            if 'stage' in node:
+                stages.append(node['stage'])
+            pending.extend(node.values())
+        elif isinstance(node, list):
+            pending.extend(node)
+    return stages
+
+def slow_query_plans(db) -> List[Tuple[str, dict, List[str]]]:
+    """Explain each hot query and return (collection, filter, offending stages) for plans with a COLLSCAN or in-memory SORT."""
+    slow = []
+    for collection, query, sort in HOT_QUERIES:
+        command = {'find': collection, 'filter': query}
+        if sort:
+            command['sort'] = dict(sort)
+        try:
+            explain = db.command('explain', command, verbosity='queryPlanner')
+        except OperationFailure as e:
+            slow.append((collection, query, [f"explain failed: {e}"]))
+            continue
+        stages = _plan_stages(explain.get('queryPlanner', {}).get('winningPlan', {}))
+        offending = sorted({stage for stage in stages if stage in ('COLLSCAN', 'SORT')})
+        if offending:
+            slow.append((collection, query, offending))
+    return slow
+
+def check_schema(db) -> bool:
+    """Print missing indexes and slow query plans. Returns True when the schema is healthy."""
+    missing = missing_indexes(db)
+    for collection, index_name in missing:
+        print(f"Missing index on {collection}: {index_name}")
+    slow = slow_query_plans(db)
+    for collection, query, stages in slow:
+        print(f"Slow query plan on {collection} ({', '.join(stages)}): {query}")
+    if not missing and not slow:
+        print("All indexes present and hot queries use them.")
+    return not missing and not slow
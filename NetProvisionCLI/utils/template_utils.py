@@ -1,7 +1,59 @@
-from jinja2 import Environment, FileSystemLoader
+import os
+import hashlib
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, meta
+
+TEMPLATE_DIR = 'templates/'
+BYTECODE_CACHE_DIR = '.template_cache'
+
+_environments = {}
+_template_digests = {}
+
+def get_environment(template_dir=TEMPLATE_DIR):
+    """Return the process-wide Jinja2 environment for a template directory.
+
+    Compiled templates are kept in memory for the life of the process (re-checked
+    against the template mtime on each lookup) and their bytecode is cached on disk
+    so later CLI runs skip the parse/compile step as long as the template is unchanged.
+    """
+    env = _environments.get(template_dir)
+    if env is None:
+        try:
+            os.makedirs(BYTECODE_CACHE_DIR, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(BYTECODE_CACHE_DIR)
+        except OSError:
+            bytecode_cache = None
+        env = Environment(loader=FileSystemLoader(template_dir), bytecode_cache=bytecode_cache,
+                          cache_size=-1, auto_reload=True)
+        _environments[template_dir] = env
+    return env
 
 def render_template(template_name, context):
     """Render customer configuration from Jinja2 templates."""
-    env = Environment(loader=FileSystemLoader('templates/'))
-    template = env.get_template(template_name)
+    template = get_environment().get_template(template_name)
     return template.render(context)
+
+def get_template_digest(template_name, template_dir=TEMPLATE_DIR):
+    """Return a SHA-256 digest of a template's source together with every template it includes, imports or extends."""
+    cached = _template_digests.get((template_dir, template_name))
+    if cached and all(uptodate() for uptodate in cached[1]):
+        return cached[0]
+
+    env = get_environment(template_dir)
+    digest = hashlib.sha256()
+    checks = []
+    pending = [template_name]
+    seen = set()
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        source, _, uptodate = env.loader.get_source(env, name)
+        digest.update(name.encode())
+        digest.update(source.encode())
+        if uptodate:
+            checks.append(uptodate)
+        pending.extend(sorted(ref for ref in meta.find_referenced_templates(env.parse(source)) if ref))
+    result = digest.hexdigest()
+    _template_digests[(template_dir, template_name)] = (result, checks)
+    return result
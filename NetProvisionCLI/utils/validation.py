@@ -1,6 +1,7 @@
 import ipaddress
 import argparse
 import re
+from functools import lru_cache
 
 def valid_ip_irb(network):
     """Validate an IP network prefix and return the first usable IP address with the prefix."""
@@ -27,10 +28,37 @@ def valid_ip_lan(network):
     except ValueError:
         raise argparse.ArgumentTypeError(f"Invalid IP network: {network}")
 
+@lru_cache(maxsize=None)
+def compile_forbidden_interfaces(patterns):
+    """Compile a tuple of forbidden interface regexes into a single matcher, compiled once per distinct pattern set.
+
+    Returns a callable that is truthy when an interface name matches any pattern (re.match semantics).
+    """
+    if not patterns:
+        return lambda interface_name: False
+    try:
+        combined = re.compile('|'.join(f'(?:{pattern})' for pattern in patterns))
+        return combined.match
+    except re.error:
+        # Patterns that cannot be combined (e.g. global inline flags) are matched one by one.
+        compiled = [re.compile(pattern) for pattern in patterns]
+        return lambda interface_name: any(regex.match(interface_name) for regex in compiled)
+
 def interface_allowed(device_info, interface_name):
     """Check if the specified interface is allowed based on forbidden ranges in the device configuration."""
-    forbidden_patterns = device_info.get('forbidden_interfaces', [])
-    for pattern in forbidden_patterns:
-        if re.match(pattern, interface_name):
-            return False
-    return True
+    matcher = compile_forbidden_interfaces(tuple(device_info.get('forbidden_interfaces') or []))
+    return not matcher(interface_name)
+
+def find_interface_violations(devices_config, device_interfaces):
+    """Check many (device_name, interface_name) pairs in one pass.
+
+    Returns a list of (device_name, interface_name, reason) tuples for every pair that is not allowed.
+    """
+    violations = []
+    for device_name, interface_name in device_interfaces:
+        device_info = devices_config.get(device_name)
+        if not device_info:
+            violations.append((device_name, interface_name, f"Device {device_name} not found in the inventory."))
+        elif not interface_allowed(device_info, interface_name):
+            violations.append((device_name, interface_name, f"The specified interface {interface_name} on the Access device {device_name} is not allowed for customer configurations."))
+    return violations
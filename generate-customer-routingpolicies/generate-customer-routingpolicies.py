@@ -1,7 +1,20 @@
 # https://github.com/leofurtadonyc/Network-Automation/wiki
 import os
 import argparse
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+
+BYTECODE_CACHE_DIR = '.template_cache'
+_env = None
+
+def get_environment():
+    """Return a single Jinja2 environment shared by every vendor generator, with compiled templates cached in memory and on disk."""
+    global _env
+    if _env is None:
+        os.makedirs(BYTECODE_CACHE_DIR, exist_ok=True)
+        _env = Environment(loader=FileSystemLoader('templates/'),
+                           bytecode_cache=FileSystemBytecodeCache(BYTECODE_CACHE_DIR),
+                           cache_size=-1, auto_reload=True)
+    return _env
 
 def load_data_from_file(filename):
     """Load data from a specified file."""
@@ -28,8 +41,7 @@ def write_to_file_with_check(filepath, data):
 
 def generate_policies_juniper_junos(asn, customer_name):
     """Generate routing policies for Juniper devices."""
-    env = Environment(loader=FileSystemLoader('templates/'))
-    template = env.get_template('juniper_junos_customer_routing_policy.j2')
+    template = get_environment().get_template('juniper_junos_customer_routing_policy.j2')
     
     as_path_group_name = f"AS{asn}:{customer_name}_ASPATH"
     route_filter_list_ipv4_name = f"AS{asn}:{customer_name}_IMPORT_IPV4"
@@ -51,8 +63,7 @@ def generate_policies_juniper_junos(asn, customer_name):
 
 def generate_policies_cisco_xe(asn, customer_name):
     """Generate routing policies for Cisco IOS XE devices."""
-    env = Environment(loader=FileSystemLoader('templates/'))
-    template = env.get_template('cisco_xe_customer_routing_policy.j2')
+    template = get_environment().get_template('cisco_xe_customer_routing_policy.j2')
     
     # as_path_acl = f"AS{asn}:{customer_name}_ASPATH"
     prefix_list_ipv4_name = f"AS{asn}:{customer_name}_IMPORT_IPV4"
@@ -74,8 +85,7 @@ def generate_policies_cisco_xe(asn, customer_name):
 
 def generate_policies_cisco_xr(asn, customer_name):
     """Generate routing policies for Cisco IOS XR devices."""
-    env = Environment(loader=FileSystemLoader('templates/'))
-    template = env.get_template('cisco_xr_customer_routing_policy.j2')
+    template = get_environment().get_template('cisco_xr_customer_routing_policy.j2')
     
     as_path_set_name = f"AS{asn}:{customer_name}_ASPATH"
     prefix_set_ipv4_name = f"AS{asn}:{customer_name}_IMPORT_IPV4"
@@ -97,8 +107,7 @@ def generate_policies_cisco_xr(asn, customer_name):
 
 def generate_policies_huawei_vrp(asn, customer_name):
     """Generate routing policies for Huawei VRP devices."""
-    env = Environment(loader=FileSystemLoader('templates/'))
-    template = env.get_template('huawei_vrp_customer_routing_policy.j2')
+    template = get_environment().get_template('huawei_vrp_customer_routing_policy.j2')
     
     as_path_filter_name = f"AS{asn}:{customer_name}_ASPATH"
     ip_prefix_name = f"AS{asn}:{customer_name}_IMPORT_IPV4"